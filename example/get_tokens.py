@@ -1,6 +1,5 @@
 """Example to fetch local authentication tokens."""
 
-import json
 from os import getenv
 
 from glocaltokens.client import GLocalAuthenticationTokens
@@ -58,7 +57,5 @@ if __name__ == "__main__":
 
     # Get google device local authentication tokens (live about 1 day)
     print("\n[*] Google devices local authentication tokens")
-    google_devices = client.get_google_devices_json()
-    # Pretty print json data
-    google_devices_str = json.dumps(google_devices, indent=2)
+    google_devices_str = client.get_google_devices_json(indent=2)
     print("[*] Google devices", google_devices_str)
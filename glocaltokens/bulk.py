@@ -0,0 +1,158 @@
+"""Bulk homegraph fetching for many accounts."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import BULK_MAX_IN_FLIGHT, GOOGLE_HOME_FOYER_API
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+        GetHomeGraphRequest,
+    )
+    from ghome_foyer_api.api_pb2_grpc import StructuresServiceStub
+
+    from .client import GLocalAuthenticationTokens
+    from .homegraph import HomegraphDevice
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BulkResult(NamedTuple):
+    """Homegraph devices fetched for a single client."""
+
+    client: GLocalAuthenticationTokens
+    homegraph_devices: tuple[HomegraphDevice, ...] | None
+    error: str | None = None
+
+
+def fetch_homegraphs(
+    clients: Sequence[GLocalAuthenticationTokens],
+    max_in_flight: int = BULK_MAX_IN_FLIGHT,
+    timeout: float | None = None,
+    auth_attempts: int = 3,
+) -> list[BulkResult]:
+    """Fetch the homegraph of many clients concurrently over a single channel.
+
+    Every call is a stream of the same HTTP/2 connection, authenticated with
+    the access token of its own client. At most max_in_flight clients are
+    fetched at once, getting their access token included. Clients with a
+    fresh homegraph are not fetched again, and fetched homegraphs are saved
+    in the token store of their client. The results are in the same order
+    as clients, with the error of failed ones.
+    """
+    # grpc and the Foyer API protobufs are only imported when needed.
+    from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+        GetHomeGraphRequest,
+    )
+    from ghome_foyer_api.api_pb2_grpc import StructuresServiceStub
+    import grpc
+
+    results: dict[int, BulkResult] = {}
+    pending = []
+    for index, client in enumerate(clients):
+        if client.needs_homegraph_refresh():
+            pending.append(index)
+        else:
+            results[index] = BulkResult(client, client.homegraph_devices)
+
+    if pending:
+        LOGGER.debug("Fetching homegraph of %d accounts", len(pending))
+        with grpc.secure_channel(
+            GOOGLE_HOME_FOYER_API, grpc.ssl_channel_credentials()
+        ) as channel:
+            rpc_service = StructuresServiceStub(channel)
+            request = GetHomeGraphRequest(string1="", num2="")
+            for _ in range(auth_attempts):
+                if not pending:
+                    break
+                pending = _fetch_homegraphs(
+                    rpc_service,
+                    request,
+                    clients,
+                    pending,
+                    results,
+                    max_in_flight=max_in_flight,
+                    timeout=timeout,
+                )
+        for index in pending:
+            results[index] = BulkResult(
+                clients[index],
+                None,
+                "Reached maximum number of authentication attempts",
+            )
+    return [results[index] for index in range(len(clients))]
+
+
+def _fetch_homegraphs(
+    rpc_service: StructuresServiceStub,
+    request: GetHomeGraphRequest,
+    clients: Sequence[GLocalAuthenticationTokens],
+    pending: list[int],
+    results: dict[int, BulkResult],
+    *,
+    max_in_flight: int,
+    timeout: float | None,
+) -> list[int]:
+    """Fetch the homegraph of pending clients, storing them in results.
+
+    Every worker gets the access token of its client before starting its
+    call, so token requests overlap with the calls of the other clients.
+    Returns the clients whose access token was rejected, to try again.
+    """
+
+    def fetch(index: int) -> bool:
+        """Fetch the homegraph of a client, return whether to try again."""
+        client = clients[index]
+        result = _fetch_homegraph(rpc_service, request, client, index, timeout)
+        if result is None:
+            return True
+        results[index] = result
+        return False
+
+    with ThreadPoolExecutor(
+        max_workers=max_in_flight, thread_name_prefix="glocaltokens-bulk"
+    ) as executor:
+        retries = list(executor.map(fetch, pending))
+    return [index for index, retry in zip(pending, retries) if retry]
+
+
+def _fetch_homegraph(
+    rpc_service: StructuresServiceStub,
+    request: GetHomeGraphRequest,
+    client: GLocalAuthenticationTokens,
+    index: int,
+    timeout: float | None,
+) -> BulkResult | None:
+    """Fetch the homegraph of a client, None if its access token was rejected.
+
+    Runs in a worker thread.
+    """
+    import grpc
+
+    access_token = client.get_access_token()
+    if not access_token:
+        return BulkResult(client, None, "Unable to obtain access token")
+    call = rpc_service.GetHomeGraph.future(
+        request,
+        timeout=timeout,
+        credentials=grpc.access_token_call_credentials(access_token),
+    )
+    try:
+        response = call.result()
+    except grpc.RpcError as rpc_error:
+        code = rpc_error.code()  # pylint: disable=no-member
+        if code.name == "UNAUTHENTICATED":
+            LOGGER.debug("Access token of account %d has expired", index)
+            client.invalidate_access_token()
+            return None
+        return BulkResult(
+            client,
+            None,
+            f"Received unknown RPC error: code={code} message={rpc_error.details()}",  # pylint: disable=no-member
+        )
+    return BulkResult(client, client.store_homegraph(response))
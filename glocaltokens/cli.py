@@ -0,0 +1,393 @@
+"""Command line interface."""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext, suppress
+import csv
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+import sys
+import time
+from typing import TYPE_CHECKING, NamedTuple, TextIO
+
+from .client import GLocalAuthenticationTokens
+from .const import DISCOVERY_TIMEOUT, SERVER_HOST, SERVER_PORT
+from .transport import AuthTransport
+from .utils.discovery_stats import DiscoveryStats
+from .utils.profiling import TimingReport, profile
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+
+    from .client import Device
+    from .types import NetworkDevice
+
+LOGGER = logging.getLogger(__name__)
+
+OUTPUT_FORMAT_CSV = "csv"
+OUTPUT_FORMAT_NDJSON = "ndjson"
+DISCOVERY_STATS_FILE = "discovery_stats.json"
+CSV_FIELDS = [
+    "account",
+    "device_id",
+    "device_name",
+    "hardware",
+    "ip",
+    "port",
+    "local_auth_token",
+]
+
+
+class Account(NamedTuple):
+    """Google account credentials read from the command line or a file."""
+
+    username: str | None = None
+    password: str | None = None
+    master_token: str | None = None
+    android_id: str | None = None
+
+    @property
+    def digest(self) -> str:
+        """Return a stable non secret hash of the username or master token."""
+        key = self.username or self.master_token or ""
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @property
+    def label(self) -> str:
+        """Return a non secret label identifying the account in the output."""
+        if self.username:
+            return self.username
+        return f"master_token:{self.digest[:12]}"
+
+
+class AccountResult(NamedTuple):
+    """Devices fetched for a single account."""
+
+    account: Account
+    devices: list[Device]
+    timings: dict[str, float]
+    error: str | None = None
+    report: TimingReport | None = None
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser of the glocaltokens command."""
+    parser = argparse.ArgumentParser(
+        prog="glocaltokens",
+        description="Extract Google device local authentication tokens.",
+    )
+    parser.add_argument(
+        "--accounts",
+        type=Path,
+        help="NDJSON file with one account per line "
+        '({"username": ..., "password": ..., "master_token": ..., "android_id": ...}). '
+        "If not set, a single account is read from the options below.",
+    )
+    parser.add_argument("--username", default=os.getenv("GOOGLE_USERNAME"))
+    parser.add_argument("--password", default=os.getenv("GOOGLE_PASSWORD"))
+    parser.add_argument("--master-token", default=os.getenv("GOOGLE_MASTER_TOKEN"))
+    parser.add_argument("--android-id", default=os.getenv("DEVICE_ID"))
+    parser.add_argument(
+        "--format",
+        choices=[OUTPUT_FORMAT_NDJSON, OUTPUT_FORMAT_CSV],
+        default=OUTPUT_FORMAT_NDJSON,
+        help="Output format, one device per line.",
+    )
+    parser.add_argument(
+        "--model",
+        action="append",
+        dest="models",
+        help="Only output devices of this model. Can be repeated.",
+    )
+    parser.add_argument(
+        "--no-discovery",
+        action="store_true",
+        help="Don't look for the devices IP and port in the local network.",
+    )
+    parser.add_argument(
+        "--discovery-timeout",
+        type=float,
+        default=DISCOVERY_TIMEOUT,
+        help="Timeout for zeroconf discovery in seconds. With --cache-dir, it is "
+        "adapted to the response times of past discoveries of the network.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        help="Directory to store homegraph snapshots in. "
+        "Accounts with a fresh snapshot are not fetched again.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Number of accounts processed concurrently.",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="Report per-stage timings of every account on stderr.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Report the duration of every stage of every account on stderr, "
+        "including retries and the resolution of every discovered device.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Keep the clients alive and serve their devices over HTTP, "
+        "refreshing them in the background, instead of printing them once.",
+    )
+    parser.add_argument(
+        "--host",
+        default=SERVER_HOST,
+        help="Address the HTTP server listens on. "
+        "The served tokens are not protected, only listen on trusted interfaces.",
+    )
+    parser.add_argument(
+        "--port", type=int, default=SERVER_PORT, help="Port of the HTTP server."
+    )
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser
+
+
+def load_accounts(path: Path) -> list[Account]:
+    """Load accounts from an NDJSON file, skipping blank lines.
+
+    Raises ValueError or TypeError with the line number of an invalid account.
+    """
+    accounts = []
+    with path.open(encoding="utf-8") as file:
+        for number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as err:
+                raise ValueError(f"{path}:{number}: invalid JSON: {err}") from err
+            if not isinstance(data, dict):
+                raise TypeError(f"{path}:{number}: account must be a JSON object")
+            accounts.append(
+                Account(
+                    username=data.get("username"),
+                    password=data.get("password"),
+                    master_token=data.get("master_token"),
+                    android_id=data.get("android_id"),
+                )
+            )
+    return accounts
+
+
+def cache_path(cache_dir: Path, account: Account) -> Path:
+    """Return the homegraph snapshot path of an account."""
+    return cache_dir / f"{account.digest}.homegraph"
+
+
+def process_account(
+    account: Account,
+    args: argparse.Namespace,
+    network_devices: list[NetworkDevice] | None,
+    transport: AuthTransport | None = None,
+) -> AccountResult:
+    """Fetch the devices of a single account, reporting failures in the result."""
+    try:
+        if not args.profile:
+            return _process_account(account, args, network_devices, transport)
+        with profile() as report:
+            result = _process_account(account, args, network_devices, transport)
+        return result._replace(report=report)
+    except Exception as err:  # pylint: disable=broad-exception-caught  # noqa: BLE001
+        return AccountResult(account, [], {}, f"Unexpected error: {err!r}")
+
+
+def _process_account(
+    account: Account,
+    args: argparse.Namespace,
+    network_devices: list[NetworkDevice] | None,
+    transport: AuthTransport | None,
+) -> AccountResult:
+    """Fetch the devices of a single account."""
+    timings: dict[str, float] = {}
+    client = GLocalAuthenticationTokens(
+        username=account.username,
+        password=account.password,
+        master_token=account.master_token,
+        android_id=account.android_id,
+        verbose=args.verbose,
+        compact_homegraph=True,
+        transport=transport,
+    )
+    snapshot_path = cache_path(args.cache_dir, account) if args.cache_dir else None
+
+    if snapshot_path is not None:
+        start = time.perf_counter()
+        client.load_homegraph(snapshot_path)
+        timings["cache"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    from_cache = client.homegraph_devices is not None
+    homegraph_devices = client.get_homegraph_devices()
+    timings["homegraph"] = time.perf_counter() - start
+    if homegraph_devices is None:
+        return AccountResult(account, [], timings, "Unable to fetch homegraph")
+    if snapshot_path is not None and not from_cache:
+        client.save_homegraph(snapshot_path)
+
+    start = time.perf_counter()
+    devices = client.get_google_devices(
+        models_list=args.models,
+        disable_discovery=args.no_discovery,
+        network_devices=network_devices,
+    )
+    timings["devices"] = time.perf_counter() - start
+    return AccountResult(account, devices, timings)
+
+
+def device_row(account: Account, device: Device) -> dict[str, str | int | None]:
+    """Return the flat output representation of a device."""
+    return {
+        "account": account.label,
+        "device_id": device.device_id,
+        "device_name": device.device_name,
+        "hardware": device.hardware,
+        "ip": device.ip_address,
+        "port": device.port,
+        "local_auth_token": device.local_auth_token,
+    }
+
+
+def write_timings(
+    stream: TextIO, line: dict[str, object], report: TimingReport | None
+) -> None:
+    """Write a timings line, with the stages of the profiling report if any."""
+    if report is not None:
+        line["profile"] = report.as_list()
+    stream.write(json.dumps(line) + "\n")
+
+
+def write_results(
+    results: Iterable[AccountResult],
+    output_format: str,
+    stream: TextIO,
+    timings_stream: TextIO | None = None,
+) -> int:
+    """Write devices of every account as they come and return the failed count."""
+    failed = 0
+    writer = None
+    if output_format == OUTPUT_FORMAT_CSV:
+        writer = csv.DictWriter(stream, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+    for result in results:
+        if result.error:
+            failed += 1
+            LOGGER.error("[%s] %s", result.account.label, result.error)
+        for device in result.devices:
+            row = device_row(result.account, device)
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(row) + "\n")
+        stream.flush()
+        if timings_stream is not None:
+            write_timings(
+                timings_stream,
+                {"account": result.account.label, "timings": result.timings},
+                result.report,
+            )
+    return failed
+
+
+def run_server(accounts: list[Account], args: argparse.Namespace) -> int:
+    """Serve the devices of the accounts until interrupted."""
+    from .server import TokenServer, serve
+
+    with AuthTransport(pool_size=max(args.workers, 1)) as transport:
+        clients = [
+            GLocalAuthenticationTokens(
+                username=account.username,
+                password=account.password,
+                master_token=account.master_token,
+                android_id=account.android_id,
+                verbose=args.verbose,
+                compact_homegraph=True,
+                transport=transport,
+            )
+            for account in accounts
+        ]
+        server = TokenServer(
+            clients,
+            models_list=args.models,
+            disable_discovery=args.no_discovery,
+            discovery_timeout=args.discovery_timeout,
+        )
+        with suppress(KeyboardInterrupt):
+            asyncio.run(serve(server, args.host, args.port))
+    return 0
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    """Run the glocaltokens command."""
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.ERROR)
+
+    if args.accounts:
+        try:
+            accounts = load_accounts(args.accounts)
+        except (OSError, TypeError, ValueError) as err:
+            parser.error(str(err))
+    else:
+        accounts = [
+            Account(args.username, args.password, args.master_token, args.android_id)
+        ]
+    if args.cache_dir:
+        args.cache_dir.mkdir(parents=True, exist_ok=True)
+    if args.serve:
+        return run_server(accounts, args)
+
+    # Discovery is the same for every account, so only run it once.
+    network_devices = None
+    if not args.no_discovery:
+        # zeroconf is only imported when discovery is used.
+        from .scanner import discover_devices
+
+        start = time.perf_counter()
+        with profile() if args.profile else nullcontext() as report:
+            network_devices = discover_devices(
+                args.models,
+                timeout=args.discovery_timeout,
+                stats=DiscoveryStats(args.cache_dir / DISCOVERY_STATS_FILE)
+                if args.cache_dir
+                else None,
+            )
+        if args.timings or args.profile:
+            write_timings(
+                sys.stderr,
+                {"timings": {"discovery": time.perf_counter() - start}},
+                report,
+            )
+
+    # Accounts share auth connections instead of each opening their own.
+    workers = max(args.workers, 1)
+    with ExitStack() as stack:
+        transport = stack.enter_context(AuthTransport(pool_size=workers))
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+        results = executor.map(
+            lambda account: process_account(account, args, network_devices, transport),
+            accounts,
+        )
+        failed = write_results(
+            results,
+            args.format,
+            sys.stdout,
+            sys.stderr if args.timings or args.profile else None,
+        )
+    return 1 if failed else 0
@@ -1,21 +1,17 @@
 """Client."""
 
+# pylint: disable=too-many-lines
+
 from __future__ import annotations
 
 from datetime import datetime
 import json
 import logging
 import random
+from threading import RLock
+import time
 from typing import TYPE_CHECKING
 
-from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
-    GetHomeGraphRequest,
-    GetHomeGraphResponse,
-)
-from ghome_foyer_api.api_pb2_grpc import StructuresServiceStub
-from gpsoauth import perform_master_login, perform_oauth
-import grpc
-
 from .const import (
     ACCESS_TOKEN_APP_NAME,
     ACCESS_TOKEN_CLIENT_SIGNATURE,
@@ -26,19 +22,44 @@ from .const import (
     DISCOVERY_TIMEOUT,
     GOOGLE_HOME_FOYER_API,
     HOMEGRAPH_DURATION,
+    TOKEN_REFRESH_MARGIN,
 )
-from .scanner import NetworkDevice, discover_devices
+from .homegraph import (
+    HomegraphDevice,
+    HomegraphHome,
+    dump_snapshot,
+    load_snapshot,
+    parse_homegraph,
+    project_homegraph,
+    project_topology,
+    read_snapshot,
+    save_snapshot,
+)
+from .index import DeviceIndex
+from .rotation import TokenRotationTracker
+from .types import NetworkDevice
 from .utils import network as net_utils, token as token_utils
-from .utils.logs import censor
-from .utils.network import is_valid_ipv4_address
+from .utils.dns import DNSCache
+from .utils.expiry import Expiry
+from .utils.logs import Censored, InstanceLogger, RateLimitFilter
+from .utils.profiling import timed
 
 if TYPE_CHECKING:
+    from collections.abc import Callable
+    from os import PathLike
+
+    from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+        GetHomeGraphResponse,
+    )
     from zeroconf import Zeroconf
 
+    from .store import TokenStore
+    from .transport import AuthTransport
     from .types import DeviceDict
+    from .utils.discovery_stats import DiscoveryStats
 
-logging.basicConfig(level=logging.ERROR)
 LOGGER = logging.getLogger(__name__)
+LOGGER.addFilter(RateLimitFilter())
 
 
 class Device:
@@ -51,10 +72,20 @@ class Device:
         local_auth_token: str,
         network_device: NetworkDevice | None = None,
         hardware: str | None = None,
+        logger: logging.Logger | InstanceLogger = LOGGER,
     ):
-        """Initialize a Device."""
-        log_prefix = f"[Device - {device_name}(id={device_id})]"
-        LOGGER.debug("%s Initializing new Device instance", log_prefix)
+        """Initialize a Device.
+
+        logger: Logger of the client creating the device, to log at its level.
+        """
+        # Many devices are created at once, skip building debug records early.
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                "[Device - %s(id=%s)] Initializing new Device instance",
+                device_name,
+                device_id,
+            )
         self.device_id = device_id
         self.device_name = device_name
         self.local_auth_token = None
@@ -63,21 +94,30 @@ class Device:
 
         # Token and name validations
         if not self.device_name:
-            LOGGER.error("%s device_name must be provided", log_prefix)
+            logger.error(
+                "[Device - %s(id=%s)] device_name must be provided",
+                device_name,
+                device_id,
+            )
             return
         if not token_utils.is_local_auth_token(local_auth_token):
-            LOGGER.warning(
-                "%s local_auth_token does not follow Google Home token format. "
-                "Ignore for non-Google Home devices",
-                log_prefix,
+            logger.warning(
+                "[Device - %s(id=%s)] local_auth_token does not follow "
+                "Google Home token format. Ignore for non-Google Home devices",
+                device_name,
+                device_id,
             )
             return
 
         # Setting IP and PORT
         if network_device:
-            LOGGER.debug(
-                "%s network_device is provided, using its IP and PORT", log_prefix
-            )
+            if debug:
+                logger.debug(
+                    "[Device - %s(id=%s)] network_device is provided, "
+                    "using its IP and PORT",
+                    device_name,
+                    device_id,
+                )
             self.ip_address: str | None = network_device.ip_address
             self.port: int | None = network_device.port
         else:
@@ -90,24 +130,36 @@ class Device:
             and not net_utils.is_valid_ipv4_address(self.ip_address)
             and not net_utils.is_valid_ipv6_address(self.ip_address)
         ):
-            LOGGER.error("%s IP(%s) is invalid", log_prefix, self.ip_address)
+            logger.error(
+                "[Device - %s(id=%s)] IP(%s) is invalid",
+                device_name,
+                device_id,
+                self.ip_address,
+            )
             return
 
         if self.port and not net_utils.is_valid_port(self.port):
-            LOGGER.error("%s PORT(%s) is invalid", log_prefix, self.port)
+            logger.error(
+                "[Device - %s(id=%s)] PORT(%s) is invalid",
+                device_name,
+                device_id,
+                self.port,
+            )
             return
 
-        LOGGER.debug(
-            '%s Set device_name to "%s", '
-            'local_auth_token to "%s", '
-            'IP to "%s", PORT to "%s" and hardware to "%s"',
-            log_prefix,
-            device_name,
-            censor(local_auth_token),
-            self.ip_address,
-            self.port,
-            hardware,
-        )
+        if debug:
+            logger.debug(
+                '[Device - %s(id=%s)] Set device_name to "%s", '
+                'local_auth_token to "%s", '
+                'IP to "%s", PORT to "%s" and hardware to "%s"',
+                device_name,
+                device_id,
+                device_name,
+                Censored(local_auth_token),
+                self.ip_address,
+                self.port,
+                hardware,
+            )
         self.local_auth_token = local_auth_token
 
     def __str__(self) -> str:
@@ -138,6 +190,12 @@ class GLocalAuthenticationTokens:
         master_token: str | None = None,
         android_id: str | None = None,
         verbose: bool = False,
+        compact_homegraph: bool = False,
+        transport: AuthTransport | None = None,
+        store: TokenStore | None = None,
+        dns_cache: DNSCache | None = None,
+        discovery_stats: DiscoveryStats | None = None,
+        memory_callback: Callable[[GLocalAuthenticationTokens], None] | None = None,
     ):
         """Initialize a GLocalAuthenticationTokens instance with Google account credentials.
 
@@ -146,12 +204,32 @@ class GLocalAuthenticationTokens:
             password: Google account password (can be an app password);
             master_token: Google master token (instead of username/password combination);
             android_id: The ID of an Android device. Will be randomly generated if not set;
-            verbose: Whether or not to print debug logging information.
+            verbose: Whether or not to print debug logging information;
+            compact_homegraph: Only keep a compact projection of the homegraph
+              devices (and the serialized response) instead of the full
+              GetHomeGraphResponse message. Reduces memory for large accounts.
+            transport: AuthTransport used for all auth requests, share one
+              between clients to reuse connections. If not set, gpsoauth opens
+              a new connection for every request.
+            store: TokenStore shared with the clients of other processes, so
+              tokens and the homegraph of the account are only fetched once.
+            dns_cache: DNSCache resolving the host names of static addresses,
+              share one between clients to resolve each name once.
+            discovery_stats: DiscoveryStats adapting the discovery window to
+              the response times of past discoveries of the network.
+            memory_callback: Called with the client when the homegraph is
+              stored or dropped, to keep track of its memory_size. It is
+              called while holding the homegraph lock.
         """
         self.logging_level = logging.DEBUG if verbose else logging.ERROR
-        LOGGER.setLevel(self.logging_level)
+        self.logger = InstanceLogger(LOGGER, self.logging_level)
+        # The access and master tokens, and the homegraph, are guarded by
+        # separate locks so instances can be shared between threads. The
+        # homegraph lock is always acquired first.
+        self._token_lock = RLock()
+        self._homegraph_lock = RLock()
 
-        LOGGER.debug("Initializing new GLocalAuthenticationTokens instance.")
+        self.logger.debug("Initializing new GLocalAuthenticationTokens instance.")
 
         self.username: str | None = username
         self.password: str | None = password
@@ -159,32 +237,52 @@ class GLocalAuthenticationTokens:
         self.android_id: str | None = android_id
         self.access_token: str | None = None
         self.access_token_date: datetime | None = None
+        self.access_token_expiry: Expiry | None = None
+        self.compact_homegraph = compact_homegraph
+        self.transport = transport
+        self.store = store
+        self.dns_cache = dns_cache if dns_cache is not None else DNSCache()
+        self.discovery_stats = discovery_stats
+        self.memory_callback = memory_callback
+        self._homegraph_size = 0
+        self._rejected_access_token: str | None = None
+        self._homegraph_generation: str | None = None
+        self._auth_failure_time: float | None = None
         self.homegraph: GetHomeGraphResponse | None = None
+        self.homegraph_devices: tuple[HomegraphDevice, ...] | None = None
+        self.homegraph_topology: tuple[HomegraphHome, ...] | None = None
         self.homegraph_date: datetime | None = None
-        LOGGER.debug(
+        self.homegraph_expiry: Expiry | None = None
+        self._homegraph_raw: bytes | None = None
+        self.token_rotations = TokenRotationTracker()
+        self._network_devices: dict[str, NetworkDevice] = {}
+        self._addresses: dict[str, str] = {}
+        self._device_index: DeviceIndex | None = None
+        self._device_index_source: tuple[HomegraphDevice, ...] | None = None
+        self.logger.debug(
             "Set GLocalAuthenticationTokens client access_token, homegraph, "
             "access_token_date and homegraph_date to None"
         )
 
-        LOGGER.debug(
+        self.logger.debug(
             "Set GLocalAuthenticationTokens client "
             'username to "%s", password to "%s", '
             'master_token to "%s" and android_id to %s',
-            censor(username, hide_length=True),
-            censor(password, hide_length=True, hide_first_letter=True),
-            censor(master_token),
-            censor(android_id),
+            Censored(username, hide_length=True),
+            Censored(password, hide_length=True, hide_first_letter=True),
+            Censored(master_token),
+            Censored(android_id),
         )
 
         # Validation
         if (not self.username or not self.password) and not self.master_token:
-            LOGGER.error(
+            self.logger.error(
                 "You must either provide google username/password "
                 "or google master token"
             )
             return
         if self.master_token and not token_utils.is_aas_et(self.master_token):
-            LOGGER.error("master_token doesn't follow the AAS_ET format")
+            self.logger.error("master_token doesn't follow the AAS_ET format")
             return
 
     @staticmethod
@@ -199,155 +297,526 @@ class GLocalAuthenticationTokens:
 
     def get_android_id(self) -> str:
         """Return existing or generate android id."""
-        if not self.android_id:
-            LOGGER.debug("There is no stored android_id, generating a new one")
-            self.android_id = self._generate_android_id()
-        return self.android_id
-
-    @staticmethod
-    def _has_expired(creation_dt: datetime, duration: int) -> bool:
-        """Check if an specified token/object has expired."""
-        return datetime.now().timestamp() - creation_dt.timestamp() > duration
+        with self._token_lock:
+            if not self.android_id:
+                self.logger.debug("There is no stored android_id, generating a new one")
+                self.android_id = self._generate_android_id()
+            return self.android_id
 
     @staticmethod
     def _escape_username(username: str) -> str:
         """Escape plus sign for some exotic accounts."""
         return username.replace("+", "%2B")
 
-    def get_master_token(self) -> str | None:
-        """Get google master token from username and password."""
-        if self.username is None or self.password is None:
-            LOGGER.error("Username and password are not set.")
-            return None
+    def _perform_master_login(
+        self, email: str, password: str, android_id: str
+    ) -> dict[str, str]:
+        """Perform a master login through the transport, or gpsoauth if not set."""
+        if self.transport is not None:
+            return self.transport.perform_master_login(email, password, android_id)
+        # gpsoauth and its crypto stack are only imported when needed.
+        from gpsoauth import perform_master_login
 
-        if not self.master_token:
-            LOGGER.debug(
-                "There is no stored master_token, "
-                "logging in using username and password"
-            )
-            res = {}
-            try:
-                res = perform_master_login(
-                    self._escape_username(self.username),
-                    self.password,
-                    self.get_android_id(),
-                )
-            except ValueError:
-                LOGGER.exception(
-                    "A ValueError exception has been thrown, this usually is related"
-                    "to a password length that exceeds the boundaries (too long)."
-                )
-            if "Token" not in res:
-                LOGGER.error("[!] Could not get master token.")
-                LOGGER.debug("Request response: %s", res)
-                return None
-            self.master_token = res["Token"]
-        LOGGER.debug("Master token: %s", censor(self.master_token))
-        return self.master_token
+        return perform_master_login(email, password, android_id)
 
-    def get_access_token(self) -> str | None:
-        """Return existing or fetch access_token."""
-        if (
-            self.access_token is None
-            or self.access_token_date is None
-            or self._has_expired(self.access_token_date, ACCESS_TOKEN_DURATION)
-        ):
-            LOGGER.debug(
-                "There is no access_token stored, "
-                "or it has expired, getting a new one..."
-            )
-            master_token = self.get_master_token()
-            if master_token is None:
-                LOGGER.debug("Unable to obtain master token.")
-                return None
-            if self.username is None:
-                LOGGER.error("Username is not set.")
-                return None
-            res = perform_oauth(
-                self._escape_username(self.username),
+    def _perform_oauth(
+        self, email: str, master_token: str, android_id: str
+    ) -> dict[str, str]:
+        """Request an access token through the transport, or gpsoauth if not set."""
+        if self.transport is not None:
+            return self.transport.perform_oauth(
+                email,
                 master_token,
-                self.get_android_id(),
-                app=ACCESS_TOKEN_APP_NAME,
+                android_id,
                 service=ACCESS_TOKEN_SERVICE,
+                app=ACCESS_TOKEN_APP_NAME,
                 client_sig=ACCESS_TOKEN_CLIENT_SIGNATURE,
             )
-            if "Auth" not in res:
-                LOGGER.error("[!] Could not get access token.")
-                LOGGER.debug("Request response: %s", res)
+        from gpsoauth import perform_oauth
+
+        return perform_oauth(
+            email,
+            master_token,
+            android_id,
+            app=ACCESS_TOKEN_APP_NAME,
+            service=ACCESS_TOKEN_SERVICE,
+            client_sig=ACCESS_TOKEN_CLIENT_SIGNATURE,
+        )
+
+    def get_master_token(self) -> str | None:
+        """Get google master token from username and password."""
+        with self._token_lock:
+            if self.username is None or self.password is None:
+                self.logger.error("Username and password are not set.")
                 return None
-            self.access_token = res["Auth"]
-            self.access_token_date = datetime.now()
-        LOGGER.debug(
-            "Access token: %s, datetime %s",
-            censor(self.access_token),
-            self.access_token_date,
+
+            if not self.master_token:
+                self.logger.debug(
+                    "There is no stored master_token, "
+                    "logging in using username and password"
+                )
+                res = {}
+                try:
+                    with timed("master_login"):
+                        res = self._perform_master_login(
+                            self._escape_username(self.username),
+                            self.password,
+                            self.get_android_id(),
+                        )
+                except ValueError:
+                    self.logger.exception(
+                        "A ValueError exception has been thrown, this usually is related"
+                        "to a password length that exceeds the boundaries (too long)."
+                    )
+                if "Token" not in res:
+                    self.logger.error("[!] Could not get master token.")
+                    self.logger.debug("Request response: %s", res)
+                    return None
+                self.master_token = res["Token"]
+            self.logger.debug("Master token: %s", Censored(self.master_token))
+            return self.master_token
+
+    def _access_token_needs_refresh(self) -> bool:
+        """Check if the access token is missing or expires soon."""
+        return (
+            self.access_token is None
+            or self.access_token_expiry is None
+            or self.access_token_expiry.has_expired(TOKEN_REFRESH_MARGIN)
         )
-        return self.access_token
+
+    def _store_key(self) -> str | None:
+        """Return the key of the account in the token store."""
+        return token_utils.account_key(self.username, self.master_token)
+
+    def get_access_token(self) -> str | None:
+        """Return existing or fetch access_token.
+
+        A new access token is fetched when the stored one expires within
+        TOKEN_REFRESH_MARGIN seconds. The lifetime is taken from the oauth
+        response, falling back to ACCESS_TOKEN_DURATION.
+
+        With a token store, the token fetched by another process is used if
+        it is still valid, and a fetched token is saved for the others.
+        """
+        with self._token_lock:
+            key = self._store_key()
+            if (
+                self.store is None
+                or key is None
+                or not self._access_token_needs_refresh()
+            ):
+                return self._get_access_token()
+            with self.store.lock(f"{key}:access_token"):
+                self._load_shared_access_token(self.store, key)
+                fetch = self._access_token_needs_refresh()
+                access_token = self._get_access_token()
+                if fetch and access_token is not None:
+                    self._share_access_token(self.store, key)
+                return access_token
+
+    def _load_shared_access_token(self, store: TokenStore, key: str) -> None:
+        """Use the access token saved in the store, unless it expires soon."""
+        shared = store.get_access_token(key)
+        if shared is None or shared.access_token == self._rejected_access_token:
+            return
+        lifetime = shared.expires_at - time.time()
+        if lifetime <= TOKEN_REFRESH_MARGIN:
+            return
+        if shared.master_token and not self.master_token:
+            self.master_token = shared.master_token
+        self.access_token = shared.access_token
+        self.access_token_date = datetime.now()
+        self.access_token_expiry = Expiry.in_seconds(lifetime)
+        self.logger.debug("Using shared access token, expires in %ds", lifetime)
+
+    def _share_access_token(self, store: TokenStore, key: str) -> None:
+        """Save the access token, and the master token, in the store."""
+        if self.access_token is None or self.access_token_expiry is None:
+            return
+        store.save_access_token(
+            key,
+            self.master_token,
+            self.access_token,
+            time.time() + self.access_token_expiry.remaining(),
+        )
+
+    def _get_access_token(self) -> str | None:
+        """Return existing or fetch access_token, without the token store."""
+        with self._token_lock:
+            if self._access_token_needs_refresh():
+                self.logger.debug(
+                    "There is no access_token stored, "
+                    "or it has expired, getting a new one..."
+                )
+                master_token = self.get_master_token()
+                if master_token is None:
+                    self.logger.debug("Unable to obtain master token.")
+                    return None
+                if self.username is None:
+                    self.logger.error("Username is not set.")
+                    return None
+                with timed("oauth"):
+                    res = self._perform_oauth(
+                        self._escape_username(self.username),
+                        master_token,
+                        self.get_android_id(),
+                    )
+                if "Auth" not in res:
+                    self.logger.error("[!] Could not get access token.")
+                    self.logger.debug("Request response: %s", res)
+                    return None
+                self.access_token = res["Auth"]
+                self.access_token_date = datetime.now()
+                lifetime = token_utils.oauth_lifetime(res, ACCESS_TOKEN_DURATION)
+                self.access_token_expiry = Expiry.in_seconds(lifetime)
+                self.logger.debug("Access token expires in %ds", lifetime)
+            self.logger.debug(
+                "Access token: %s, datetime %s",
+                Censored(self.access_token),
+                self.access_token_date,
+            )
+            return self.access_token
+
+    def _homegraph_needs_refresh(self) -> bool:
+        """Check if the stored homegraph is missing, expired or has a stale token.
+
+        A token is stale if its device reported an auth failure or it is
+        about to rotate.
+        """
+        return (
+            self.homegraph_devices is None
+            or self.homegraph_expiry is None
+            or self.homegraph_expiry.has_expired(TOKEN_REFRESH_MARGIN)
+            or self.token_rotations.needs_refresh(TOKEN_REFRESH_MARGIN)
+        )
+
+    def _store_homegraph(
+        self,
+        homegraph: GetHomeGraphResponse,
+        fetched_at: datetime | None = None,
+        lifetime: float | None = None,
+    ) -> None:
+        """Store the homegraph, its compact projection and its topology.
+
+        Unless given, the lifetime is the shortest observed token rotation
+        interval, or HOMEGRAPH_DURATION while rotations are still unknown.
+        """
+        self.homegraph_devices = project_homegraph(homegraph)
+        self.homegraph_topology = project_topology(homegraph, self.homegraph_devices)
+        self.token_rotations.observe(self.homegraph_devices)
+        if lifetime is None:
+            lifetime = self.token_rotations.shortest_interval() or HOMEGRAPH_DURATION
+        if self.compact_homegraph:
+            self.homegraph = None
+            self._homegraph_raw = homegraph.SerializeToString()
+        else:
+            self.homegraph = homegraph
+            self._homegraph_raw = None
+        self.homegraph_date = fetched_at or datetime.now()
+        self.homegraph_expiry = Expiry.in_seconds(lifetime)
+        self._homegraph_resized()
+
+    def _homegraph_resized(self) -> None:
+        """Measure the stored homegraph again and report its new size."""
+        size = len(self._homegraph_raw or b"")
+        if self.homegraph is not None:
+            size += self.homegraph.ByteSize()
+        for device in self.homegraph_devices or ():
+            size += sum(map(len, device))
+        self._homegraph_size = size
+        if self.memory_callback is not None:
+            self.memory_callback(self)
+
+    def needs_homegraph_refresh(self) -> bool:
+        """Check if the stored homegraph must be fetched again."""
+        with self._homegraph_lock:
+            return self._homegraph_needs_refresh()
+
+    def store_homegraph(
+        self, homegraph: GetHomeGraphResponse
+    ) -> tuple[HomegraphDevice, ...] | None:
+        """Store a homegraph fetched by the caller and return its devices.
+
+        With a token store, the homegraph is also saved for other processes.
+        """
+        with self._homegraph_lock:
+            self._store_homegraph(homegraph)
+            key = self._store_key()
+            if self.store is not None and key is not None:
+                self._share_homegraph(self.store, key, homegraph)
+            return self.homegraph_devices
 
     def get_homegraph(self, auth_attempts: int = 3) -> GetHomeGraphResponse | None:
-        """Return the entire Google Home Foyer V2 service."""
+        """Return the entire Google Home Foyer V2 service.
+
+        With compact_homegraph enabled, the stored response is parsed again
+        on every call, so prefer get_homegraph_devices when possible.
+
+        With a token store, the homegraph fetched by another process is used
+        if it is still valid, and a fetched homegraph is saved for the others.
+        """
+        with self._homegraph_lock:
+            key = self._store_key()
+            if self.store is None or key is None or not self._homegraph_needs_refresh():
+                return self._get_homegraph(auth_attempts)
+            with self.store.lock(f"{key}:homegraph"):
+                self._load_shared_homegraph(self.store, key)
+                fetch = self._homegraph_needs_refresh()
+                response = self._get_homegraph(auth_attempts)
+                if fetch and response is not None:
+                    self._share_homegraph(self.store, key, response)
+                return response
+
+    def _load_shared_homegraph(self, store: TokenStore, key: str) -> None:
+        """Use the homegraph saved in the store if it is newer and still valid."""
+        shared = store.get_homegraph(key)
+        if shared is None or shared.generation == self._homegraph_generation:
+            return
+        lifetime = shared.expires_at - time.time()
+        if lifetime <= TOKEN_REFRESH_MARGIN:
+            return
+        try:
+            snapshot = load_snapshot(shared.snapshot)
+        except ValueError as err:
+            self.logger.warning("Ignoring shared homegraph: %s", err)
+            return
         if (
-            self.homegraph is None
-            or self.homegraph_date is None
-            or self._has_expired(self.homegraph_date, HOMEGRAPH_DURATION)
+            self._auth_failure_time is not None
+            and snapshot.fetched_at.timestamp() <= self._auth_failure_time
         ):
-            if auth_attempts == 0:
-                LOGGER.error("Reached maximum number of authentication attempts")
+            # Fetched before a device rejected its token, so it is as stale.
+            return
+        self._store_homegraph(
+            snapshot.homegraph, fetched_at=snapshot.fetched_at, lifetime=lifetime
+        )
+        self._homegraph_generation = shared.generation
+        self._auth_failure_time = None
+        self.logger.debug("Using shared homegraph fetched at %s", snapshot.fetched_at)
+
+    def _share_homegraph(
+        self, store: TokenStore, key: str, homegraph: GetHomeGraphResponse
+    ) -> None:
+        """Save the homegraph in the store."""
+        if self.homegraph_date is None or self.homegraph_expiry is None:
+            return
+        self._homegraph_generation = store.save_homegraph(
+            key,
+            dump_snapshot(homegraph, self.homegraph_date),
+            time.time() + self.homegraph_expiry.remaining(),
+        )
+        self._auth_failure_time = None
+
+    def _get_homegraph(self, auth_attempts: int) -> GetHomeGraphResponse | None:
+        """Return the stored or fetch the homegraph, without the token store."""
+        with self._homegraph_lock:
+            if self._homegraph_needs_refresh():
+                if auth_attempts == 0:
+                    self.logger.error(
+                        "Reached maximum number of authentication attempts"
+                    )
+                    return None
+                self.logger.debug(
+                    "There is no stored homegraph, or it has expired, getting a new one..."
+                )
+                # grpc and the Foyer API protobufs are slow to import, so they are
+                # only imported when the homegraph has to be fetched.
+                from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+                    GetHomeGraphRequest,
+                )
+                from ghome_foyer_api.api_pb2_grpc import StructuresServiceStub
+                import grpc
+
+                log_prefix = "[GRPC]"
+                access_token = self.get_access_token()
+                if not access_token:
+                    self.logger.debug("%s Unable to obtain access token.", log_prefix)
+                    return None
+                try:
+                    with timed("channel"):
+                        self.logger.debug(
+                            "%s Creating SSL channel credentials...", log_prefix
+                        )
+                        scc = grpc.ssl_channel_credentials(root_certificates=None)
+                        self.logger.debug(
+                            "%s Creating access token call credentials...", log_prefix
+                        )
+                        tok = grpc.access_token_call_credentials(access_token)
+                        self.logger.debug(
+                            "%s Compositing channel credentials...", log_prefix
+                        )
+                        channel_credentials = grpc.composite_channel_credentials(
+                            scc, tok
+                        )
+
+                        self.logger.debug(
+                            "%s Establishing secure channel with the Google Home Foyer API...",
+                            log_prefix,
+                        )
+                        channel = grpc.secure_channel(
+                            GOOGLE_HOME_FOYER_API, channel_credentials
+                        )
+                    with channel:
+                        self.logger.debug(
+                            "%s Getting channels StructuresServiceStub...", log_prefix
+                        )
+                        rpc_service = StructuresServiceStub(channel)
+                        self.logger.debug("%s Getting HomeGraph request...", log_prefix)
+                        request = GetHomeGraphRequest(string1="", num2="")
+                        self.logger.debug("%s Fetching HomeGraph...", log_prefix)
+                        with timed("get_homegraph", f"auth_attempts={auth_attempts}"):
+                            response = rpc_service.GetHomeGraph(request)
+                        self.logger.debug(
+                            "%s Storing obtained HomeGraph...", log_prefix
+                        )
+                        self._store_homegraph(response)
+                except grpc.RpcError as rpc_error:
+                    self.logger.debug("%s Got an RpcError", log_prefix)
+                    if (
+                        rpc_error.code().name  # pylint: disable=no-member
+                        == "UNAUTHENTICATED"
+                    ):
+                        self.logger.warning(
+                            "%s The access token has expired. Getting a new one.",
+                            log_prefix,
+                        )
+                        self.invalidate_access_token()
+                        return self._get_homegraph(auth_attempts - 1)
+                    self.logger.exception(
+                        "%s Received unknown RPC error: code=%s message=%s",
+                        log_prefix,
+                        rpc_error.code(),  # pylint: disable=no-member
+                        rpc_error.details(),  # pylint: disable=no-member
+                    )
+                    return None
+                return response
+            return self._stored_homegraph()
+
+    def _stored_homegraph(self) -> GetHomeGraphResponse | None:
+        """Return the stored homegraph, parsing the serialized one if needed."""
+        if self.homegraph is None and self._homegraph_raw is not None:
+            return parse_homegraph(self._homegraph_raw)
+        return self.homegraph
+
+    def get_homegraph_devices(
+        self, auth_attempts: int = 3
+    ) -> tuple[HomegraphDevice, ...] | None:
+        """Return the compact projection of the homegraph devices."""
+        with self._homegraph_lock:
+            if (
+                self._homegraph_needs_refresh()
+                and self.get_homegraph(auth_attempts) is None
+            ):
                 return None
-            LOGGER.debug(
-                "There is no stored homegraph, or it has expired, getting a new one..."
-            )
-            log_prefix = "[GRPC]"
-            access_token = self.get_access_token()
-            if not access_token:
-                LOGGER.debug("%s Unable to obtain access token.", log_prefix)
+            return self.homegraph_devices
+
+    def get_homegraph_topology(
+        self, auth_attempts: int = 3
+    ) -> tuple[HomegraphHome, ...] | None:
+        """Return the homes of the homegraph with their rooms and devices.
+
+        The topology is built once per homegraph fetch.
+        """
+        with self._homegraph_lock:
+            if (
+                self._homegraph_needs_refresh()
+                and self.get_homegraph(auth_attempts) is None
+            ):
                 return None
+            return self.homegraph_topology
+
+    def save_homegraph(self, path: str | PathLike[str]) -> bool:
+        """Save the stored homegraph as a binary snapshot file.
+
+        Nothing is fetched from the network; returns False if there is no
+        stored homegraph or the file can't be written.
+        """
+        with self._homegraph_lock:
+            homegraph = self._stored_homegraph()
+            if homegraph is None or self.homegraph_date is None:
+                self.logger.error("There is no stored homegraph to save")
+                return False
             try:
-                LOGGER.debug("%s Creating SSL channel credentials...", log_prefix)
-                scc = grpc.ssl_channel_credentials(root_certificates=None)
-                LOGGER.debug("%s Creating access token call credentials...", log_prefix)
-                tok = grpc.access_token_call_credentials(access_token)
-                LOGGER.debug("%s Compositing channel credentials...", log_prefix)
-                channel_credentials = grpc.composite_channel_credentials(scc, tok)
-
-                LOGGER.debug(
-                    "%s Establishing secure channel with the Google Home Foyer API...",
-                    log_prefix,
+                save_snapshot(path, homegraph, self.homegraph_date)
+            except OSError:
+                self.logger.exception("Unable to save homegraph snapshot to %s", path)
+                return False
+            self.logger.debug("Saved homegraph snapshot to %s", path)
+            return True
+
+    def load_homegraph(
+        self, path: str | PathLike[str], max_age: int = HOMEGRAPH_DURATION
+    ) -> bool:
+        """Load a homegraph snapshot saved with save_homegraph without network.
+
+        path: The snapshot file.
+        max_age: Maximum age of the snapshot in seconds. Older snapshots, or
+          snapshots from the future, are rejected.
+        """
+        with self._homegraph_lock:
+            try:
+                snapshot = read_snapshot(path)
+            except (OSError, ValueError) as err:
+                self.logger.warning(
+                    "Unable to load homegraph snapshot from %s: %s", path, err
                 )
-                with grpc.secure_channel(
-                    GOOGLE_HOME_FOYER_API, channel_credentials
-                ) as channel:
-                    LOGGER.debug(
-                        "%s Getting channels StructuresServiceStub...", log_prefix
-                    )
-                    rpc_service = StructuresServiceStub(channel)
-                    LOGGER.debug("%s Getting HomeGraph request...", log_prefix)
-                    request = GetHomeGraphRequest(string1="", num2="")
-                    LOGGER.debug("%s Fetching HomeGraph...", log_prefix)
-                    response = rpc_service.GetHomeGraph(request)
-                    LOGGER.debug("%s Storing obtained HomeGraph...", log_prefix)
-                    self.homegraph = response
-                self.homegraph_date = datetime.now()
-            except grpc.RpcError as rpc_error:
-                LOGGER.debug("%s Got an RpcError", log_prefix)
-                if (
-                    rpc_error.code().name  # pylint: disable=no-member
-                    == "UNAUTHENTICATED"
-                ):
-                    LOGGER.warning(
-                        "%s The access token has expired. Getting a new one.",
-                        log_prefix,
-                    )
-                    self.invalidate_access_token()
-                    return self.get_homegraph(auth_attempts - 1)
-                LOGGER.exception(
-                    "%s Received unknown RPC error: code=%s message=%s",
-                    log_prefix,
-                    rpc_error.code(),  # pylint: disable=no-member
-                    rpc_error.details(),  # pylint: disable=no-member
+                return False
+            age = datetime.now().timestamp() - snapshot.fetched_at.timestamp()
+            if not 0 <= age <= min(max_age, HOMEGRAPH_DURATION):
+                self.logger.warning(
+                    "Homegraph snapshot %s is out of date (fetched at %s), ignoring",
+                    path,
+                    snapshot.fetched_at,
                 )
-                return None
-        return self.homegraph
+                return False
+            self._store_homegraph(
+                snapshot.homegraph,
+                fetched_at=snapshot.fetched_at,
+                lifetime=HOMEGRAPH_DURATION - age,
+            )
+            self.logger.debug(
+                "Loaded homegraph snapshot from %s fetched at %s",
+                path,
+                snapshot.fetched_at,
+            )
+            return True
+
+    def _discover_network_devices(
+        self,
+        models_list: list[str],
+        disable_discovery: bool,
+        zeroconf_instance: Zeroconf | None,
+        discovery_timeout: float,
+        homegraph_devices: tuple[HomegraphDevice, ...],
+    ) -> list[NetworkDevice]:
+        """Discover network devices unless discovery is disabled.
+
+        Only the devices of the homegraph are resolved, and discovery stops
+        as soon as all of them are found.
+        """
+        if disable_discovery:
+            return []
+        # zeroconf is only imported when discovery is used.
+        from .scanner import discover_devices
+
+        self.logger.debug("Automatically discovering network devices...")
+        unique_ids = {
+            item.unique_id
+            for item in homegraph_devices
+            if item.unique_id
+            and item.local_auth_token
+            and (not models_list or item.model in models_list)
+        }
+        if not unique_ids:
+            return []
+        return discover_devices(
+            models_list,
+            timeout=discovery_timeout,
+            zeroconf_instance=zeroconf_instance,
+            logging_level=self.logging_level,
+            unique_ids=unique_ids,
+            max_devices=len(unique_ids),
+            stats=self.discovery_stats,
+        )
 
     def get_google_devices(
         self,
@@ -356,7 +825,8 @@ class GLocalAuthenticationTokens:
         addresses: dict[str, str] | None = None,
         zeroconf_instance: Zeroconf | None = None,
         force_homegraph_reload: bool = False,
-        discovery_timeout: int = DISCOVERY_TIMEOUT,
+        discovery_timeout: float = DISCOVERY_TIMEOUT,
+        network_devices: list[NetworkDevice] | None = None,
     ) -> list[Device]:
         """Return a list of Google devices with their local authentication tokens, IP, and ports.
 
@@ -364,118 +834,224 @@ class GLocalAuthenticationTokens:
         disable_discovery: Whether or not the device's IP and port should
           be searched for in the network.
         addresses: Dict of network devices from the local network
-          ({"name": "ip_address"}). If set to `None` will try to automatically
+          ({"name": "ip_address"}), with IPv4 or IPv6 addresses or host names
+          resolved through the DNS cache. If set to `None` will try to automatically
           discover network devices. Disable discovery by setting to `{}`.
         zeroconf_instance: If you already have an initialized zeroconf instance,
           use it here.
         force_homegraph_reload: If the stored homegraph should be generated again.
         discovery_timeout: Timeout for zeroconf discovery in seconds.
+        network_devices: Already discovered network devices to match against.
+          When set, discovery is not run again, so a single discovery can be
+          shared between several accounts.
         """
 
         # Set models_list to empty list if None
-        LOGGER.debug("Initializing models list if empty...")
+        self.logger.debug("Initializing models list if empty...")
         models_list = models_list if models_list else []
 
         if force_homegraph_reload:
-            LOGGER.debug("Forcing homegraph reload")
+            self.logger.debug("Forcing homegraph reload")
             self.invalidate_homegraph()
 
-        LOGGER.debug("Getting homegraph...")
-        homegraph = self.get_homegraph()
+        self.logger.debug("Getting homegraph...")
+        homegraph_devices = self.get_homegraph_devices()
 
         devices: list[Device] = []
 
-        def is_dict_with_valid_ipv4_addresses(data: dict[str, str]) -> bool:
+        def is_dict_with_valid_addresses(data: dict[str, str]) -> bool:
             # Validate the data structure is correct and that each entry contains a
-            # valid IPv4 address.
+            # valid IPv4 or IPv6 address, or host name.
             return isinstance(data, dict) and all(
-                isinstance(x, str) and is_valid_ipv4_address(x) for x in data.values()
+                isinstance(x, str)
+                and (
+                    net_utils.is_valid_ipv4_address(x)
+                    or net_utils.is_valid_ipv6_address(x)
+                    or net_utils.is_valid_hostname(x)
+                )
+                for x in data.values()
             )
 
-        if addresses and not is_dict_with_valid_ipv4_addresses(addresses):
-            LOGGER.error(
+        if addresses and not is_dict_with_valid_addresses(addresses):
+            self.logger.error(
                 "Invalid dictionary structure for addresses dictionary "
-                "argument. Correct structure is {'device_name': 'ipaddress'}"
+                "argument. Correct structure is {'device_name': 'address'}, "
+                "with IP addresses or host names"
             )
             return devices
 
-        if homegraph is None:
-            LOGGER.debug("Failed to fetch homegraph")
+        if homegraph_devices is None:
+            self.logger.debug("Failed to fetch homegraph")
             return devices
 
-        network_devices: list[NetworkDevice] = []
-        if disable_discovery is False:
-            LOGGER.debug("Automatically discovering network devices...")
-            network_devices = discover_devices(
-                models_list,
-                timeout=discovery_timeout,
-                zeroconf_instance=zeroconf_instance,
-                logging_level=self.logging_level,
-            )
+        if network_devices is None:
+            with timed("discovery"):
+                network_devices = self._discover_network_devices(
+                    models_list,
+                    disable_discovery,
+                    zeroconf_instance,
+                    discovery_timeout,
+                    homegraph_devices,
+                )
+
+        return self._join_devices(
+            homegraph_devices, models_list, network_devices, addresses
+        )
+
+    def join_devices(
+        self,
+        network_devices: list[NetworkDevice],
+        models_list: list[str] | None = None,
+    ) -> list[Device] | None:
+        """Join the stored homegraph devices with already discovered network devices.
 
-        def find_device(unique_id: str) -> NetworkDevice | None:
-            for device in network_devices:
-                if device.unique_id == unique_id:
-                    return device
+        Nothing is fetched, even if the stored homegraph expired.
+        Returns None if no homegraph is stored.
+        """
+        with self._homegraph_lock:
+            homegraph_devices = self.homegraph_devices
+        if homegraph_devices is None:
             return None
+        return self._join_devices(
+            homegraph_devices, models_list or [], network_devices, None
+        )
+
+    def _join_devices(
+        self,
+        homegraph_devices: tuple[HomegraphDevice, ...],
+        models_list: list[str],
+        network_devices: list[NetworkDevice],
+        addresses: dict[str, str] | None,
+    ) -> list[Device]:
+        """Create the devices of the homegraph, matched with the network devices."""
+        devices: list[Device] = []
+        # Keep the first device of every id, like the previous linear search.
+        network_dict = {
+            device.unique_id: device for device in reversed(network_devices)
+        }
+        # Addresses are only used when no device was discovered
+        address_dict = (
+            self._resolve_addresses(addresses) if addresses and not network_dict else {}
+        )
+        with self._homegraph_lock:
+            self._network_devices = network_dict
+            self._addresses = address_dict
+            self._device_index = None
+
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        with timed("join"):
+            self.logger.debug(
+                "Iterating in %d homegraph devices", len(homegraph_devices)
+            )
+            for item in homegraph_devices:
+                if item.local_auth_token != "":
+                    # This checks if the current item is a valid model,
+                    # only if there are models in models_list.
+                    # If models_list is empty, the check should be omitted,
+                    # and accept all items.
+                    if models_list and item.model not in models_list:
+                        if debug:
+                            self.logger.debug("%s not in models_list", item.model)
+                        continue
 
-        address_dict = addresses if addresses else {}
-
-        LOGGER.debug("Iterating in %d homegraph devices", len(homegraph.home.devices))
-        for item in homegraph.home.devices:
-            if item.local_auth_token != "":
-                # This checks if the current item is a valid model,
-                # only if there are models in models_list.
-                # If models_list is empty, the check should be omitted,
-                # and accept all items.
-                if models_list and item.hardware.model not in models_list:
-                    LOGGER.debug("%s not in models_list", item.hardware.model)
-                    continue
-
-                network_device = None
-                if network_devices:
-                    unique_id = item.device_info.agent_info.unique_id
-                    LOGGER.debug(
-                        "Looking for '%s' (id=%s) in local network",
+                    device = self._create_device(item, network_dict, address_dict)
+                    if device is not None:
+                        if debug:
+                            self.logger.debug(
+                                "Adding %s to devices list", device.device_name
+                            )
+                        devices.append(device)
+                elif debug:
+                    self.logger.debug(
+                        "'%s' local_auth_token is not found in Homegraph, skipping",
                         item.device_name,
-                        unique_id,
-                    )
-                    network_device = find_device(unique_id)
-                elif item.device_name in address_dict:
-                    network_device = NetworkDevice(
-                        name=item.device_name,
-                        ip_address=address_dict[item.device_name],
-                        port=DEFAULT_DISCOVERY_PORT,
-                        model=item.hardware.model,
-                        unique_id=item.device_info.device_id,
                     )
 
-                device = Device(
-                    device_id=item.device_info.device_id,
-                    device_name=network_device.name
-                    if network_device is not None
-                    else item.device_name,
-                    local_auth_token=item.local_auth_token,
-                    network_device=network_device,
-                    hardware=item.hardware.model,
-                )
-                if device.local_auth_token:
-                    LOGGER.debug("Adding %s to devices list", device.device_name)
-                    devices.append(device)
-                else:
-                    LOGGER.warning(
-                        "%s device initialization failed "
-                        "because of missing local_auth_token, skipping.",
-                        device.device_name,
-                    )
-            else:
-                LOGGER.debug(
-                    "'%s' local_auth_token is not found in Homegraph, skipping",
+        self.logger.debug(
+            "Successfully initialized %d Google Home devices", len(devices)
+        )
+        return devices
+
+    def _resolve_addresses(self, addresses: dict[str, str]) -> dict[str, str]:
+        """Resolve the host names of static addresses, dropping unresolvable ones."""
+        with timed("resolve_addresses"):
+            resolved = self.dns_cache.resolve_many(addresses.values())
+        return {
+            name: address
+            for name, host in addresses.items()
+            if (address := resolved[host]) is not None
+        }
+
+    def _create_device(
+        self,
+        item: HomegraphDevice,
+        network_devices: dict[str, NetworkDevice],
+        address_dict: dict[str, str],
+    ) -> Device | None:
+        """Create the Device of a homegraph device, None if it is invalid."""
+        network_device = None
+        if network_devices:
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(
+                    "Looking for '%s' (id=%s) in local network",
                     item.device_name,
+                    item.unique_id,
                 )
+            network_device = network_devices.get(item.unique_id)
+        elif item.device_name in address_dict:
+            network_device = NetworkDevice(
+                name=item.device_name,
+                ip_address=address_dict[item.device_name],
+                port=DEFAULT_DISCOVERY_PORT,
+                model=item.model,
+                unique_id=item.device_id,
+            )
 
-        LOGGER.debug("Successfully initialized %d Google Home devices", len(devices))
-        return devices
+        device = Device(
+            device_id=item.device_id,
+            device_name=network_device.name
+            if network_device is not None
+            else item.device_name,
+            local_auth_token=item.local_auth_token,
+            network_device=network_device,
+            hardware=item.model,
+            logger=self.logger,
+        )
+        if not device.local_auth_token:
+            self.logger.warning(
+                "%s device initialization failed "
+                "because of missing local_auth_token, skipping.",
+                device.device_name,
+            )
+            return None
+        return device
+
+    @property
+    def devices(self) -> DeviceIndex:
+        """Return the index of the devices in the stored homegraph.
+
+        Devices are matched with the network devices of the last
+        get_google_devices call. Nothing is fetched: the index is empty until
+        a homegraph is stored, and only rebuilt when it changes.
+        """
+        with self._homegraph_lock:
+            if (
+                self._device_index is None
+                or self._device_index_source is not self.homegraph_devices
+            ):
+                self._device_index = DeviceIndex(
+                    device
+                    for item in self.homegraph_devices or ()
+                    if item.local_auth_token
+                    and (
+                        device := self._create_device(
+                            item, self._network_devices, self._addresses
+                        )
+                    )
+                    is not None
+                )
+                self._device_index_source = self.homegraph_devices
+            return self._device_index
 
     def get_google_devices_json(
         self,
@@ -493,7 +1069,8 @@ class GLocalAuthenticationTokens:
         disable_discovery: Whether or not the device's IP and port should
           be searched for in the network.
         addresses: Dict of network devices from the local network
-          ({"name": "ip_address"}). If set to `None` will try to automatically
+          ({"name": "ip_address"}), with IPv4 or IPv6 addresses or host names
+          resolved through the DNS cache. If set to `None` will try to automatically
           discover network devices. Disable discovery by setting to `{}`.
         zeroconf_instance: If you already have an initialized zeroconf instance,
           use it here.
@@ -509,19 +1086,84 @@ class GLocalAuthenticationTokens:
         )
         return json.dumps([obj.as_dict() for obj in google_devices], indent=indent)
 
+    def next_refresh_in(self, include_access_token: bool = False) -> float | None:
+        """Return the number of seconds until the stored homegraph must be refreshed.
+
+        The homegraph is refreshed when it expires, when a device token is
+        predicted to rotate or right away if a device reported an auth failure.
+        The access token is only needed to fetch the homegraph, so it is
+        refreshed on demand, unless include_access_token is set.
+        Returns None if there is nothing stored to refresh.
+        """
+        with self._homegraph_lock:
+            expiries = [self.homegraph_expiry]
+            if include_access_token:
+                expiries.append(self.access_token_expiry)
+            remaining = [
+                expiry.remaining() - TOKEN_REFRESH_MARGIN
+                for expiry in expiries
+                if expiry is not None
+            ]
+            if not remaining:
+                return None
+            rotation = self.token_rotations.next_refresh_in(TOKEN_REFRESH_MARGIN)
+            if rotation is not None:
+                remaining.append(rotation)
+            return max(min(remaining), 0)
+
+    def memory_size(self) -> int:
+        """Return an estimate of the bytes held by the homegraph and tokens.
+
+        It is based on the serialized sizes, Python objects take more. The
+        homegraph is measured when it is stored, so this never waits for a
+        homegraph being fetched.
+        """
+        tokens = (self.master_token, self.access_token, self.password)
+        return self._homegraph_size + sum(len(token or "") for token in tokens)
+
+    def report_auth_failure(self, device_id: str) -> bool:
+        """Report that a device rejected its local authentication token.
+
+        The homegraph is fetched again on the next request, so a fresh token
+        is handed out. Returns False if the device is unknown.
+        """
+        with self._homegraph_lock:
+            if not self.token_rotations.report_auth_failure(device_id):
+                self.logger.warning(
+                    "Auth failure reported for unknown device %s", device_id
+                )
+                return False
+            self._auth_failure_time = time.time()
+            self.logger.debug(
+                "Device %s rejected its token, homegraph will be refreshed", device_id
+            )
+            return True
+
     def invalidate_access_token(self) -> None:
         """Invalidate the current access token."""
-        self.access_token = None
-        self.access_token_date = None
-        LOGGER.debug("Invalidated access_token")
+        with self._token_lock:
+            if self.access_token is not None:
+                # Don't pick the same token up from the token store again
+                self._rejected_access_token = self.access_token
+            self.access_token = None
+            self.access_token_date = None
+            self.access_token_expiry = None
+            self.logger.debug("Invalidated access_token")
 
     def invalidate_master_token(self) -> None:
         """Invalidate the current master token."""
-        self.master_token = None
-        LOGGER.debug("Invalidated master_token")
+        with self._token_lock:
+            self.master_token = None
+            self.logger.debug("Invalidated master_token")
 
     def invalidate_homegraph(self) -> None:
         """Invalidate the stored homegraph data."""
-        self.homegraph = None
-        self.homegraph_date = None
-        LOGGER.debug("Invalidated homegraph")
+        with self._homegraph_lock:
+            self.homegraph = None
+            self.homegraph_devices = None
+            self.homegraph_topology = None
+            self.homegraph_date = None
+            self.homegraph_expiry = None
+            self._homegraph_raw = None
+            self._homegraph_resized()
+            self.logger.debug("Invalidated homegraph")
@@ -6,21 +6,84 @@ from typing import Final
 
 ACCESS_TOKEN_APP_NAME: Final = "com.google.android.apps.chromecast.app"
 ACCESS_TOKEN_CLIENT_SIGNATURE: Final = "24bb24c05e47e0aefa68a58a766179d9b613a600"
+# Used when perform_oauth doesn't return the lifetime of the access token
 ACCESS_TOKEN_DURATION: Final = 60 * 60
 ACCESS_TOKEN_SERVICE: Final = "oauth2:https://www.google.com/accounts/OAuthLogin"
 
+# Google Play Services version reported to the auth server, same as gpsoauth
+GOOGLE_PLAY_SERVICES_VERSION: Final = 240913000
+AUTH_POOL_SIZE: Final = 10
+AUTH_REQUEST_TIMEOUT: Final = 30
+
 ANDROID_ID_LENGTH: Final = 16
 MASTER_TOKEN_LENGTH: Final = 216
 ACCESS_TOKEN_LENGTH: Final = 315
 LOCAL_AUTH_TOKEN_LENGTH: Final = 108
 
 GOOGLE_HOME_FOYER_API: Final = "googlehomefoyer-pa.googleapis.com:443"
+# Google front ends allow 100 concurrent streams per HTTP/2 connection
+BULK_MAX_IN_FLIGHT: Final = 100
 
 HOMEGRAPH_DURATION: Final = 24 * 60 * 60
+# Shortest homegraph lifetime learned from token rotations
+ROTATION_MIN_INTERVAL: Final = 10 * 60
+# Tokens are refreshed when expiring within this many seconds
+TOKEN_REFRESH_MARGIN: Final = 60
+REFRESH_MIN_INTERVAL: Final = 1
+REFRESH_RETRY_INTERVAL: Final = 60
+# Budget of a FleetScheduler, whatever the number of clients
+FLEET_MAX_CONCURRENCY: Final = 8
+FLEET_RATE: Final = 2  # Refreshes started per second
+# Refreshes are moved up to this fraction of their delay earlier
+FLEET_JITTER: Final = 0.1
+HOMEGRAPH_SNAPSHOT_MAGIC: Final = b"GLTHG\x01"
+# Leases of a TokenStore outlive a crashed holder by at most this many seconds
+STORE_LEASE_DURATION: Final = 60
+STORE_LOCK_TIMEOUT: Final = 60
+STORE_POLL_INTERVAL: Final = 0.05
+# Nodes renew their leases every interval, well before they expire
+SHARD_LEASE_DURATION: Final = 30
+SHARD_REBALANCE_INTERVAL: Final = 10
+# Points of every node on the hash ring, more spread accounts more evenly
+SHARD_VIRTUAL_NODES: Final = 100
+
+# Repeats of a log message beyond the burst are dropped until the interval ends
+LOG_RATE_LIMIT_BURST: Final = 10
+LOG_RATE_LIMIT_INTERVAL: Final = 60
+
+# The system resolver doesn't expose record TTLs
+DNS_CACHE_TTL: Final = 5 * 60
+DNS_NEGATIVE_TTL: Final = 30
+DNS_MAX_PARALLEL: Final = 16
 
 DISCOVERY_TIMEOUT: Final = 2
+# Adaptive discovery windows, see DiscoveryStats
+DISCOVERY_MIN_TIMEOUT: Final = 0.5
+DISCOVERY_MAX_TIMEOUT: Final = 10
+DISCOVERY_MARGIN: Final = 0.25
+DISCOVERY_STEP_UP: Final = 1.5
+DISCOVERY_STATS_SAMPLES: Final = 50
+DISCOVERY_STATS_MIN_SAMPLES: Final = 5
 DEFAULT_DISCOVERY_PORT: Final = 0
 
+# Local HTTPS API of the devices
+DEVICE_API_PORT: Final = 8443
+LOCAL_AUTH_TOKEN_HEADER: Final = "cast-local-authorization-token"
+DEVICE_POOL_SIZE: Final = 64
+# Connections kept alive to a single device
+DEVICE_CONNECTIONS: Final = 2
+DEVICE_MAX_PARALLEL: Final = 16
+DEVICE_REQUEST_TIMEOUT: Final = 10
+# Delay between connection attempts to the addresses of a device, from RFC 8305
+CONNECTION_ATTEMPT_DELAY: Final = 0.25
+CONNECTION_TIMEOUT: Final = 5
+# Cheap endpoint requiring a valid local auth token
+DEVICE_VERIFY_PATH: Final = "setup/bluetooth/status"
+
+SERVER_HOST: Final = "127.0.0.1"
+SERVER_PORT: Final = 8642
+SERVER_DISCOVERY_INTERVAL: Final = 5 * 60
+
 GOOGLE_HOME_MODELS: Final = [
     "Google Home",
     "Google Home Mini",
@@ -0,0 +1,165 @@
+"""Homegraph helpers."""
+
+from __future__ import annotations
+
+from datetime import datetime
+import os
+from pathlib import Path
+import struct
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import HOMEGRAPH_SNAPSHOT_MAGIC
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+    from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+        GetHomeGraphResponse,
+    )
+
+_SNAPSHOT_HEADER = struct.Struct(f">{len(HOMEGRAPH_SNAPSHOT_MAGIC)}sd")
+
+
+class HomegraphDevice(NamedTuple):
+    """Compact projection of a homegraph device.
+
+    Holds only the fields needed to build a Device, so the full
+    GetHomeGraphResponse does not have to be kept in memory.
+    """
+
+    device_id: str
+    device_name: str
+    local_auth_token: str
+    model: str
+    unique_id: str
+
+
+class HomegraphRoom(NamedTuple):
+    """Room of a home in the homegraph."""
+
+    room_id: str
+    room_name: str
+    category: str
+
+
+class HomegraphHome(NamedTuple):
+    """Home of the homegraph with its rooms and devices.
+
+    The homegraph doesn't tell which room a device is in, so devices are
+    listed on their home.
+    """
+
+    home_id: str
+    home_name: str
+    rooms: tuple[HomegraphRoom, ...]
+    devices: tuple[HomegraphDevice, ...]
+
+
+class HomegraphSnapshot(NamedTuple):
+    """Homegraph response together with the time it was fetched."""
+
+    homegraph: GetHomeGraphResponse
+    fetched_at: datetime
+
+
+def project_homegraph(homegraph: GetHomeGraphResponse) -> tuple[HomegraphDevice, ...]:
+    """Project the homegraph devices into a compact table."""
+    return tuple(
+        HomegraphDevice(
+            device_id=item.device_info.device_id,
+            device_name=item.device_name,
+            local_auth_token=item.local_auth_token,
+            model=item.hardware.model,
+            unique_id=item.device_info.agent_info.unique_id,
+        )
+        for item in homegraph.home.devices
+    )
+
+
+def project_topology(
+    homegraph: GetHomeGraphResponse,
+    devices: tuple[HomegraphDevice, ...] | None = None,
+) -> tuple[HomegraphHome, ...]:
+    """Project the homes of the homegraph with their rooms and devices.
+
+    devices: The projected homegraph devices, to share them with the topology.
+    """
+    if not homegraph.HasField("home"):
+        return ()
+    home = homegraph.home
+    return (
+        HomegraphHome(
+            home_id=home.home_id,
+            home_name=home.home_name,
+            rooms=tuple(
+                HomegraphRoom(
+                    room_id=room.room_id,
+                    room_name=room.room_name,
+                    category=room.category.name,
+                )
+                for room in home.rooms
+            ),
+            devices=devices if devices is not None else project_homegraph(homegraph),
+        ),
+    )
+
+
+def parse_homegraph(data: bytes) -> GetHomeGraphResponse:
+    """Parse a serialized homegraph response.
+
+    The Foyer API protobufs are only imported here, on first use.
+    """
+    from ghome_foyer_api.api_pb2 import (  # pylint: disable=no-name-in-module
+        GetHomeGraphResponse,
+    )
+
+    return GetHomeGraphResponse.FromString(data)
+
+
+def dump_snapshot(homegraph: GetHomeGraphResponse, fetched_at: datetime) -> bytes:
+    """Serialize the homegraph and its fetch time into a binary snapshot."""
+    header = _SNAPSHOT_HEADER.pack(HOMEGRAPH_SNAPSHOT_MAGIC, fetched_at.timestamp())
+    return header + homegraph.SerializeToString()
+
+
+def load_snapshot(data: bytes) -> HomegraphSnapshot:
+    """Deserialize a binary snapshot created with dump_snapshot.
+
+    Raises ValueError if the data is not a valid homegraph snapshot.
+    """
+    if len(data) < _SNAPSHOT_HEADER.size:
+        raise ValueError("Homegraph snapshot is truncated")
+    magic, timestamp = _SNAPSHOT_HEADER.unpack_from(data)
+    if magic != HOMEGRAPH_SNAPSHOT_MAGIC:
+        raise ValueError("Data is not a homegraph snapshot")
+    from google.protobuf.message import DecodeError
+
+    try:
+        homegraph = parse_homegraph(data[_SNAPSHOT_HEADER.size :])
+    except DecodeError as err:
+        raise ValueError("Homegraph snapshot is corrupted") from err
+    return HomegraphSnapshot(homegraph, datetime.fromtimestamp(timestamp))
+
+
+def save_snapshot(
+    path: str | PathLike[str], homegraph: GetHomeGraphResponse, fetched_at: datetime
+) -> None:
+    """Atomically write a homegraph snapshot to a file.
+
+    The snapshot contains local authentication tokens, so the file is only
+    readable by its owner.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(dump_snapshot(homegraph, fetched_at))
+    tmp_path.replace(path)
+
+
+def read_snapshot(path: str | PathLike[str]) -> HomegraphSnapshot:
+    """Read a homegraph snapshot from a file.
+
+    Raises OSError if the file can't be read and ValueError if it is invalid.
+    """
+    return load_snapshot(Path(path).read_bytes())
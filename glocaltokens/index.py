@@ -0,0 +1,70 @@
+"""Device index."""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+    from .client import Device
+
+
+class DeviceIndex:
+    """Read-only collection of devices with O(1) lookups.
+
+    Devices are indexed by id, name, model and IP address. Names, models and
+    IP addresses don't have to be unique, so their lookups return tuples.
+    """
+
+    def __init__(self, devices: Iterable[Device] = ()):
+        """Index the given devices."""
+        self._devices = tuple(devices)
+        self._by_id: dict[str, Device] = {}
+        self._by_name: dict[str, list[Device]] = {}
+        self._by_model: dict[str, list[Device]] = {}
+        self._by_ip: dict[str, list[Device]] = {}
+        for device in self._devices:
+            self._by_id[device.device_id] = device
+            self._by_name.setdefault(device.device_name, []).append(device)
+            if device.hardware:
+                self._by_model.setdefault(device.hardware, []).append(device)
+            if device.ip_address:
+                self._by_ip.setdefault(device.ip_address, []).append(device)
+
+    def __len__(self) -> int:
+        """Return the number of devices."""
+        return len(self._devices)
+
+    def __iter__(self) -> Iterator[Device]:
+        """Iterate over the devices in homegraph order."""
+        return iter(self._devices)
+
+    def __contains__(self, device_id: object) -> bool:
+        """Check if there is a device with this id."""
+        return device_id in self._by_id
+
+    def get(self, device_id: str) -> Device | None:
+        """Return the device with this id."""
+        return self._by_id.get(device_id)
+
+    def by_name(self, name: str) -> tuple[Device, ...]:
+        """Return the devices with this name."""
+        return tuple(self._by_name.get(name, ()))
+
+    def by_model(self, *models: str) -> tuple[Device, ...]:
+        """Return the devices of any of these models, in homegraph order."""
+        if len(models) == 1:
+            return tuple(self._by_model.get(models[0], ()))
+        wanted = {
+            id(device) for model in models for device in self._by_model.get(model, ())
+        }
+        return tuple(device for device in self._devices if id(device) in wanted)
+
+    def by_ip(self, ip_address: str) -> tuple[Device, ...]:
+        """Return the devices at this IP address."""
+        return tuple(self._by_ip.get(ip_address, ()))
+
+    def models(self) -> set[str]:
+        """Return the models of the devices."""
+        return set(self._by_model)
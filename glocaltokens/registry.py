@@ -0,0 +1,180 @@
+"""Shared client registry."""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from functools import partial
+import logging
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from .client import GLocalAuthenticationTokens
+from .utils import token as token_utils
+
+if TYPE_CHECKING:
+    from .store import TokenStore
+    from .transport import AuthTransport
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ClientRegistry:
+    """Hand out one shared client per Google account.
+
+    Clients are thread safe, so worker threads can share them and reuse
+    their tokens and homegraph instead of each authenticating again.
+
+    The registry can be bounded by a number of clients and an estimate of
+    their memory, updated when a client is handed out and when it stores or
+    drops a homegraph. The least recently used clients are dropped first.
+    Bounding a registry needs a store: their tokens and homegraph are
+    already saved there, so a client created again for an evicted account
+    loads them from the file instead of fetching them, and gets the saved
+    master token if get isn't given credentials to log in with. Without a
+    store, evicted clients are lost, including master tokens obtained by
+    logging in with a password.
+    """
+
+    def __init__(
+        self,
+        verbose: bool = False,
+        compact_homegraph: bool = False,
+        transport: AuthTransport | None = None,
+        store: TokenStore | None = None,
+        max_clients: int | None = None,
+        max_memory: int | None = None,
+    ):
+        """Initialize a ClientRegistry.
+
+        verbose: Whether or not clients print debug logging information;
+        compact_homegraph: Whether or not clients only keep a compact
+          projection of the homegraph;
+        transport: AuthTransport shared by all clients;
+        store: TokenStore shared by all clients;
+        max_clients: Maximum number of clients kept, unbounded if not set,
+          ignored without store;
+        max_memory: Maximum estimated bytes held by the clients kept,
+          unbounded if not set, ignored without store.
+        """
+        self.verbose = verbose
+        self.compact_homegraph = compact_homegraph
+        self.transport = transport
+        self.store = store
+        if store is None and (max_clients is not None or max_memory is not None):
+            LOGGER.error("Clients can only be evicted with a store, keeping them all")
+            max_clients = max_memory = None
+        self.max_clients = max_clients
+        self.max_memory = max_memory
+        self.evictions = 0
+        # Least recently used first
+        self._clients: OrderedDict[str, GLocalAuthenticationTokens] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._memory = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        """Return the number of registered clients."""
+        return len(self._clients)
+
+    @property
+    def memory_size(self) -> int:
+        """Estimated bytes held by the clients."""
+        return self._memory
+
+    @staticmethod
+    def account_key(username: str | None, master_token: str | None) -> str | None:
+        """Return the key identifying an account, None without credentials."""
+        return token_utils.account_key(username, master_token)
+
+    def get(
+        self,
+        username: str | None = None,
+        password: str | None = None,
+        master_token: str | None = None,
+        android_id: str | None = None,
+    ) -> GLocalAuthenticationTokens | None:
+        """Return the client of an account, creating it on first use.
+
+        The credentials are only used to create the client, later calls only
+        need the username or master token identifying the account.
+        Returns None if neither is given.
+        """
+        key = self.account_key(username, master_token)
+        if key is None:
+            LOGGER.error("You must either provide google username or master token")
+            return None
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                LOGGER.debug("Creating new client for %s", key.split(":", 1)[0])
+                if master_token is None and password is None:
+                    master_token = self._saved_master_token(key)
+                client = GLocalAuthenticationTokens(
+                    username=username,
+                    password=password,
+                    master_token=master_token,
+                    android_id=android_id,
+                    verbose=self.verbose,
+                    compact_homegraph=self.compact_homegraph,
+                    transport=self.transport,
+                    store=self.store,
+                    memory_callback=partial(self._resize, key),
+                )
+                self._clients[key] = client
+            else:
+                self._clients.move_to_end(key)
+            self._measure(key, client.memory_size())
+            self._evict()
+            return client
+
+    def _saved_master_token(self, key: str) -> str | None:
+        """Return the master token of an account saved in the store."""
+        if self.store is None:
+            return None
+        shared = self.store.get_access_token(key)
+        return shared.master_token if shared is not None else None
+
+    def _resize(self, key: str, client: GLocalAuthenticationTokens) -> None:
+        """Measure a client again after it stored or dropped its homegraph."""
+        with self._lock:
+            if self._clients.get(key) is client:
+                self._measure(key, client.memory_size())
+                self._evict()
+
+    def _measure(self, key: str, size: int | None) -> None:
+        """Update the memory estimate of a client, forget it if size is None."""
+        self._memory += (size or 0) - self._sizes.pop(key, 0)
+        if size is not None:
+            self._sizes[key] = size
+
+    def _evict(self) -> None:
+        """Drop the least recently used clients until within bounds.
+
+        The most recently used client is always kept.
+        """
+        while len(self._clients) > 1 and (
+            (self.max_clients is not None and len(self._clients) > self.max_clients)
+            or (self.max_memory is not None and self._memory > self.max_memory)
+        ):
+            key, _ = self._clients.popitem(last=False)
+            self._measure(key, None)
+            self.evictions += 1
+            LOGGER.debug("Evicted client of %s", key.split(":", 1)[0])
+
+    def remove(
+        self, username: str | None = None, master_token: str | None = None
+    ) -> GLocalAuthenticationTokens | None:
+        """Remove the client of an account, e.g. after its credentials changed."""
+        key = self.account_key(username, master_token)
+        if key is None:
+            return None
+        with self._lock:
+            self._measure(key, None)
+            return self._clients.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all clients."""
+        with self._lock:
+            self._clients.clear()
+            self._sizes.clear()
+            self._memory = 0
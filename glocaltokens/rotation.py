@@ -0,0 +1,156 @@
+"""Local authentication token rotation tracking."""
+
+from __future__ import annotations
+
+import logging
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import ROTATION_MIN_INTERVAL
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from .homegraph import HomegraphDevice
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TokenRotation(NamedTuple):
+    """Observed history of a device local authentication token.
+
+    Times are on the monotonic clock. The rotation interval is only known
+    once the token has been seen changing twice, as the first change may
+    have happened any time before the device was first seen.
+    """
+
+    local_auth_token: str
+    first_seen: float
+    last_seen: float
+    last_changed: float
+    changes: int = 0
+    interval: float | None = None
+    auth_failures: int = 0
+
+    def next_rotation(self) -> float | None:
+        """Return the predicted time of the next rotation, if it is known."""
+        if self.interval is None:
+            return None
+        return self.last_changed + self.interval
+
+
+class TokenRotationTracker:
+    """Track when the local authentication token of every device rotates.
+
+    Used to refresh the homegraph only when a token is about to rotate or a
+    device rejected its token, instead of on a fixed schedule.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty TokenRotationTracker."""
+        self._rotations: dict[str, TokenRotation] = {}
+
+    def __len__(self) -> int:
+        """Return the number of tracked devices."""
+        return len(self._rotations)
+
+    def get(self, device_id: str) -> TokenRotation | None:
+        """Return the rotation history of a device."""
+        return self._rotations.get(device_id)
+
+    def observe(self, devices: Iterable[HomegraphDevice]) -> None:
+        """Record the tokens of a freshly fetched homegraph.
+
+        Devices no longer in the homegraph are forgotten, and reported auth
+        failures are cleared as the tokens can't get any fresher.
+        """
+        now = time.monotonic()
+        rotations = {}
+        for device in devices:
+            if not device.local_auth_token:
+                continue
+            previous = self._rotations.get(device.device_id)
+            if previous is None:
+                rotation = TokenRotation(device.local_auth_token, now, now, now)
+            elif previous.local_auth_token == device.local_auth_token:
+                rotation = previous._replace(last_seen=now, auth_failures=0)
+            else:
+                interval = previous.interval
+                if previous.changes:
+                    interval = now - previous.last_changed
+                rotation = previous._replace(
+                    local_auth_token=device.local_auth_token,
+                    last_seen=now,
+                    last_changed=now,
+                    changes=previous.changes + 1,
+                    interval=interval,
+                    auth_failures=0,
+                )
+                LOGGER.debug(
+                    "Local auth token of %s rotated (interval: %s)",
+                    device.device_name,
+                    interval,
+                )
+            rotations[device.device_id] = rotation
+        self._rotations = rotations
+
+    def report_auth_failure(self, device_id: str) -> bool:
+        """Record that a device rejected its token.
+
+        Returns False if the device is not tracked.
+        """
+        rotation = self._rotations.get(device_id)
+        if rotation is None:
+            return False
+        self._rotations[device_id] = rotation._replace(
+            auth_failures=rotation.auth_failures + 1
+        )
+        return True
+
+    def needs_refresh(self, margin: float = 0) -> bool:
+        """Check if a device rejected its token or its token is about to rotate.
+
+        A predicted rotation only triggers a single refresh: if the token
+        hasn't rotated by then, the device is left alone until it reports an
+        auth failure.
+        """
+        now = time.monotonic()
+        for rotation in self._rotations.values():
+            if rotation.auth_failures:
+                return True
+            next_rotation = rotation.next_rotation()
+            if (
+                next_rotation is not None
+                and rotation.last_seen < next_rotation - margin <= now
+            ):
+                return True
+        return False
+
+    def next_refresh_in(self, margin: float = 0) -> float | None:
+        """Return the number of seconds until the next predicted rotation.
+
+        Returns None if no upcoming rotation is known.
+        """
+        now = time.monotonic()
+        upcoming = [
+            next_rotation - margin - now
+            for rotation in self._rotations.values()
+            if (next_rotation := rotation.next_rotation()) is not None
+            and rotation.last_seen < next_rotation - margin
+        ]
+        if any(rotation.auth_failures for rotation in self._rotations.values()):
+            upcoming.append(0)
+        return max(min(upcoming), 0) if upcoming else None
+
+    def shortest_interval(self) -> float | None:
+        """Return the shortest observed rotation interval.
+
+        It is at least ROTATION_MIN_INTERVAL, so a device rotating twice in a
+        row, e.g. after a reboot, doesn't make every refresh follow quickly.
+        Returns None unless the interval of every tracked device is known.
+        """
+        intervals = [rotation.interval for rotation in self._rotations.values()]
+        if not intervals or None in intervals:
+            return None
+        shortest = min(interval for interval in intervals if interval is not None)
+        return max(shortest, ROTATION_MIN_INTERVAL)
@@ -2,29 +2,105 @@
 
 from __future__ import annotations
 
+import asyncio
+from collections.abc import Callable
+from enum import Enum
 import logging
+from queue import Empty, Queue
 from threading import Event
+import time
 from typing import TYPE_CHECKING, NamedTuple
 
 from zeroconf import ServiceBrowser, ServiceInfo, ServiceListener, Zeroconf
 
 from .const import DISCOVERY_TIMEOUT, GOOGLE_CAST_GROUP
+from .types import NetworkDevice
 from .utils import network as net_utils
+from .utils.discovery_stats import DiscoverySample, DiscoveryStats, current_network
+from .utils.logs import InstanceLogger
+from .utils.profiling import active_report
 
 if TYPE_CHECKING:
-    from collections.abc import Callable
+    from collections.abc import AsyncGenerator, Generator, Iterable
+
+__all__ = [
+    "CastListener",
+    "DiscoveryEvent",
+    "DiscoveryEventType",
+    "DiscoveryFilter",
+    "NetworkDevice",
+    "async_iter_discovery_events",
+    "discover_devices",
+    "iter_discovery_events",
+]
 
 LOGGER = logging.getLogger(__name__)
 
 
-class NetworkDevice(NamedTuple):
-    """Discovered Google device representation."""
+class DiscoveryEventType(str, Enum):
+    """Kind of change reported for a discovered Google device."""
 
-    name: str
-    ip_address: str
-    port: int
-    model: str
-    unique_id: str
+    ADD = "add"
+    UPDATE = "update"
+    REMOVE = "remove"
+
+
+class DiscoveryEvent(NamedTuple):
+    """Discovery change event emitted while browsing the network."""
+
+    type: DiscoveryEventType
+    device: NetworkDevice
+
+
+DeviceCallback = Callable[[NetworkDevice], None]
+
+
+class DiscoveryFilter(NamedTuple):
+    """Services to resolve and report while browsing.
+
+    models: Accepted model names, all if empty;
+    unique_ids: Accepted unique ids, all if empty;
+    include_groups: Whether or not cast groups are accepted.
+    """
+
+    models: frozenset[str] = frozenset()
+    unique_ids: frozenset[str] = frozenset()
+    include_groups: bool = False
+
+    @classmethod
+    def create(
+        cls,
+        models_list: Iterable[str] | None = None,
+        unique_ids: Iterable[str] | None = None,
+    ) -> DiscoveryFilter:
+        """Create a filter of the given models and unique ids, without cast groups."""
+        return cls(frozenset(models_list or ()), frozenset(unique_ids or ()))
+
+    def accepts(
+        self,
+        model: str | None,
+        unique_id: str | None,
+        logger: logging.Logger | InstanceLogger = LOGGER,
+    ) -> bool:
+        """Check if a service is wanted, unknown values are accepted."""
+        if model is not None:
+            if self.models and model not in self.models:
+                logger.debug(
+                    'Skip discovered device since model "%s" is not in models_list',
+                    model,
+                )
+                return False
+            if not self.include_groups and model == GOOGLE_CAST_GROUP:
+                logger.debug("Skip discovered cast group")
+                return False
+        if (
+            unique_id is not None
+            and self.unique_ids
+            and unique_id not in self.unique_ids
+        ):
+            logger.debug("Skip discovered device %s, it is not known", unique_id)
+            return False
+        return True
 
 
 class CastListener(ServiceListener):
@@ -36,12 +112,24 @@ class CastListener(ServiceListener):
 
     def __init__(
         self,
-        add_callback: Callable[[], None] | None = None,
-        remove_callback: Callable[[], None] | None = None,
-        update_callback: Callable[[], None] | None = None,
+        add_callback: DeviceCallback | None = None,
+        remove_callback: DeviceCallback | None = None,
+        update_callback: DeviceCallback | None = None,
+        device_filter: DiscoveryFilter | None = None,
+        logger: logging.Logger | InstanceLogger = LOGGER,
     ):
-        """Create cast listener."""
+        """Create cast listener.
+
+        Every callback receives the affected NetworkDevice. When created while
+        profiling, the time to resolve every service is added to the report.
+        With a device_filter, services whose cached TXT record shows they
+        aren't wanted are not resolved, and only wanted devices are stored.
+        Services are logged with logger.
+        """
+        self.logger = logger
         self.devices: dict[str, NetworkDevice] = {}
+        self.device_filter = device_filter
+        self.report = active_report()
         self.add_callback = add_callback
         self.remove_callback = remove_callback
         self.update_callback = update_callback
@@ -53,35 +141,37 @@ class CastListener(ServiceListener):
 
     def add_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         """Add a service to the collection."""
-        LOGGER.debug("add_service %s, %s", type_, name)
+        self.logger.debug("add_service %s, %s", type_, name)
         self._add_update_service(zc, type_, name, self.add_callback)
 
     def update_service(self, zc: Zeroconf, type_: str, name: str) -> None:
         """Update a service in the collection."""
-        LOGGER.debug("update_service %s, %s", type_, name)
+        self.logger.debug("update_service %s, %s", type_, name)
         self._add_update_service(zc, type_, name, self.update_callback)
 
     def remove_service(self, _zc: Zeroconf, type_: str, name: str) -> None:
         """Remove a cast device when its mDNS info expires or the host is down."""
-        LOGGER.debug("remove_service %s, %s", type_, name)
-        if name in self.devices:
-            del self.devices[name]
-        if self.remove_callback:
-            self.remove_callback()
+        self.logger.debug("remove_service %s, %s", type_, name)
+        device = self.devices.pop(name, None)
+        if device is not None and self.remove_callback:
+            self.remove_callback(device)
 
     def _add_update_service(
         self,
         zc: Zeroconf,
         type_: str,
         name: str,
-        callback: Callable[[], None] | None,
+        callback: DeviceCallback | None,
     ) -> None:
         """Add or update a service."""
-        if name.endswith("_sub._googlecast._tcp.local."):
-            LOGGER.debug("_add_update_service ignoring %s, %s", type_, name)
+        if name.endswith(
+            "_sub._googlecast._tcp.local."
+        ) or not self._is_cached_service_wanted(zc, type_, name):
+            self.logger.debug("_add_update_service ignoring %s, %s", type_, name)
             return
         service = None
         tries = 0
+        start = time.perf_counter()
         while service is None and tries < 4:
             try:
                 service = zc.get_service_info(type_, name)
@@ -90,48 +180,89 @@ class CastListener(ServiceListener):
                 # adding the service
                 break
             tries += 1
+        if self.report is not None:
+            self.report.add(
+                "resolve", time.perf_counter() - start, name, failed=not service
+            )
 
         if not service:
-            LOGGER.debug("_add_update_service failed to add %s, %s", type_, name)
+            self.logger.debug("_add_update_service failed to add %s, %s", type_, name)
             return
 
-        addresses = service.parsed_addresses()
+        # Devices often advertise link-local IPv6 addresses, which can't be
+        # used without their interface, so they are only used as a last resort.
+        addresses = tuple(
+            address
+            for address in service.parsed_addresses() or ()
+            if net_utils.is_valid_ipv4_address(address)
+            or net_utils.is_valid_ipv6_address(address)
+        )
+        preferred = [
+            address
+            for address in addresses
+            if not net_utils.is_link_local_address(address)
+        ]
         server_name = service.server or service.name
-        ip_address = addresses[0] if addresses else server_name
+        ip_address = (preferred or addresses or (server_name,))[0]
 
         model_name = self.get_service_value(service, "md")
         friendly_name = self.get_service_value(service, "fn")
         unique_id = self.get_service_value(service, "cd")
 
         if not model_name or not friendly_name or not service.port or not unique_id:
-            LOGGER.debug(
+            self.logger.debug(
                 "Discovered device %s has incomplete service info, skipping...",
                 ip_address,
             )
             return
 
+        if self.device_filter is not None and not self.device_filter.accepts(
+            model_name, unique_id, self.logger
+        ):
+            return
+
         if not net_utils.is_valid_ipv4_address(
             ip_address
         ) and not net_utils.is_valid_ipv6_address(ip_address):
-            LOGGER.error("Discovered device has invalid IP address: %s", ip_address)
+            self.logger.error(
+                "Discovered device has invalid IP address: %s", ip_address
+            )
             return
 
         if not 0 <= service.port <= 65535:
-            LOGGER.error(
+            self.logger.error(
                 "Port of discovered device is out of the valid range: [0,65535]"
             )
             return
 
-        self.devices[name] = NetworkDevice(
+        device = NetworkDevice(
             name=friendly_name,
             ip_address=ip_address,
             port=service.port,
             model=model_name,
             unique_id=unique_id,
+            addresses=addresses,
         )
+        self.devices[name] = device
 
         if callback:
-            callback()
+            callback(device)
+
+    def _is_cached_service_wanted(self, zc: Zeroconf, type_: str, name: str) -> bool:
+        """Check the filter against the TXT record of a service in the zeroconf cache.
+
+        Services are usually announced with their TXT record, so most unwanted
+        ones are skipped without sending any query.
+        """
+        if self.device_filter is None:
+            return True
+        info = ServiceInfo(type_, name)
+        info.load_from_cache(zc)
+        return self.device_filter.accepts(
+            self.get_service_value(info, "md"),
+            self.get_service_value(info, "cd"),
+            self.logger,
+        )
 
     @staticmethod
     def get_service_value(service: ServiceInfo, key: str) -> str | None:
@@ -143,56 +274,182 @@ class CastListener(ServiceListener):
         return value.decode("utf-8")
 
 
+def _create_event_listener(
+    put_event: Callable[[DiscoveryEvent], None],
+    device_filter: DiscoveryFilter,
+) -> CastListener:
+    """Create a CastListener forwarding every change as a DiscoveryEvent."""
+
+    def forward(event_type: DiscoveryEventType) -> DeviceCallback:
+        def callback(device: NetworkDevice) -> None:
+            put_event(DiscoveryEvent(event_type, device))
+
+        return callback
+
+    return CastListener(
+        add_callback=forward(DiscoveryEventType.ADD),
+        remove_callback=forward(DiscoveryEventType.REMOVE),
+        update_callback=forward(DiscoveryEventType.UPDATE),
+        device_filter=device_filter,
+    )
+
+
+def iter_discovery_events(
+    models_list: list[str] | None = None,
+    timeout: float | None = DISCOVERY_TIMEOUT,
+    zeroconf_instance: Zeroconf | None = None,
+) -> Generator[DiscoveryEvent]:
+    """Yield add/update/remove events for Google devices as they are discovered.
+
+    Events are yielded as soon as zeroconf resolves a device, so the caller can
+    act on the first device without waiting for the whole discovery window.
+    Browsing stops when the timeout elapses (never if `None`) or when the
+    caller stops iterating.
+
+    models_list: The list of accepted model names.
+    timeout: Discovery window in seconds.
+    zeroconf_instance: If you already have an initialized zeroconf instance,
+      use it here. It is left open when browsing stops.
+    """
+    events: Queue[DiscoveryEvent] = Queue()
+    listener = _create_event_listener(events.put, DiscoveryFilter.create(models_list))
+    zc = zeroconf_instance or Zeroconf()
+    LOGGER.debug("Creating zeroconf service browser for _googlecast._tcp.local.")
+    service_browser = ServiceBrowser(zc, "_googlecast._tcp.local.", listener)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                event = events.get(timeout=remaining)
+            except Empty:
+                break
+            yield event
+    finally:
+        service_browser.cancel()
+        if not zeroconf_instance:
+            zc.close()
+
+
+async def async_iter_discovery_events(
+    models_list: list[str] | None = None,
+    timeout: float | None = DISCOVERY_TIMEOUT,
+    zeroconf_instance: Zeroconf | None = None,
+) -> AsyncGenerator[DiscoveryEvent]:
+    """Asynchronously yield add/update/remove events for discovered Google devices.
+
+    Same as `iter_discovery_events`, without blocking the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue[DiscoveryEvent] = asyncio.Queue()
+
+    def put_event(event: DiscoveryEvent) -> None:
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    listener = _create_event_listener(put_event, DiscoveryFilter.create(models_list))
+    if zeroconf_instance:
+        zc = zeroconf_instance
+    else:
+        zc = await asyncio.to_thread(Zeroconf)
+    LOGGER.debug("Creating zeroconf service browser for _googlecast._tcp.local.")
+    service_browser = ServiceBrowser(zc, "_googlecast._tcp.local.", listener)
+    deadline = None if timeout is None else loop.time() + timeout
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(events.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            yield event
+    finally:
+        await asyncio.to_thread(service_browser.cancel)
+        if not zeroconf_instance:
+            await asyncio.to_thread(zc.close)
+
+
 def discover_devices(
     models_list: list[str] | None = None,
     max_devices: int | None = None,
-    timeout: int = DISCOVERY_TIMEOUT,
+    timeout: float = DISCOVERY_TIMEOUT,
     zeroconf_instance: Zeroconf | None = None,
     logging_level: int = logging.ERROR,
+    unique_ids: Iterable[str] | None = None,
+    stats: DiscoveryStats | None = None,
 ) -> list[NetworkDevice]:
-    """Discover devices."""
-    LOGGER.setLevel(logging_level)
+    """Discover devices.
+
+    models_list: The list of accepted model names;
+    max_devices: Stop as soon as this many wanted devices are found;
+    timeout: Discovery window in seconds, only used until stats has enough
+      samples of the network when set;
+    unique_ids: Only resolve the devices with these unique ids;
+    stats: DiscoveryStats choosing the window from past discoveries of the
+      network, the discovery is recorded and saved in them.
+    """
+    logger = InstanceLogger(LOGGER, logging_level)
 
-    LOGGER.debug("Discovering devices...")
+    logger.debug("Discovering devices...")
+    network = current_network() if stats is not None else ""
+    if stats is not None:
+        timeout = stats.timeout(network, default=timeout)
+        logger.debug("Discovery window on %s: %.2fs", network, timeout)
+    start = time.monotonic()
+    response_times: list[float] = []
 
-    def callback() -> None:
+    def callback(_device: NetworkDevice) -> None:
         """Handle the event when zeroconf discovers a new device."""
+        response_times.append(time.monotonic() - start)
         if max_devices is not None and listener.count >= max_devices:
             discovery_complete.set()
 
-    LOGGER.debug("Creating new Event for discovery completion...")
+    logger.debug("Creating new Event for discovery completion...")
     discovery_complete = Event()
-    LOGGER.debug("Creating new CastListener...")
-    listener = CastListener(add_callback=callback)
+    logger.debug("Creating new CastListener...")
+    listener = CastListener(
+        add_callback=callback,
+        device_filter=DiscoveryFilter.create(models_list, unique_ids),
+        logger=logger,
+    )
     if not zeroconf_instance:
-        LOGGER.debug("Creating new Zeroconf instance")
+        logger.debug("Creating new Zeroconf instance")
         zc = Zeroconf()
     else:
-        LOGGER.debug("Using attribute Zeroconf instance")
+        logger.debug("Using attribute Zeroconf instance")
         zc = zeroconf_instance
-    LOGGER.debug("Creating zeroconf service browser for _googlecast._tcp.local.")
+    logger.debug("Creating zeroconf service browser for _googlecast._tcp.local.")
     service_browser = ServiceBrowser(zc, "_googlecast._tcp.local.", listener)
 
     # Wait for the timeout or the maximum number of devices
-    LOGGER.debug("Waiting for discovery completion...")
+    logger.debug("Waiting for discovery completion...")
     discovery_complete.wait(timeout)
 
     # Stop discovery
     service_browser.cancel()
     service_browser.zc.close()
 
+    if stats is not None:
+        # max_devices may count devices that are offline, so only the devices
+        # found by recent discoveries are expected
+        stats.record(
+            network,
+            DiscoverySample(
+                response_times[0] if response_times else None,
+                response_times[-1] if response_times else None,
+                listener.count,
+                discovery_complete.is_set()
+                or listener.count >= stats.expected_devices(network),
+            ),
+        )
+        stats.save()
+
     devices: list[NetworkDevice] = []
-    LOGGER.debug("Got %d devices. Iterating...", listener.count)
+    logger.debug("Got %d devices. Iterating...", listener.count)
     for device in listener.devices.values():
-        if models_list and device.model not in models_list:
-            LOGGER.debug(
-                'Skip discovered device since model "%s" is not in models_list',
-                device.model,
-            )
-            continue
-        if device.model == GOOGLE_CAST_GROUP:
-            LOGGER.debug("Skip discovered cast group: %s", device.name)
-            continue
-        LOGGER.debug("Add discovered device: %s", device)
+        logger.debug("Add discovered device: %s", device)
         devices.append(device)
     return devices
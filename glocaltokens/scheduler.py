@@ -0,0 +1,288 @@
+"""Token refresh scheduling."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+from itertools import count
+import logging
+import random
+from threading import Condition, Event, Thread
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import (
+    FLEET_JITTER,
+    FLEET_MAX_CONCURRENCY,
+    FLEET_RATE,
+    REFRESH_MIN_INTERVAL,
+    REFRESH_RETRY_INTERVAL,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from .client import GLocalAuthenticationTokens
+
+LOGGER = logging.getLogger(__name__)
+
+
+class RefreshScheduler:
+    """Refresh the homegraph of a client in the background right before it expires.
+
+    Refresh times come from the client's expiry tracking, so no oauth or
+    homegraph request is made before it is actually needed.
+    """
+
+    def __init__(
+        self,
+        client: GLocalAuthenticationTokens,
+        include_access_token: bool = False,
+        retry_interval: float = REFRESH_RETRY_INTERVAL,
+    ):
+        """Initialize a RefreshScheduler.
+
+        client: The client to keep fresh;
+        include_access_token: Also keep the access token fresh, for callers
+          using it directly;
+        retry_interval: Seconds to wait before retrying a failed refresh.
+        """
+        self.client = client
+        self.include_access_token = include_access_token
+        self.retry_interval = retry_interval
+        self._stop_event = Event()
+        self._thread: Thread | None = None
+
+    def refresh(self) -> float:
+        """Refresh expiring data and return the number of seconds until the next refresh."""
+        if self.include_access_token and self.client.get_access_token() is None:
+            LOGGER.warning("Unable to refresh access token, retrying later")
+            return self.retry_interval
+        if self.client.get_homegraph_devices() is None:
+            LOGGER.warning("Unable to refresh homegraph, retrying later")
+            return self.retry_interval
+        delay = self.client.next_refresh_in(self.include_access_token)
+        if delay is None:
+            return self.retry_interval
+        LOGGER.debug("Next refresh in %.0fs", delay)
+        return max(delay, REFRESH_MIN_INTERVAL)
+
+    def start(self) -> None:
+        """Start refreshing in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(
+            target=self._run, name="glocaltokens-refresh", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and wait for it to finish."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        """Refresh until stopped."""
+        while not self._stop_event.is_set():
+            self._stop_event.wait(self.refresh())
+
+
+class FleetStats(NamedTuple):
+    """State of the queue of a FleetScheduler.
+
+    queue_depth: Refreshes that are due but not started yet;
+    lag: Seconds the most overdue of them has been waiting;
+    in_flight: Refreshes running;
+    scheduled: Clients in the queue, due or not;
+    refreshes: Refreshes completed since the scheduler was created;
+    errors: Refreshes that raised an exception.
+    """
+
+    queue_depth: int
+    lag: float
+    in_flight: int
+    scheduled: int
+    refreshes: int
+    errors: int
+
+
+class FleetScheduler:
+    """Refresh the homegraphs of many clients within a global budget.
+
+    Clients are kept in a single queue ordered by the time their data must
+    be refreshed. At most max_concurrency refreshes run at once and at most
+    rate start every second, so a fleet restarted at once or expiring at the
+    same time is refreshed progressively instead of in a burst. Every delay
+    is shortened by a random fraction of up to jitter, so refreshes spread
+    out over time. It is thread safe.
+    """
+
+    def __init__(
+        self,
+        clients: Iterable[GLocalAuthenticationTokens] = (),
+        include_access_token: bool = False,
+        max_concurrency: int = FLEET_MAX_CONCURRENCY,
+        rate: float = FLEET_RATE,
+        jitter: float = FLEET_JITTER,
+        retry_interval: float = REFRESH_RETRY_INTERVAL,
+    ):
+        """Initialize a FleetScheduler.
+
+        clients: The clients to keep fresh, more can be added later;
+        include_access_token: Also keep the access tokens fresh;
+        max_concurrency: Maximum number of refreshes running at once;
+        rate: Maximum number of refreshes started per second;
+        jitter: Fraction of the delays refreshes are randomly moved earlier by;
+        retry_interval: Seconds to wait before retrying a failed refresh.
+
+        Raises ValueError if the budget doesn't allow any refresh.
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.include_access_token = include_access_token
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.jitter = jitter
+        self.retry_interval = retry_interval
+        self._queue: list[tuple[float, int, GLocalAuthenticationTokens]] = []
+        # Sequence number of the queue entry of every client, by client id
+        self._entries: dict[int, int] = {}
+        # Number of refreshes running for every client, by client id
+        self._running: dict[int, int] = {}
+        self._sequence = count()
+        self._condition = Condition()
+        self._next_start = 0.0
+        self._in_flight = 0
+        self._refreshes = 0
+        self._errors = 0
+        self._stopping = False
+        self._thread: Thread | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        for client in clients:
+            self.add(client)
+
+    def add(self, client: GLocalAuthenticationTokens) -> None:
+        """Add a client to the queue, it is refreshed as soon as the budget allows."""
+        with self._condition:
+            if id(client) in self._entries:
+                return
+            sequence = next(self._sequence)
+            self._entries[id(client)] = sequence
+            heapq.heappush(self._queue, (time.monotonic(), sequence, client))
+            self._condition.notify_all()
+
+    def remove(self, client: GLocalAuthenticationTokens, wait: bool = False) -> None:
+        """Stop refreshing a client, a refresh in flight still completes.
+
+        wait: Wait for the refresh in flight of the client to complete, e.g.
+          before handing it over to another refresher.
+        """
+        with self._condition:
+            self._entries.pop(id(client), None)
+            self._condition.notify_all()
+            if wait:
+                self._condition.wait_for(lambda: id(client) not in self._running)
+
+    def stats(self) -> FleetStats:
+        """Return the current state of the queue."""
+        now = time.monotonic()
+        with self._condition:
+            live = [
+                due
+                for due, sequence, client in self._queue
+                if self._entries.get(id(client)) == sequence
+            ]
+            overdue = [due for due in live if due <= now]
+            return FleetStats(
+                queue_depth=len(overdue),
+                lag=now - min(overdue) if overdue else 0.0,
+                in_flight=self._in_flight,
+                scheduled=len(self._entries),
+                refreshes=self._refreshes,
+                errors=self._errors,
+            )
+
+    def start(self) -> None:
+        """Start refreshing in background threads."""
+        if self._thread is not None:
+            return
+        with self._condition:
+            self._stopping = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix="glocaltokens-fleet"
+        )
+        self._thread = Thread(
+            target=self._run,
+            args=(self._executor,),
+            name="glocaltokens-fleet-scheduler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background threads and wait for running refreshes to finish."""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _run(self, executor: ThreadPoolExecutor) -> None:
+        """Start due refreshes in executor as the budget allows, until stopped."""
+        with self._condition:
+            while not self._stopping:
+                # Drop the entries of removed clients
+                while self._queue and (
+                    self._entries.get(id(self._queue[0][2])) != self._queue[0][1]
+                ):
+                    heapq.heappop(self._queue)
+                if not self._queue or self._in_flight >= self.max_concurrency:
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                start_at = max(self._queue[0][0], self._next_start)
+                if start_at > now:
+                    self._condition.wait(start_at - now)
+                    continue
+                _, sequence, client = heapq.heappop(self._queue)
+                self._in_flight += 1
+                self._running[id(client)] = self._running.get(id(client), 0) + 1
+                self._next_start = now + 1 / self.rate
+                executor.submit(self._refresh, client, sequence)
+
+    def _refresh(self, client: GLocalAuthenticationTokens, sequence: int) -> None:
+        """Refresh a client and queue its next refresh.
+
+        Runs in a worker thread.
+        """
+        errors = 0
+        try:
+            delay = RefreshScheduler(
+                client, self.include_access_token, self.retry_interval
+            ).refresh()
+        except Exception:  # pylint: disable=broad-exception-caught
+            LOGGER.exception("Unexpected error refreshing %s", client.username)
+            delay = self.retry_interval
+            errors = 1
+        delay = max(delay * (1 - self.jitter * random.random()), REFRESH_MIN_INTERVAL)
+        with self._condition:
+            self._in_flight -= 1
+            self._running[id(client)] -= 1
+            if not self._running[id(client)]:
+                del self._running[id(client)]
+            self._refreshes += 1
+            self._errors += errors
+            if self._entries.get(id(client)) == sequence:
+                heapq.heappush(
+                    self._queue, (time.monotonic() + delay, sequence, client)
+                )
+            self._condition.notify_all()
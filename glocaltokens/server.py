@@ -0,0 +1,335 @@
+"""HTTP server serving cached device tokens."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import (
+    DISCOVERY_TIMEOUT,
+    REFRESH_RETRY_INTERVAL,
+    SERVER_DISCOVERY_INTERVAL,
+    SERVER_HOST,
+    SERVER_PORT,
+)
+from .scheduler import RefreshScheduler
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+    from .client import Device, GLocalAuthenticationTokens
+    from .types import NetworkDevice
+
+LOGGER = logging.getLogger(__name__)
+
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    503: "Service Unavailable",
+}
+
+
+class CachedResponse(NamedTuple):
+    """JSON response body with its ETag."""
+
+    body: bytes
+    etag: str
+
+    @classmethod
+    def from_json(cls, data: object) -> CachedResponse:
+        """Serialize data and compute its ETag."""
+        body = json.dumps(data).encode("utf-8")
+        return cls(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+
+
+class TokenServer:
+    """Serve the devices of long-lived clients over HTTP.
+
+    Every client is refreshed in the background right before its homegraph
+    expires, and responses are built once per refresh, so requests never
+    wait for Google or for discovery. Endpoints:
+
+    GET /devices: Devices of every client, like get_google_devices_json;
+    GET /devices/<device_id>: A single device;
+    GET /ready: 200 once every client has been refreshed at least once, 503
+      before, with the state and last error of every client.
+
+    A client failing to refresh doesn't stop the others from being served,
+    and its previous devices are kept until it succeeds again. Devices are
+    joined again with the network devices after every discovery.
+
+    Device responses have an ETag and answer If-None-Match with 304.
+    Responses contain local authentication tokens, so only bind the server
+    to interfaces trusted clients can reach.
+    """
+
+    def __init__(
+        self,
+        clients: Sequence[GLocalAuthenticationTokens],
+        models_list: list[str] | None = None,
+        disable_discovery: bool = False,
+        discovery_timeout: float = DISCOVERY_TIMEOUT,
+        discovery_interval: float = SERVER_DISCOVERY_INTERVAL,
+        retry_interval: float = REFRESH_RETRY_INTERVAL,
+    ):
+        """Initialize a TokenServer.
+
+        clients: The clients of the served accounts;
+        models_list: The list of accepted model names;
+        disable_discovery: Whether or not the devices IP and port should
+          be searched for in the network;
+        discovery_timeout: Timeout for zeroconf discovery in seconds;
+        discovery_interval: Seconds between two discoveries;
+        retry_interval: Seconds to wait before retrying a failed refresh.
+        """
+        self.clients = list(clients)
+        self.models_list = models_list
+        self.disable_discovery = disable_discovery
+        self.discovery_timeout = discovery_timeout
+        self.discovery_interval = discovery_interval
+        self.retry_interval = retry_interval
+        self.network_devices: list[NetworkDevice] = []
+        self._devices: list[list[Device] | None] = [None] * len(self.clients)
+        self._attempted = [False] * len(self.clients)
+        self._errors: list[str | None] = [None] * len(self.clients)
+        self._all_devices = CachedResponse.from_json([])
+        self._by_id: dict[str, CachedResponse] = {}
+        self._server: asyncio.Server | None = None
+        self._tasks: list[asyncio.Task[None]] = []
+
+    @property
+    def ready(self) -> bool:
+        """Whether or not every client has been refreshed at least once."""
+        return all(self._attempted)
+
+    async def start(self, host: str = SERVER_HOST, port: int = SERVER_PORT) -> int:
+        """Start refreshing clients and serving requests, return the bound port."""
+        if not self.disable_discovery:
+            await self._discover()
+            self._tasks.append(asyncio.create_task(self._discovery_loop()))
+        self._tasks.extend(
+            asyncio.create_task(self._refresh_loop(index))
+            for index in range(len(self.clients))
+        )
+        self._server = await asyncio.start_server(self._handle, host, port)
+        bound_port: int = self._server.sockets[0].getsockname()[1]
+        LOGGER.debug("Serving %d accounts on %s:%d", len(self.clients), host, port)
+        return bound_port
+
+    async def stop(self) -> None:
+        """Stop serving requests and refreshing clients."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _discover(self) -> None:
+        """Discover the network devices shared by all clients."""
+        # zeroconf is only imported when discovery is used.
+        from .scanner import discover_devices
+
+        self.network_devices = await asyncio.to_thread(
+            discover_devices, self.models_list, timeout=self.discovery_timeout
+        )
+
+    async def _discovery_loop(self) -> None:
+        """Discover network devices again every discovery_interval."""
+        while True:
+            await asyncio.sleep(self.discovery_interval)
+            try:
+                await self._discover()
+                await asyncio.to_thread(self._join_all)
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Unexpected error discovering devices")
+            self._build_responses()
+
+    def _join(self, index: int) -> None:
+        """Join the stored homegraph devices of a client with the network devices.
+
+        Nothing is fetched. Runs in a worker thread.
+        """
+        devices = self.clients[index].join_devices(
+            self.network_devices, self.models_list
+        )
+        if devices is not None:
+            self._devices[index] = devices
+
+    def _join_all(self) -> None:
+        """Join the devices of every client with fresh network devices.
+
+        Clients due for a refresh are left to their refresh loop, so nothing
+        is fetched. Runs in a worker thread.
+        """
+        for index, client in enumerate(self.clients):
+            if (
+                self._devices[index] is not None
+                and not client.needs_homegraph_refresh()
+            ):
+                self._join(index)
+
+    def _refresh(self, index: int) -> float:
+        """Refresh a client and return the number of seconds until the next refresh.
+
+        Runs in a worker thread.
+        """
+        client = self.clients[index]
+        delay = RefreshScheduler(client, retry_interval=self.retry_interval).refresh()
+        if client.needs_homegraph_refresh():
+            # The previous devices are kept until a refresh succeeds
+            self._errors[index] = "Unable to refresh homegraph"
+            return delay
+        self._errors[index] = None
+        self._join(index)
+        return delay
+
+    async def _refresh_loop(self, index: int) -> None:
+        """Refresh a client until stopped."""
+        while True:
+            try:
+                delay = await asyncio.to_thread(self._refresh, index)
+            except Exception as err:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Unexpected error refreshing account %d", index)
+                self._errors[index] = f"Unexpected error: {err!r}"
+                delay = self.retry_interval
+            self._attempted[index] = True
+            self._build_responses()
+            await asyncio.sleep(delay)
+
+    def _build_responses(self) -> None:
+        """Build the responses from the devices of every client."""
+        devices = [
+            device.as_dict()
+            for client_devices in self._devices
+            for device in client_devices or ()
+        ]
+        self._all_devices = CachedResponse.from_json(devices)
+        self._by_id = {
+            device["device_id"]: CachedResponse.from_json(device) for device in devices
+        }
+
+    def _readiness(self) -> CachedResponse:
+        """Return the readiness of the server and of every account."""
+        return CachedResponse.from_json(
+            {
+                "ready": self.ready,
+                "accounts": [
+                    {
+                        "account": index,
+                        "ready": devices is not None,
+                        "error": error,
+                    }
+                    for index, (devices, error) in enumerate(
+                        zip(self._devices, self._errors)
+                    )
+                ],
+            }
+        )
+
+    def _route(self, path: str) -> tuple[int, CachedResponse | None]:
+        """Return the status and cached response of a path."""
+        if path == "/ready":
+            return (200 if self.ready else 503), self._readiness()
+        if not self.ready and (path == "/devices" or path.startswith("/devices/")):
+            return 503, self._readiness()
+        if path == "/devices":
+            return 200, self._all_devices
+        if path.startswith("/devices/"):
+            response = self._by_id.get(path[len("/devices/") :])
+            if response is not None:
+                return 200, response
+        return 404, None
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer the requests of a connection until it is closed."""
+        try:
+            while await self._handle_request(reader, writer):
+                pass
+        except (
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+        ):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Answer a single request, return whether the connection is kept alive."""
+        request_line = await reader.readline()
+        if not request_line:
+            return False
+        headers: dict[str, str] = {}
+        while (line := await reader.readuntil(b"\n")) not in {b"\r\n", b"\n"}:
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            self._respond(writer, 400, None, keep_alive=False)
+            return False
+        keep_alive = headers.get("connection", "").lower() != "close" and (
+            version != "HTTP/1.0"
+        )
+
+        if method not in {"GET", "HEAD"}:
+            status, response = 405, None
+        else:
+            status, response = self._route(target.split("?", 1)[0])
+        if (
+            status == 200
+            and response is not None
+            and headers.get("if-none-match") == response.etag
+        ):
+            status = 304
+        self._respond(
+            writer, status, response, keep_alive=keep_alive, head=method == "HEAD"
+        )
+        await writer.drain()
+        return keep_alive
+
+    @staticmethod
+    def _respond(
+        writer: asyncio.StreamWriter,
+        status: int,
+        response: CachedResponse | None,
+        keep_alive: bool,
+        head: bool = False,
+    ) -> None:
+        """Write a response."""
+        body = response.body if response is not None and status != 304 else b""
+        lines = [
+            f"HTTP/1.1 {status} {_REASONS[status]}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Cache-Control: no-cache",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        if response is not None:
+            lines.append(f"ETag: {response.etag}")
+        head_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        writer.write(head_bytes if head else head_bytes + body)
+
+
+async def serve(
+    server: TokenServer, host: str = SERVER_HOST, port: int = SERVER_PORT
+) -> None:
+    """Run a TokenServer until cancelled."""
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
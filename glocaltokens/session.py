@@ -0,0 +1,303 @@
+"""Pooled client for the local API of Google devices."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Lock
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+from .const import (
+    DEVICE_API_PORT,
+    DEVICE_CONNECTIONS,
+    DEVICE_MAX_PARALLEL,
+    DEVICE_POOL_SIZE,
+    DEVICE_REQUEST_TIMEOUT,
+    DEVICE_VERIFY_PATH,
+    LOCAL_AUTH_TOKEN_HEADER,
+)
+from .utils.network import select_address
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from types import TracebackType
+
+    from requests import Response, Session
+
+    from .client import Device, GLocalAuthenticationTokens
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeviceResponse(NamedTuple):
+    """Response of a device to a local API request."""
+
+    device: Device
+    status: int | None
+    data: object = None
+    error: str | None = None
+
+
+class TokenCheck(NamedTuple):
+    """Result of probing a device with its local authentication token.
+
+    valid is None when the device couldn't tell, like when it is unreachable.
+    """
+
+    device: Device
+    valid: bool | None
+    latency: float | None = None
+    error: str | None = None
+
+
+class DeviceSession:
+    """Call the local HTTPS API of devices over persistent connections.
+
+    Connections to every device are kept alive between requests, so calling
+    a fleet repeatedly doesn't repeat the TLS handshakes. Devices advertising
+    several addresses are reached on the one accepting a connection first,
+    until a request to it fails. When a device
+    rejects its local authentication token and a client is set, the client
+    is told about it, the homegraph is fetched again and the request is sent
+    once more with the new token. It is thread safe.
+
+    Devices use self-signed certificates, so they are not verified by
+    default, and urllib3 warns about every unverified request.
+    """
+
+    def __init__(
+        self,
+        client: GLocalAuthenticationTokens | None = None,
+        port: int = DEVICE_API_PORT,
+        pool_size: int = DEVICE_POOL_SIZE,
+        timeout: float = DEVICE_REQUEST_TIMEOUT,
+        verify: bool | str = False,
+        session: Session | None = None,
+    ):
+        """Initialize a DeviceSession.
+
+        client: The client the devices come from, to refresh rejected tokens;
+        port: Port of the local API;
+        pool_size: Maximum number of devices connections are kept alive to;
+        timeout: Timeout of a single request in seconds;
+        verify: Whether or not to verify certificates, or the CA bundle to
+          verify them with;
+        session: The requests session to use, a new one is created if not set.
+        """
+        # requests is only imported when a session is used.
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+
+        self.client = client
+        self.port = port
+        self.timeout = timeout
+        self.session = session if session is not None else Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(pool_connections=pool_size, pool_maxsize=DEVICE_CONNECTIONS),
+        )
+        # Set on every request, session.verify is overridden by REQUESTS_CA_BUNDLE
+        self.verify = verify
+        self._refresh_lock = Lock()
+        self._addresses: dict[str, str] = {}
+        self._addresses_lock = Lock()
+
+    def __enter__(self) -> DeviceSession:  # noqa: PYI034
+        """Return the session."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the session."""
+        self.close()
+
+    def _address(self, device: Device) -> str | None:
+        """Return the address of a device, racing its addresses the first time."""
+        network_device = device.network_device
+        if network_device is None or len(network_device.addresses) <= 1:
+            return device.ip_address
+        with self._addresses_lock:
+            address = self._addresses.get(device.device_id)
+        if address is None:
+            address = select_address(
+                network_device.addresses, self.port, timeout=self.timeout
+            )
+            if address is None:
+                return device.ip_address
+            LOGGER.debug("Selected %s for %s", address, device.device_name)
+            with self._addresses_lock:
+                self._addresses[device.device_id] = address
+        return address
+
+    def _forget_address(self, device: Device) -> None:
+        """Race the addresses of a device again on the next request."""
+        with self._addresses_lock:
+            self._addresses.pop(device.device_id, None)
+
+    def _url(self, device: Device, path: str) -> str:
+        """Return the URL of a path of the local API of a device."""
+        host = self._address(device) or ""
+        if ":" in host:
+            host = f"[{host}]"
+        return f"https://{host}:{self.port}/{path.lstrip('/')}"
+
+    def _send(self, device: Device, method: str, path: str, json: object) -> Response:
+        """Send a request to a device with its current token."""
+        return self.session.request(
+            method,
+            self._url(device, path),
+            json=json,
+            headers={LOCAL_AUTH_TOKEN_HEADER: device.local_auth_token or ""},
+            timeout=self.timeout,
+            verify=self.verify,
+        )
+
+    def _refresh_token(self, device: Device, rejected_token: str | None) -> bool:
+        """Get a new token for a device from the client.
+
+        Returns False if there is no client or no newer token.
+        """
+        if self.client is None:
+            return False
+        with self._refresh_lock:
+            token = self._current_token(device)
+            # Another request may already have refreshed it
+            if token is None or token == rejected_token:
+                self.client.report_auth_failure(device.device_id)
+                self.client.get_homegraph_devices()
+                token = self._current_token(device)
+        if token is None or token == rejected_token:
+            LOGGER.warning("No new local auth token for %s", device.device_name)
+            return False
+        device.local_auth_token = token
+        return True
+
+    def _current_token(self, device: Device) -> str | None:
+        """Return the token of a device in the homegraph of the client."""
+        homegraph_devices = self.client.homegraph_devices if self.client else None
+        for item in homegraph_devices or ():
+            if item.device_id == device.device_id:
+                return item.local_auth_token
+        return None
+
+    def request(
+        self,
+        device: Device,
+        path: str,
+        method: str = "GET",
+        json: object = None,
+    ) -> DeviceResponse:
+        """Send a request to the local API of a device.
+
+        path: Path of the endpoint, like "setup/eureka_info";
+        json: JSON body of the request.
+
+        The token of the device is updated in place when it is refreshed.
+        Connection errors are returned as the error of the response.
+        """
+        from requests import RequestException
+
+        if not device.local_auth_token:
+            return DeviceResponse(device, None, error="No local auth token")
+        if not device.ip_address:
+            return DeviceResponse(device, None, error="Unknown IP address")
+        try:
+            response = self._send(device, method, path, json)
+            if response.status_code == 401 and self._refresh_token(
+                device, response.request.headers[LOCAL_AUTH_TOKEN_HEADER]
+            ):
+                response = self._send(device, method, path, json)
+        except RequestException as err:
+            LOGGER.debug("Request to %s failed: %s", device.device_name, err)
+            self._forget_address(device)
+            return DeviceResponse(device, None, error=str(err))
+        try:
+            data = response.json() if response.content else None
+        except ValueError:
+            data = None
+        error = None if response.ok else f"{response.status_code} {response.reason}"
+        return DeviceResponse(device, response.status_code, data, error)
+
+    def request_many(
+        self,
+        devices: Sequence[Device],
+        path: str,
+        method: str = "GET",
+        json: object = None,
+        max_parallel: int = DEVICE_MAX_PARALLEL,
+    ) -> list[DeviceResponse]:
+        """Send the same request to many devices concurrently.
+
+        At most max_parallel requests are in flight at once. The responses
+        are in the same order as devices, and a failing device doesn't
+        affect the others.
+        """
+        if not devices:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(max_parallel, len(devices))
+        ) as executor:
+            return list(
+                executor.map(
+                    lambda device: self.request(device, path, method, json), devices
+                )
+            )
+
+    def verify_token(
+        self, device: Device, path: str = DEVICE_VERIFY_PATH
+    ) -> TokenCheck:
+        """Probe a device with a lightweight authenticated request.
+
+        A rejected token is reported to the client, so the next homegraph
+        request fetches a fresh one. It is not retried.
+        """
+        from requests import RequestException
+
+        if not device.local_auth_token:
+            return TokenCheck(device, None, error="No local auth token")
+        if not device.ip_address:
+            return TokenCheck(device, None, error="Unknown IP address")
+        start = time.perf_counter()
+        try:
+            response = self._send(device, "GET", path, None)
+        except RequestException as err:
+            self._forget_address(device)
+            return TokenCheck(device, None, error=str(err))
+        latency = time.perf_counter() - start
+        if response.status_code in {401, 403}:
+            if self.client is not None:
+                self.client.report_auth_failure(device.device_id)
+            return TokenCheck(device, False, latency)
+        if not response.ok:
+            return TokenCheck(
+                device, None, latency, f"{response.status_code} {response.reason}"
+            )
+        return TokenCheck(device, True, latency)
+
+    def verify_tokens(
+        self,
+        devices: Sequence[Device],
+        path: str = DEVICE_VERIFY_PATH,
+        max_parallel: int = DEVICE_MAX_PARALLEL,
+    ) -> list[TokenCheck]:
+        """Probe many devices concurrently, like verify_token.
+
+        The results are in the same order as devices.
+        """
+        if not devices:
+            return []
+        with ThreadPoolExecutor(
+            max_workers=min(max_parallel, len(devices))
+        ) as executor:
+            return list(
+                executor.map(lambda device: self.verify_token(device, path), devices)
+            )
+
+    def close(self) -> None:
+        """Close the session and its connections."""
+        self.session.close()
@@ -0,0 +1,281 @@
+"""Sharding of accounts between the nodes of a cluster."""
+
+from __future__ import annotations
+
+import bisect
+import hashlib
+import logging
+from threading import Event, Lock, Thread
+import time
+from typing import TYPE_CHECKING, Protocol
+from uuid import uuid4
+
+from .const import SHARD_LEASE_DURATION, SHARD_REBALANCE_INTERVAL, SHARD_VIRTUAL_NODES
+from .utils import token as token_utils
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+    from .client import GLocalAuthenticationTokens
+    from .scheduler import FleetScheduler
+
+LOGGER = logging.getLogger(__name__)
+
+_NODE_PREFIX = "node:"
+_SHARD_PREFIX = "shard:"
+
+
+class LeaseBackend(Protocol):
+    """Coordination service holding the leases of a cluster.
+
+    TokenStore is a backend for the nodes of a single host.
+    """
+
+    def acquire_lease(
+        self, name: str, owner: str, duration: float | None = None
+    ) -> bool:
+        """Take or renew the lease of name unless another owner holds it."""
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """Release the lease of name if owner holds it."""
+
+    def leases(self, prefix: str) -> dict[str, str]:
+        """Return the owners of the unexpired leases whose name starts with prefix."""
+
+
+class MemoryLeaseBackend:
+    """In-process LeaseBackend, standing in for a shared key-value service.
+
+    It behaves like keys set with an expiry only if they don't exist, as
+    Redis does, so nodes of a single process can be tested without one.
+    It is thread safe.
+    """
+
+    def __init__(self, lease_duration: float = SHARD_LEASE_DURATION):
+        """Initialize a MemoryLeaseBackend without leases.
+
+        lease_duration: Seconds a lease is held for by default.
+        """
+        self.lease_duration = lease_duration
+        self._leases: dict[str, tuple[str, float]] = {}
+        self._lock = Lock()
+
+    def acquire_lease(
+        self, name: str, owner: str, duration: float | None = None
+    ) -> bool:
+        """Take or renew the lease of name unless another owner holds it."""
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease[0] != owner and lease[1] > now:
+                return False
+            self._leases[name] = (owner, now + (duration or self.lease_duration))
+            return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """Release the lease of name if owner holds it."""
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease[0] == owner:
+                del self._leases[name]
+
+    def leases(self, prefix: str) -> dict[str, str]:
+        """Return the owners of the unexpired leases whose name starts with prefix."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                name: owner
+                for name, (owner, expires_at) in self._leases.items()
+                if name.startswith(prefix) and expires_at > now
+            }
+
+
+def _hash(key: str) -> int:
+    """Return the position of a key on the hash ring."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes.
+
+    Every node is placed on the ring at virtual_nodes points, and a key
+    belongs to the node of the next point. Adding or removing a node only
+    moves the keys of its own points.
+    """
+
+    def __init__(
+        self, nodes: Iterable[str] = (), virtual_nodes: int = SHARD_VIRTUAL_NODES
+    ):
+        """Initialize a HashRing of nodes."""
+        self.nodes = frozenset(nodes)
+        points = sorted(
+            (_hash(f"{node}#{index}"), node)
+            for node in self.nodes
+            for index in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> str | None:
+        """Return the node a key belongs to, None if there are no nodes."""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class ShardCoordinator:
+    """Share the refresh of accounts between the nodes of a cluster.
+
+    Every node holds a lease announcing it in the backend, and accounts are
+    assigned to the live nodes by consistent hashing, so a node joining or
+    leaving only moves its share of the accounts. A node only refreshes the
+    accounts whose lease it holds. An account moving to another node is
+    released by its previous owner on its next rebalance, or when its lease
+    expires if the owner crashed, so it is never refreshed by both.
+    It is thread safe.
+    """
+
+    def __init__(
+        self,
+        backend: LeaseBackend,
+        scheduler: FleetScheduler | None = None,
+        node_id: str | None = None,
+        lease_duration: float = SHARD_LEASE_DURATION,
+        rebalance_interval: float = SHARD_REBALANCE_INTERVAL,
+        virtual_nodes: int = SHARD_VIRTUAL_NODES,
+    ):
+        """Initialize a ShardCoordinator.
+
+        backend: The backend shared by the nodes, like a TokenStore;
+        scheduler: FleetScheduler the owned accounts are added to;
+        node_id: Unique name of this node, generated if not set;
+        lease_duration: Seconds the accounts of a crashed node stay assigned
+          to it, must be longer than rebalance_interval;
+        rebalance_interval: Seconds between two rebalances in the background;
+        virtual_nodes: Number of points of every node on the hash ring.
+        """
+        self.backend = backend
+        self.scheduler = scheduler
+        self.node_id = node_id or uuid4().hex
+        self.lease_duration = lease_duration
+        self.rebalance_interval = rebalance_interval
+        self.virtual_nodes = virtual_nodes
+        self._clients: dict[str, GLocalAuthenticationTokens] = {}
+        self._owned: set[str] = set()
+        self._lock = Lock()
+        self._stop_event = Event()
+        self._thread: Thread | None = None
+
+    @property
+    def owned(self) -> frozenset[str]:
+        """Keys of the accounts this node refreshes."""
+        with self._lock:
+            return frozenset(self._owned)
+
+    def add(self, client: GLocalAuthenticationTokens) -> bool:
+        """Track the account of a client, it is owned on the next rebalance.
+
+        Returns False if the client has no credentials identifying its account.
+        """
+        key = token_utils.account_key(client.username, client.master_token)
+        if key is None:
+            LOGGER.error("You must either provide google username or master token")
+            return False
+        with self._lock:
+            self._clients[key] = client
+        return True
+
+    def remove(self, client: GLocalAuthenticationTokens) -> None:
+        """Stop tracking the account of a client, releasing it if owned."""
+        key = token_utils.account_key(client.username, client.master_token)
+        with self._lock:
+            if key is None or self._clients.pop(key, None) is None:
+                return
+            owned = key in self._owned
+            self._owned.discard(key)
+        if owned:
+            self._release(key, client)
+
+    def _release(self, key: str, client: GLocalAuthenticationTokens) -> None:
+        """Stop refreshing an account, then release its lease.
+
+        The lease is only released once a refresh in flight has completed, so
+        the next owner never refreshes the account at the same time.
+        """
+        if self.scheduler is not None:
+            self.scheduler.remove(client, wait=True)
+        self.backend.release_lease(_SHARD_PREFIX + key, self.node_id)
+
+    def ring(self) -> HashRing:
+        """Announce this node and return the ring of the live nodes."""
+        self.backend.acquire_lease(
+            _NODE_PREFIX + self.node_id, self.node_id, self.lease_duration
+        )
+        nodes = self.backend.leases(_NODE_PREFIX).values()
+        return HashRing(nodes, self.virtual_nodes)
+
+    def rebalance(self) -> frozenset[str]:
+        """Take or renew the leases of the accounts of this node.
+
+        Accounts now belonging to other nodes are released. Returns the keys
+        of the owned accounts.
+        """
+        ring = self.ring()
+        with self._lock:
+            clients = dict(self._clients)
+            previous = set(self._owned)
+        owned = {
+            key
+            for key in clients
+            if ring.node_for(key) == self.node_id
+            and self.backend.acquire_lease(
+                _SHARD_PREFIX + key, self.node_id, self.lease_duration
+            )
+        }
+        for key in previous - owned:
+            if key in clients:
+                self._release(key, clients[key])
+        if self.scheduler is not None:
+            for key in owned - previous:
+                self.scheduler.add(clients[key])
+        with self._lock:
+            self._owned = owned
+        LOGGER.debug(
+            "Node %s owns %d of %d accounts", self.node_id, len(owned), len(clients)
+        )
+        return frozenset(owned)
+
+    def leave(self) -> None:
+        """Release every account and leave the cluster, for a quick handover."""
+        with self._lock:
+            owned = [(key, self._clients[key]) for key in self._owned]
+            self._owned.clear()
+        for key, client in owned:
+            self._release(key, client)
+        self.backend.release_lease(_NODE_PREFIX + self.node_id, self.node_id)
+
+    def start(self) -> None:
+        """Start rebalancing in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = Thread(target=self._run, name="glocaltokens-shard", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background thread and leave the cluster."""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.leave()
+
+    def _run(self) -> None:
+        """Rebalance until stopped."""
+        while not self._stop_event.is_set():
+            try:
+                self.rebalance()
+            except Exception:  # pylint: disable=broad-exception-caught
+                LOGGER.exception("Unexpected error rebalancing node %s", self.node_id)
+            self._stop_event.wait(self.rebalance_interval)
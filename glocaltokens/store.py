@@ -0,0 +1,249 @@
+"""Token store shared between processes."""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+import logging
+import os
+from pathlib import Path
+import sqlite3
+from threading import Lock
+import time
+from typing import TYPE_CHECKING, NamedTuple
+from uuid import uuid4
+
+from .const import STORE_LEASE_DURATION, STORE_LOCK_TIMEOUT, STORE_POLL_INTERVAL
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from os import PathLike
+    from types import TracebackType
+
+LOGGER = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS access_tokens (
+    account TEXT PRIMARY KEY,
+    master_token TEXT,
+    access_token TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS homegraphs (
+    account TEXT PRIMARY KEY,
+    snapshot BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    generation TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class SharedAccessToken(NamedTuple):
+    """Access token of an account, with the master token it was obtained with."""
+
+    master_token: str | None
+    access_token: str
+    expires_at: float
+
+
+class SharedHomegraph(NamedTuple):
+    """Homegraph snapshot of an account.
+
+    The generation changes every time the homegraph is saved, so clients can
+    tell if it is the one they already have.
+    """
+
+    snapshot: bytes
+    expires_at: float
+    generation: str
+
+
+class TokenStore:
+    """SQLite backed store sharing tokens and homegraphs between processes.
+
+    Processes on the same host pointing their clients to the same file only
+    fetch each token and homegraph once: the first one takes a lease, fetches
+    and saves it, and the others wait for the lease and read the result.
+    Expiry times are wall clock timestamps, as monotonic clocks are not
+    shared between processes. It is thread safe.
+
+    The file contains master and access tokens, so it is only readable by its
+    owner.
+    """
+
+    def __init__(
+        self,
+        path: str | PathLike[str],
+        lease_duration: float = STORE_LEASE_DURATION,
+        lock_timeout: float = STORE_LOCK_TIMEOUT,
+        poll_interval: float = STORE_POLL_INTERVAL,
+    ):
+        """Open the store, creating the file if needed.
+
+        lease_duration: Seconds after which the lease of a crashed process
+          can be taken over;
+        lock_timeout: Seconds to wait for a lease before going on without it;
+        poll_interval: Seconds between two attempts to take a lease.
+        """
+        path = Path(path)
+        if not path.exists():
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600))
+        self.lease_duration = lease_duration
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        # Transactions are started explicitly, see _transaction.
+        self._connection = sqlite3.connect(
+            path, timeout=lock_timeout, isolation_level=None, check_same_thread=False
+        )
+        self._lock = Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+
+    def __enter__(self) -> TokenStore:  # noqa: PYI034
+        """Return the store."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the store."""
+        self.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run statements in a write transaction."""
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+    def acquire_lease(
+        self, name: str, owner: str, duration: float | None = None
+    ) -> bool:
+        """Take or renew the lease of name unless another owner holds it.
+
+        duration: Seconds the lease is held for, lease_duration if not set.
+        """
+        now = time.time()
+        with self._transaction() as cursor:
+            row = cursor.execute(
+                "SELECT owner, expires_at FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            cursor.execute(
+                "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                (name, owner, now + (duration or self.lease_duration)),
+            )
+            return True
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """Release the lease of name if owner holds it."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+    def leases(self, prefix: str) -> dict[str, str]:
+        """Return the owners of the unexpired leases whose name starts with prefix."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT name, owner FROM leases "
+                "WHERE substr(name, 1, ?) = ? AND expires_at > ?",
+                (len(prefix), prefix, time.time()),
+            ).fetchall()
+        return dict(rows)
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[bool]:
+        """Hold the lease of name, across processes, for the duration of the block.
+
+        If the lease is not released within lock_timeout, the block runs
+        anyway and the value is False.
+        """
+        owner = uuid4().hex
+        deadline = time.monotonic() + self.lock_timeout
+        while not (acquired := self.acquire_lease(name, owner)):
+            if time.monotonic() >= deadline:
+                LOGGER.warning("Timed out waiting for the lease of %s", name)
+                break
+            time.sleep(self.poll_interval)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self.release_lease(name, owner)
+
+    def get_access_token(self, account: str) -> SharedAccessToken | None:
+        """Return the access token of an account."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT master_token, access_token, expires_at "
+                "FROM access_tokens WHERE account = ?",
+                (account,),
+            ).fetchone()
+        if row is None:
+            return None
+        master_token, access_token, expires_at = row
+        return SharedAccessToken(master_token, access_token, expires_at)
+
+    def save_access_token(
+        self,
+        account: str,
+        master_token: str | None,
+        access_token: str,
+        expires_at: float,
+    ) -> None:
+        """Save the access token of an account."""
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO access_tokens VALUES (?, ?, ?, ?)",
+                (account, master_token, access_token, expires_at),
+            )
+
+    def get_homegraph(self, account: str) -> SharedHomegraph | None:
+        """Return the homegraph snapshot of an account."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT snapshot, expires_at, generation "
+                "FROM homegraphs WHERE account = ?",
+                (account,),
+            ).fetchone()
+        if row is None:
+            return None
+        snapshot, expires_at, generation = row
+        return SharedHomegraph(snapshot, expires_at, generation)
+
+    def save_homegraph(self, account: str, snapshot: bytes, expires_at: float) -> str:
+        """Save the homegraph snapshot of an account and return its generation."""
+        generation = uuid4().hex
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT OR REPLACE INTO homegraphs VALUES (?, ?, ?, ?)",
+                (account, snapshot, expires_at, generation),
+            )
+        return generation
+
+    def delete(self, account: str) -> None:
+        """Forget the tokens and homegraph of an account."""
+        with self._transaction() as cursor:
+            cursor.execute("DELETE FROM access_tokens WHERE account = ?", (account,))
+            cursor.execute("DELETE FROM homegraphs WHERE account = ?", (account,))
+
+    def close(self) -> None:
+        """Close the store."""
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,182 @@
+"""Transport for Google auth requests."""
+
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from .const import AUTH_POOL_SIZE, AUTH_REQUEST_TIMEOUT, GOOGLE_PLAY_SERVICES_VERSION
+
+if TYPE_CHECKING:
+    from collections.abc import MutableMapping
+    from types import TracebackType
+
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _create_adapter(pool_size: int) -> HTTPAdapter:
+    """Create an HTTP adapter with the TLS settings the auth server expects."""
+    from gpsoauth import AuthHTTPAdapter
+
+    class PooledAuthHTTPAdapter(AuthHTTPAdapter):
+        """AuthHTTPAdapter honoring the pool size.
+
+        AuthHTTPAdapter passes the pool settings positionally to PoolManager,
+        where the pool size ends up as its headers.
+        """
+
+        def init_poolmanager(  # pylint: disable=arguments-differ
+            self,
+            connections: int,
+            maxsize: int,
+            block: bool = False,
+            **pool_kwargs: object,
+        ) -> None:
+            super().init_poolmanager(
+                num_pools=connections, maxsize=maxsize, block=block, **pool_kwargs
+            )
+
+    return PooledAuthHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+
+
+class AuthTransport:
+    """Send gpsoauth requests over a single pooled HTTP session.
+
+    gpsoauth opens a new session, and so a new TLS connection, for every
+    request. Sharing an AuthTransport between clients keeps connections to
+    the auth server alive, so refreshing the tokens of many accounts doesn't
+    repeat the TLS handshake for each of them. It is thread safe.
+
+    The auth server rejects connections negotiating ALPN, so requests are
+    always sent over HTTP/1.1.
+    """
+
+    def __init__(
+        self,
+        session: Session | None = None,
+        pool_size: int = AUTH_POOL_SIZE,
+        timeout: float = AUTH_REQUEST_TIMEOUT,
+        proxies: MutableMapping[str, str] | None = None,
+    ):
+        """Initialize an AuthTransport.
+
+        session: The requests session to use, a new one is created if not set;
+        pool_size: Maximum number of connections kept alive to the auth server;
+        timeout: Timeout of a single request in seconds;
+        proxies: Proxies to use for the requests.
+        """
+        # gpsoauth and requests are only imported when a transport is used.
+        from gpsoauth import AUTH_URL, USER_AGENT
+        from requests import Session
+
+        self.session = session if session is not None else Session()
+        self.session.mount(AUTH_URL, _create_adapter(pool_size))
+        self.session.headers.update(
+            {
+                "Accept-Encoding": "identity",
+                "Content-type": "application/x-www-form-urlencoded",
+                "User-Agent": USER_AGENT,
+            }
+        )
+        if proxies:
+            self.session.proxies.update(proxies)
+        self.timeout = timeout
+
+    def __enter__(self) -> AuthTransport:  # noqa: PYI034
+        """Return the transport."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        """Close the transport."""
+        self.close()
+
+    def perform_auth_request(
+        self, data: dict[str, int | str | bytes]
+    ) -> dict[str, str]:
+        """Post form data to the auth server and return the parsed response."""
+        from gpsoauth import AUTH_URL
+        from gpsoauth.google import parse_auth_response
+        from requests import RequestException
+
+        try:
+            response = self.session.post(AUTH_URL, data=data, timeout=self.timeout)
+        except RequestException:
+            LOGGER.exception("Auth request failed")
+            return {}
+        return parse_auth_response(response.text)
+
+    def perform_master_login(
+        self,
+        email: str,
+        password: str,
+        android_id: str,
+        service: str = "ac2dm",
+        client_sig: str = "38918a453d07199354f8b19af05ec6562ced5788",
+    ) -> dict[str, str]:
+        """Perform a master login, like gpsoauth.perform_master_login."""
+        from gpsoauth import ANDROID_KEY_7_3_29
+        from gpsoauth.google import construct_signature
+
+        return self.perform_auth_request(
+            {
+                "accountType": "HOSTED_OR_GOOGLE",
+                "Email": email,
+                "has_permission": 1,
+                "add_account": 1,
+                "EncryptedPasswd": construct_signature(
+                    email, password, ANDROID_KEY_7_3_29
+                ),
+                "service": service,
+                "source": "android",
+                "androidId": android_id,
+                "device_country": "us",
+                "operatorCountry": "us",
+                "lang": "en",
+                "sdk_version": 17,
+                "google_play_services_version": GOOGLE_PLAY_SERVICES_VERSION,
+                "client_sig": client_sig,
+                "callerSig": client_sig,
+                "droidguard_results": "dummy123",
+            }
+        )
+
+    def perform_oauth(
+        self,
+        email: str,
+        master_token: str,
+        android_id: str,
+        service: str,
+        app: str,
+        client_sig: str,
+    ) -> dict[str, str]:
+        """Get an access token for a service, like gpsoauth.perform_oauth."""
+        return self.perform_auth_request(
+            {
+                "accountType": "HOSTED_OR_GOOGLE",
+                "Email": email,
+                "has_permission": 1,
+                "EncryptedPasswd": master_token,
+                "service": service,
+                "source": "android",
+                "androidId": android_id,
+                "app": app,
+                "client_sig": client_sig,
+                "device_country": "us",
+                "operatorCountry": "us",
+                "lang": "en",
+                "sdk_version": 17,
+                "google_play_services_version": GOOGLE_PLAY_SERVICES_VERSION,
+            }
+        )
+
+    def close(self) -> None:
+        """Close the session and its connections."""
+        self.session.close()
@@ -2,7 +2,22 @@
 
 from __future__ import annotations
 
-from typing import TypedDict
+from typing import NamedTuple, TypedDict
+
+
+class NetworkDevice(NamedTuple):
+    """Discovered Google device representation.
+
+    ip_address is the preferred address, addresses all the ones the device
+    advertises.
+    """
+
+    name: str
+    ip_address: str
+    port: int
+    model: str
+    unique_id: str
+    addresses: tuple[str, ...] = ()
 
 
 class NetworkDeviceDict(TypedDict):
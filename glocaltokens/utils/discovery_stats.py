@@ -0,0 +1,150 @@
+"""Discovery response time statistics, to adapt the discovery window."""
+
+from __future__ import annotations
+
+import json
+import logging
+import math
+import os
+from pathlib import Path
+import socket
+from threading import Lock
+from typing import TYPE_CHECKING, NamedTuple
+
+from ..const import (
+    DISCOVERY_MARGIN,
+    DISCOVERY_MAX_TIMEOUT,
+    DISCOVERY_MIN_TIMEOUT,
+    DISCOVERY_STATS_MIN_SAMPLES,
+    DISCOVERY_STATS_SAMPLES,
+    DISCOVERY_STEP_UP,
+    DISCOVERY_TIMEOUT,
+)
+
+if TYPE_CHECKING:
+    from os import PathLike
+
+LOGGER = logging.getLogger(__name__)
+
+# mDNS multicast group, connecting a UDP socket to it doesn't send anything
+_MDNS_ADDRESS = ("224.0.0.251", 5353)
+
+
+class DiscoverySample(NamedTuple):
+    """Response times of a single discovery, in seconds since it started.
+
+    first_response and last_device are None if no device responded.
+    complete is False if the window ended before every expected device
+    responded.
+    """
+
+    first_response: float | None
+    last_device: float | None
+    devices: int
+    complete: bool = True
+
+
+def current_network() -> str:
+    """Return the address of the interface mDNS queries are sent from."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            sock.connect(_MDNS_ADDRESS)
+            return str(sock.getsockname()[0])
+        except OSError:
+            return "default"
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    """Return the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+class DiscoveryStats:
+    """Response times of past discoveries on every network.
+
+    The discovery window of a network is the 99th percentile of the time it
+    took for its last device to respond, plus a margin, within bounds. When
+    the last discovery ended with fewer devices than expected, the next
+    window is one step longer, until a discovery finds them all again.
+    It is thread safe.
+    """
+
+    def __init__(
+        self,
+        path: str | PathLike[str] | None = None,
+        max_samples: int = DISCOVERY_STATS_SAMPLES,
+    ):
+        """Initialize DiscoveryStats, loading them from path if it exists.
+
+        path: JSON file the statistics are persisted in;
+        max_samples: Number of discoveries kept per network.
+        """
+        self.path = Path(path) if path is not None else None
+        self.max_samples = max_samples
+        self._samples: dict[str, list[DiscoverySample]] = {}
+        self._lock = Lock()
+        if self.path is not None and self.path.exists():
+            try:
+                data = json.loads(self.path.read_text(encoding="utf-8"))
+                self._samples = {
+                    network: [DiscoverySample(*sample) for sample in samples]
+                    for network, samples in data.items()
+                }
+            except (OSError, ValueError, TypeError):
+                LOGGER.warning("Ignoring invalid discovery stats %s", self.path)
+
+    def samples(self, network: str) -> list[DiscoverySample]:
+        """Return the samples of a network, oldest first."""
+        with self._lock:
+            return list(self._samples.get(network, ()))
+
+    def timeout(self, network: str, default: float = DISCOVERY_TIMEOUT) -> float:
+        """Return the discovery window of a network.
+
+        default is used until enough discoveries were recorded. The step up
+        after an incomplete discovery isn't compounded, so repeated ones
+        don't stretch the window further.
+        """
+        samples = self.samples(network)
+        if len(samples) < DISCOVERY_STATS_MIN_SAMPLES:
+            return default
+        last_device = [
+            sample.last_device for sample in samples if sample.last_device is not None
+        ]
+        window = (
+            _percentile(last_device, 0.99) + DISCOVERY_MARGIN
+            if last_device
+            else default
+        )
+        if not samples[-1].complete:
+            window *= DISCOVERY_STEP_UP
+        return min(max(window, DISCOVERY_MIN_TIMEOUT), DISCOVERY_MAX_TIMEOUT)
+
+    def expected_devices(self, network: str) -> int:
+        """Return the most devices one of the last discoveries of the network found.
+
+        Only the last few are used, so devices leaving the network stop being
+        expected quickly.
+        """
+        recent = self.samples(network)[-DISCOVERY_STATS_MIN_SAMPLES:]
+        return max((sample.devices for sample in recent), default=0)
+
+    def record(self, network: str, sample: DiscoverySample) -> None:
+        """Record a discovery run of a network."""
+        with self._lock:
+            samples = self._samples.setdefault(network, [])
+            samples.append(sample)
+            del samples[: -self.max_samples]
+
+    def save(self) -> None:
+        """Atomically write the statistics to path, errors are logged."""
+        if self.path is None:
+            return
+        tmp_path = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with self._lock:
+            try:
+                tmp_path.write_text(json.dumps(self._samples), encoding="utf-8")
+                tmp_path.replace(self.path)
+            except OSError:
+                LOGGER.exception("Unable to save discovery stats to %s", self.path)
@@ -0,0 +1,122 @@
+"""Cached DNS resolution."""
+
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import socket
+from threading import Lock
+from typing import TYPE_CHECKING
+
+from ..const import DNS_CACHE_TTL, DNS_MAX_PARALLEL, DNS_NEGATIVE_TTL
+from .expiry import Expiry
+from .network import is_valid_ipv4_address, is_valid_ipv6_address
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _lookup(host: str) -> str | None:
+    """Resolve a host name with the system resolver."""
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except OSError as err:
+        LOGGER.warning("Unable to resolve %s: %s", host, err)
+        return None
+    return str(infos[0][4][0]) if infos else None
+
+
+class DNSCache:
+    """Resolve host names to IP addresses, caching the results.
+
+    The system resolver doesn't expose record TTLs, so addresses are kept
+    for a fixed ttl, and failed lookups for negative_ttl. IP addresses are
+    returned as is. It is thread safe.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DNS_CACHE_TTL,
+        negative_ttl: float = DNS_NEGATIVE_TTL,
+        max_parallel: int = DNS_MAX_PARALLEL,
+    ):
+        """Initialize an empty DNSCache.
+
+        ttl: Seconds an address is kept;
+        negative_ttl: Seconds a failed lookup is kept;
+        max_parallel: Maximum number of concurrent lookups.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_parallel = max_parallel
+        self._entries: dict[str, tuple[str | None, Expiry]] = {}
+        self._lock = Lock()
+
+    def _cached(self, host: str) -> tuple[bool, str | None]:
+        """Return whether the host is known, and its address."""
+        if is_valid_ipv4_address(host) or is_valid_ipv6_address(host):
+            return True, host
+        with self._lock:
+            entry = self._entries.get(host)
+        if entry is None or entry[1].has_expired():
+            return False, None
+        return True, entry[0]
+
+    def _store(self, host: str, address: str | None) -> None:
+        """Cache the address of a host."""
+        ttl = self.ttl if address is not None else self.negative_ttl
+        with self._lock:
+            self._entries[host] = (address, Expiry.in_seconds(ttl))
+
+    def _pending(self, hosts: Iterable[str]) -> tuple[dict[str, str | None], list[str]]:
+        """Split hosts between cached addresses and hosts to look up."""
+        addresses: dict[str, str | None] = {}
+        pending: dict[str, None] = {}
+        for host in hosts:
+            known, address = self._cached(host)
+            if known:
+                addresses[host] = address
+            else:
+                pending[host] = None
+        return addresses, list(pending)
+
+    def resolve(self, host: str) -> str | None:
+        """Return the address of a host, None if it can't be resolved."""
+        return self.resolve_many([host])[host]
+
+    def resolve_many(self, hosts: Iterable[str]) -> dict[str, str | None]:
+        """Return the addresses of hosts, looking uncached ones up concurrently."""
+        addresses, pending = self._pending(hosts)
+        if pending:
+            LOGGER.debug("Resolving %d hosts", len(pending))
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_parallel, len(pending))
+            ) as executor:
+                for host, address in zip(pending, executor.map(_lookup, pending)):
+                    self._store(host, address)
+                    addresses[host] = address
+        return addresses
+
+    async def async_resolve_many(self, hosts: Iterable[str]) -> dict[str, str | None]:
+        """Return the addresses of hosts, like resolve_many, without blocking the loop."""
+        addresses, pending = self._pending(hosts)
+        if pending:
+            semaphore = asyncio.Semaphore(self.max_parallel)
+
+            async def lookup(host: str) -> str | None:
+                async with semaphore:
+                    return await asyncio.to_thread(_lookup, host)
+
+            results = await asyncio.gather(*(lookup(host) for host in pending))
+            for host, address in zip(pending, results):
+                self._store(host, address)
+                addresses[host] = address
+        return addresses
+
+    def clear(self) -> None:
+        """Forget all cached addresses."""
+        with self._lock:
+            self._entries.clear()
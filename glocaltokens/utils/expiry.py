@@ -0,0 +1,29 @@
+"""Expiry utilities."""
+
+from __future__ import annotations
+
+import time
+from typing import NamedTuple
+
+
+class Expiry(NamedTuple):
+    """Moment a token or object expires, on the monotonic clock.
+
+    The monotonic clock is not affected by system clock changes or DST, so
+    tokens are neither refreshed too early nor handed out after they expired.
+    """
+
+    deadline: float
+
+    @classmethod
+    def in_seconds(cls, seconds: float) -> Expiry:
+        """Create an expiry the given number of seconds from now."""
+        return cls(time.monotonic() + seconds)
+
+    def remaining(self) -> float:
+        """Return the number of seconds left before expiry."""
+        return self.deadline - time.monotonic()
+
+    def has_expired(self, margin: float = 0) -> bool:
+        """Check if expired, or expiring within margin seconds."""
+        return self.remaining() <= margin
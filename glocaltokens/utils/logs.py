@@ -2,6 +2,14 @@
 
 from __future__ import annotations
 
+import logging
+import sys
+from threading import Lock
+import time
+from typing import TYPE_CHECKING
+
+from ..const import LOG_RATE_LIMIT_BURST, LOG_RATE_LIMIT_INTERVAL
+
 
 def censor(
     text: str | None, hide_length: bool = False, hide_first_letter: bool = False
@@ -17,3 +25,137 @@ def censor(
     prefix = text[0] if not hide_first_letter else ""
     suffix = "<redacted>" if hide_length else char * (len(text) - len(prefix))
     return prefix + suffix
+
+
+class Censored:
+    """Log argument censored only when the record is formatted.
+
+    Pass it instead of censor(text) so nothing is computed for records that
+    are never emitted.
+    """
+
+    __slots__ = ("hide_first_letter", "hide_length", "text")
+
+    def __init__(
+        self,
+        text: str | None,
+        hide_length: bool = False,
+        hide_first_letter: bool = False,
+    ):
+        """Wrap text to censor."""
+        self.text = text
+        self.hide_length = hide_length
+        self.hide_first_letter = hide_first_letter
+
+    def __str__(self) -> str:
+        """Return the censored text."""
+        return censor(self.text, self.hide_length, self.hide_first_letter)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop repeats of a message beyond a burst per interval.
+
+    Records of the same logger, level and message template count as repeats,
+    whatever their arguments, so a warning logged for every device of a large
+    fleet is only emitted a few times. Only INFO and WARNING records are
+    limited. The number of dropped records is appended to the next record of
+    the message that goes through.
+    """
+
+    def __init__(
+        self,
+        burst: int = LOG_RATE_LIMIT_BURST,
+        interval: float = LOG_RATE_LIMIT_INTERVAL,
+    ):
+        """Initialize a RateLimitFilter letting burst records through per interval."""
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        # (window start, records in window, dropped records) per message
+        self._windows: dict[tuple[str, int, object], tuple[float, int, int]] = {}
+        self._lock = Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Return False if the record should be dropped."""
+        if not logging.INFO <= record.levelno <= logging.WARNING:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            start, count, dropped = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                start, count = now, 0
+            if count >= self.burst:
+                self._windows[key] = (start, count, dropped + 1)
+                return False
+            self._windows[key] = (start, count + 1, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+        return True
+
+
+# Before Python 3.11, the stacklevel given to a logger also counts the frames
+# of the logging module itself.
+_COUNTS_LOGGING_FRAMES = sys.version_info < (3, 11)
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
+
+    _LoggerAdapter = logging.LoggerAdapter[logging.Logger]
+else:
+    # LoggerAdapter is only subscriptable at runtime since Python 3.11
+    _LoggerAdapter = logging.LoggerAdapter
+
+
+class InstanceLogger(_LoggerAdapter):
+    """Logger adapter with its own level.
+
+    Lets each instance log at its own verbosity without changing the level of
+    the shared module logger, which would affect every other instance. A level
+    set on the module logger by the application takes precedence.
+    """
+
+    def __init__(self, logger: logging.Logger, level: int):
+        """Initialize an InstanceLogger logging records of level and above."""
+        super().__init__(logger, {})
+        self.level = level
+
+    def isEnabledFor(self, level: int) -> bool:  # noqa: N802
+        """Check if records of this level are logged by this instance."""
+        if self.logger.disabled or self.logger.manager.disable >= level:
+            return False
+        return level >= (self.logger.level or self.level)
+
+    def exception(  # type: ignore[override]  # pylint: disable=arguments-differ
+        self,
+        msg: object,
+        *args: object,
+        exc_info: bool = True,
+        stack_info: bool = False,
+        stacklevel: int = 1,
+        extra: Mapping[str, object] | None = None,
+    ) -> None:
+        """Log msg with level ERROR and exception information, like Logger.exception."""
+        self.error(
+            msg,
+            *args,
+            exc_info=exc_info,
+            stack_info=stack_info,
+            # Skip this frame, and the LoggerAdapter.error one where counted
+            stacklevel=stacklevel + (2 if _COUNTS_LOGGING_FRAMES else 1),
+            extra=extra,
+        )
+
+    def log(self, level: int, msg: object, *args: object, **kwargs: object) -> None:
+        """Log msg if isEnabledFor(level), bypassing the effective level of the logger."""
+        if not self.isEnabledFor(level):
+            return
+        if not _COUNTS_LOGGING_FRAMES:
+            # Skip this frame when looking for the caller, older versions
+            # already skip it along with the LoggerAdapter frames.
+            stacklevel = kwargs.get("stacklevel", 1)
+            kwargs["stacklevel"] = (
+                stacklevel if isinstance(stacklevel, int) else 1
+            ) + 1
+        msg, record_kwargs = self.process(msg, kwargs)
+        self.logger._log(level, msg, args, **record_kwargs)  # noqa: SLF001  # pylint: disable=protected-access
@@ -2,7 +2,20 @@
 
 from __future__ import annotations
 
+import ipaddress
+from queue import Empty, Queue
+import re
 import socket
+from threading import Thread
+import time
+from typing import TYPE_CHECKING
+
+from ..const import CONNECTION_ATTEMPT_DELAY, CONNECTION_TIMEOUT
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+
+_HOSTNAME_LABEL = re.compile(r"(?!-)[a-z0-9-]{1,63}(?<!-)", re.IGNORECASE)
 
 
 def is_valid_ipv4_address(address: str) -> bool:
@@ -33,3 +46,77 @@ def is_valid_ipv6_address(address: str) -> bool:
 def is_valid_port(port: int) -> bool:
     """Check if port is valid."""
     return 0 <= port <= 65535
+
+
+def is_valid_hostname(hostname: str) -> bool:
+    """Check if hostname is a valid DNS name."""
+    hostname = hostname.removesuffix(".")
+    return 0 < len(hostname) <= 253 and all(
+        _HOSTNAME_LABEL.fullmatch(label) for label in hostname.split(".")
+    )
+
+
+def is_link_local_address(address: str) -> bool:
+    """Check if ip address is link-local."""
+    try:
+        return ipaddress.ip_address(address).is_link_local
+    except ValueError:
+        return False
+
+
+def _interleave_families(addresses: Sequence[str]) -> list[str]:
+    """Alternate IPv6 and IPv4 addresses, starting with the family of the first one."""
+    ipv6 = [address for address in addresses if ":" in address]
+    ipv4 = [address for address in addresses if ":" not in address]
+    first, second = (ipv6, ipv4) if addresses and ":" in addresses[0] else (ipv4, ipv6)
+    interleaved = []
+    for index in range(max(len(first), len(second))):
+        interleaved += first[index : index + 1] + second[index : index + 1]
+    return interleaved
+
+
+def select_address(
+    addresses: Sequence[str],
+    port: int,
+    timeout: float = CONNECTION_TIMEOUT,
+    attempt_delay: float = CONNECTION_ATTEMPT_DELAY,
+) -> str | None:
+    """Return the address of a host that accepts a connection first.
+
+    Connection attempts are raced like Happy Eyeballs (RFC 8305): they are
+    started attempt_delay apart, or as soon as the previous one fails,
+    alternating address families. Returns None if no address is reachable
+    within timeout.
+    """
+    if len(addresses) <= 1:
+        return addresses[0] if addresses else None
+    results: Queue[tuple[str, bool]] = Queue()
+
+    def attempt(address: str) -> None:
+        try:
+            with socket.create_connection((address, port), timeout=timeout):
+                results.put((address, True))
+        except OSError:
+            results.put((address, False))
+
+    pending = _interleave_families(addresses)
+    deadline = time.monotonic() + timeout
+    running = 0
+    while pending or running:
+        if pending:
+            # Losing attempts finish in the background
+            Thread(target=attempt, args=(pending.pop(0),), daemon=True).start()
+            running += 1
+        wait = deadline - time.monotonic()
+        if pending:
+            wait = min(wait, attempt_delay)
+        try:
+            address, connected = results.get(timeout=max(wait, 0))
+        except Empty:
+            if time.monotonic() >= deadline:
+                return None
+            continue
+        running -= 1
+        if connected:
+            return address
+    return None
@@ -0,0 +1,103 @@
+"""Opt-in timing of the stages of a request.
+
+Profiling is enabled with `profile()`. While it is active, the client records
+how long each stage took: master_login, oauth, channel, get_homegraph,
+discovery, resolve (one per device resolved by zeroconf), resolve_addresses
+(DNS lookups of static addresses) and join.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+import time
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
+_ACTIVE_REPORT: ContextVar[TimingReport | None] = ContextVar(
+    "glocaltokens_timing_report", default=None
+)
+
+
+class StageTiming(NamedTuple):
+    """Duration of a single run of a stage."""
+
+    stage: str
+    duration: float
+    detail: str | None = None
+    failed: bool = False
+
+
+class TimingReport:
+    """Timings of the stages run while profiling, in completion order.
+
+    Stages run more than once, like get_homegraph when it is retried, have
+    an entry for every run. It is thread safe.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty TimingReport."""
+        self.stages: list[StageTiming] = []
+        self._lock = Lock()
+
+    def add(
+        self,
+        stage: str,
+        duration: float,
+        detail: str | None = None,
+        failed: bool = False,
+    ) -> None:
+        """Record a run of a stage."""
+        with self._lock:
+            self.stages.append(StageTiming(stage, duration, detail, failed))
+
+    def totals(self) -> dict[str, float]:
+        """Return the total duration of every stage."""
+        totals: dict[str, float] = {}
+        with self._lock:
+            for timing in self.stages:
+                totals[timing.stage] = totals.get(timing.stage, 0) + timing.duration
+        return totals
+
+    def as_list(self) -> list[dict[str, str | float | bool | None]]:
+        """Return the stages as JSON serializable dicts."""
+        with self._lock:
+            return [timing._asdict() for timing in self.stages]
+
+
+def active_report() -> TimingReport | None:
+    """Return the report of the current profiling session, if any."""
+    return _ACTIVE_REPORT.get()
+
+
+@contextmanager
+def profile() -> Iterator[TimingReport]:
+    """Record the stage timings of the calls made in this block.
+
+    The report only covers the current thread or task.
+    """
+    report = TimingReport()
+    token = _ACTIVE_REPORT.set(report)
+    try:
+        yield report
+    finally:
+        _ACTIVE_REPORT.reset(token)
+
+
+@contextmanager
+def timed(stage: str, detail: str | None = None) -> Iterator[None]:
+    """Record the duration of the block as a stage if profiling is active."""
+    report = _ACTIVE_REPORT.get()
+    if report is None:
+        yield
+        return
+    start = time.perf_counter()
+    failed = True
+    try:
+        yield
+        failed = False
+    finally:
+        report.add(stage, time.perf_counter() - start, detail, failed)
@@ -1,7 +1,14 @@
 """Token utilities."""
 
+from __future__ import annotations
+
 import random
 import string
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from collections.abc import Mapping
 
 
 def is_aas_et(token: str) -> bool:
@@ -14,6 +21,31 @@ def is_local_auth_token(token: str) -> bool:
     return len(token) == 108
 
 
+def oauth_lifetime(response: Mapping[str, str], default: int) -> int:
+    """Return the lifetime in seconds of a token obtained through perform_oauth.
+
+    Uses the ExpiresInDurationSec field if present, otherwise the Expiry epoch
+    timestamp, and falls back to default if the response has neither.
+    """
+    try:
+        return int(response["ExpiresInDurationSec"])
+    except (KeyError, ValueError):
+        pass
+    try:
+        return int(int(response["Expiry"]) - time.time())
+    except (KeyError, ValueError):
+        return default
+
+
+def account_key(username: str | None, master_token: str | None) -> str | None:
+    """Return the key identifying an account, None without credentials."""
+    if username:
+        return f"username:{username.lower()}"
+    if master_token:
+        return f"master_token:{master_token}"
+    return None
+
+
 def generate(length: int, prefix: str = "", suffix: str = "") -> str:
     """Generate token."""
     return (
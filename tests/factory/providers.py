@@ -79,3 +79,13 @@ class HomegraphProvider(TokenProvider):
                 count if count else faker.random.randint(min_devices, max_devices)
             )
         ]
+
+    def homegraph(
+        self, devices: list[GetHomeGraphResponse.Home.Device] | None = None
+    ) -> GetHomeGraphResponse:
+        """Create and return a mocked HomeGraph response with the given devices."""
+        return GetHomeGraphResponse(
+            home=GetHomeGraphResponse.Home(
+                devices=devices if devices is not None else self.homegraph_devices()
+            )
+        )
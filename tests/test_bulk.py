@@ -0,0 +1,167 @@
+"""Bulk homegraph fetching specific tests."""
+
+from __future__ import annotations
+
+from concurrent.futures import Future
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Barrier, Lock, Timer
+from unittest import TestCase, mock
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+import grpc
+
+from glocaltokens.bulk import fetch_homegraphs
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.homegraph import load_snapshot, project_homegraph
+from glocaltokens.store import TokenStore
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+
+def rpc_error(code: str) -> grpc.RpcError:
+    """Return an RPC error with the given status code name."""
+    error = grpc.RpcError()
+    error.code = mock.Mock(return_value=grpc.StatusCode[code])  # type: ignore[method-assign]
+    error.details = mock.Mock()  # type: ignore[method-assign]
+    return error
+
+
+class FetchHomegraphsTests(TestCase):
+    """fetch_homegraphs tests."""
+
+    def setUp(self) -> None:
+        """Set up clients whose homegraph calls are answered from a thread."""
+        patcher = patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+        self.m_get_homegraph: NonCallableMock = (
+            patcher.start().return_value.GetHomeGraph.future
+        )
+        self.addCleanup(patcher.stop)
+        patcher = patch(
+            "grpc.access_token_call_credentials",
+            side_effect=lambda access_token: ("credentials", access_token),
+        )
+        self.m_credentials: NonCallableMock = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("grpc.secure_channel")
+        self.m_secure_channel: NonCallableMock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.clients = [
+            GLocalAuthenticationTokens(master_token=faker.master_token())
+            for _ in range(4)
+        ]
+        self.tokens = {id(client): faker.access_token() for client in self.clients}
+        self.token_barrier: Barrier | None = None
+        patcher = patch.object(
+            GLocalAuthenticationTokens,
+            "get_access_token",
+            autospec=True,
+            side_effect=self.get_access_token,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.homegraph = faker.homegraph()
+        self.errors: dict[str, list[grpc.RpcError]] = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = Lock()
+        self.m_get_homegraph.side_effect = self.get_homegraph
+
+    def get_access_token(self, client: GLocalAuthenticationTokens) -> str | None:
+        """Return the access token of a client, once token_barrier is passed."""
+        if self.token_barrier is not None:
+            self.token_barrier.wait()
+        return self.tokens.get(id(client))
+
+    def get_homegraph(
+        self, _request: object, timeout: float | None, credentials: tuple[str, str]
+    ) -> Future[object]:
+        """Answer a homegraph call shortly, failing with the token's next error."""
+        assert timeout == 10
+        _, access_token = credentials
+        future: Future[object] = Future()
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        def done() -> None:
+            with self.lock:
+                self.in_flight -= 1
+            errors = self.errors.get(access_token)
+            if errors:
+                future.set_exception(errors.pop(0))
+            else:
+                future.set_result(self.homegraph)
+
+        Timer(0.01, done).start()
+        return future
+
+    def test_fetch_homegraphs(self) -> None:
+        """Every account gets its own result, errors don't affect the others."""
+        fresh, expired, failing, no_token = self.clients
+        fresh_homegraph = faker.homegraph()
+        fresh.store_homegraph(fresh_homegraph)
+        self.errors[self.tokens[id(expired)]] = [rpc_error("UNAUTHENTICATED")]
+        self.errors[self.tokens[id(failing)]] = [rpc_error("UNAVAILABLE")]
+        del self.tokens[id(no_token)]
+
+        results = fetch_homegraphs(self.clients, max_in_flight=1, timeout=10)
+
+        assert [result.client for result in results] == self.clients
+        assert results[0].homegraph_devices == project_homegraph(fresh_homegraph)
+        assert results[1].homegraph_devices == project_homegraph(self.homegraph)
+        assert results[1].error is None
+        assert expired.homegraph_devices == project_homegraph(self.homegraph)
+        assert results[2].homegraph_devices is None
+        assert results[2].error is not None
+        assert "UNAVAILABLE" in results[2].error
+        assert results[3] == (no_token, None, "Unable to obtain access token")
+
+        # One channel, at most one call at a time, the expired one retried
+        assert self.m_secure_channel.call_count == 1
+        assert self.max_in_flight == 1
+        assert self.m_get_homegraph.call_count == 3
+        assert self.m_credentials.call_count == 3
+
+    def test_fetch_homegraphs__max_attempts(self) -> None:
+        """Accounts whose token keeps being rejected give up after auth_attempts."""
+        client = self.clients[0]
+        self.errors[self.tokens[id(client)]] = [
+            rpc_error("UNAUTHENTICATED") for _ in range(3)
+        ]
+        results = fetch_homegraphs([client], timeout=10, auth_attempts=2)
+        assert results[0].error == "Reached maximum number of authentication attempts"
+        assert self.m_get_homegraph.call_count == 2
+
+    def test_fetch_homegraphs__store(self) -> None:
+        """Fetched homegraphs are saved in the token store of their client."""
+        with TemporaryDirectory() as tmp_dir:
+            with TokenStore(Path(tmp_dir) / "tokens.db") as store:
+                client = self.clients[0]
+                client.store = store
+                fetch_homegraphs([client], timeout=10)
+                shared = store.get_homegraph(f"master_token:{client.master_token}")
+            assert shared is not None
+            assert load_snapshot(shared.snapshot).homegraph == self.homegraph
+
+    def test_fetch_homegraphs__slow_tokens(self) -> None:
+        """Access tokens of different accounts are obtained concurrently."""
+        # Only passed once every account is getting its token at the same time
+        self.token_barrier = Barrier(len(self.clients), timeout=5)
+        results = fetch_homegraphs(self.clients, timeout=10)
+        assert all(result.error is None for result in results)
+        assert not self.token_barrier.broken
+
+    def test_nothing_to_fetch(self) -> None:
+        """No channel is opened when every homegraph is fresh."""
+        for client in self.clients:
+            client.store_homegraph(self.homegraph)
+        results = fetch_homegraphs(self.clients)
+        assert all(result.homegraph_devices for result in results)
+        assert self.m_secure_channel.call_count == 0
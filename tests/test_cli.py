@@ -0,0 +1,176 @@
+"""Command line interface specific tests."""
+
+from __future__ import annotations
+
+import csv
+import io
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+import pytest
+
+from glocaltokens.cli import CSV_FIELDS, Account, cache_path, load_accounts, main
+from glocaltokens.scanner import NetworkDevice
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+
+class CliTests(TestCase):
+    """Command line interface tests."""
+
+    def setUp(self) -> None:
+        """Fake the homegraph of every account."""
+        self.homegraph = faker.homegraph(faker.homegraph_devices(count=2))
+        self.m_fetch = self.patch(
+            "ghome_foyer_api.api_pb2_grpc.StructuresServiceStub"
+        ).return_value.GetHomeGraph
+        self.m_fetch.return_value = self.homegraph
+        self.patch(
+            "glocaltokens.client.GLocalAuthenticationTokens.get_access_token"
+        ).return_value = faker.access_token()
+        self.m_discover_devices = self.patch("glocaltokens.scanner.discover_devices")
+        self.m_discover_devices.return_value = []
+        tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = Path(tmp_dir.name)
+        self.accounts = [
+            Account(username=faker.email(), password=faker.word()),
+            Account(master_token=faker.master_token()),
+        ]
+        self.accounts_path = self.tmp_dir / "accounts.ndjson"
+        self.accounts_path.write_text(
+            "\n".join(json.dumps(account._asdict()) for account in self.accounts)
+            + "\n\n",
+            encoding="utf-8",
+        )
+
+    def patch(self, target: str) -> NonCallableMock:
+        """Patch target for the duration of the test."""
+        patcher = patch(target)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def run_main(self, *argv: str) -> tuple[int, str, str]:
+        """Run the command and return its exit code, stdout and stderr."""
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with patch("sys.stdout", stdout), patch("sys.stderr", stderr):
+            exit_code = main(["--accounts", str(self.accounts_path), *argv])
+        return exit_code, stdout.getvalue(), stderr.getvalue()
+
+    def test_load_accounts(self) -> None:
+        """Accounts are read from NDJSON, skipping blank lines."""
+        assert load_accounts(self.accounts_path) == self.accounts
+
+    def test_load_accounts__invalid(self) -> None:
+        """Invalid accounts are reported with their line number."""
+        for line in ("{", '["not", "an", "account"]'):
+            with self.subTest(line=line):
+                self.accounts_path.write_text(
+                    json.dumps(self.accounts[0]._asdict()) + "\n" + line,
+                    encoding="utf-8",
+                )
+                with pytest.raises(
+                    (TypeError, ValueError), match=r"accounts\.ndjson:2: "
+                ):
+                    load_accounts(self.accounts_path)
+                with pytest.raises(SystemExit) as exc_info:
+                    self.run_main()
+                assert exc_info.value.code == 2
+                self.m_fetch.assert_not_called()
+
+    def test_label(self) -> None:
+        """Master token accounts get distinct labels without their token."""
+        accounts = [Account(master_token=faker.master_token()) for _ in range(2)]
+        labels = {account.label for account in accounts}
+        assert len(labels) == 2
+        assert all(
+            account.master_token not in account.label  # type: ignore[operator]
+            for account in accounts
+        )
+        assert self.accounts[0].label == self.accounts[0].username
+
+    def test_ndjson_output(self) -> None:
+        """Every device of every account is output as a JSON line."""
+        exit_code, stdout, _ = self.run_main("--no-discovery")
+        assert exit_code == 0
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        assert len(rows) == 4
+        assert {row["account"] for row in rows} == {
+            account.label for account in self.accounts
+        }
+        assert {row["local_auth_token"] for row in rows} == {
+            device.local_auth_token for device in self.homegraph.home.devices
+        }
+        assert self.m_discover_devices.call_count == 0
+
+    def test_csv_output_with_model_filter(self) -> None:
+        """CSV output only contains devices of the requested models."""
+        model = self.homegraph.home.devices[0].hardware.model
+        exit_code, stdout, _ = self.run_main(
+            "--no-discovery", "--format", "csv", "--model", model
+        )
+        assert exit_code == 0
+        rows = list(csv.DictReader(io.StringIO(stdout)))
+        assert list(rows[0]) == CSV_FIELDS
+        assert len(rows) == 2
+        assert {row["hardware"] for row in rows} == {model}
+
+    def test_discovery_is_shared(self) -> None:
+        """Discovery runs once and its devices are matched for every account."""
+        for device in self.homegraph.home.devices:
+            device.device_info.agent_info.unique_id = faker.uuid4()
+        item = self.homegraph.home.devices[0]
+        ip_address = faker.ipv4()
+        self.m_discover_devices.return_value = [
+            NetworkDevice(
+                item.device_name,
+                ip_address,
+                faker.port_number(),
+                item.hardware.model,
+                item.device_info.agent_info.unique_id,
+            )
+        ]
+        exit_code, stdout, stderr = self.run_main("--timings")
+        assert exit_code == 0
+        assert self.m_discover_devices.call_count == 1
+        rows = [json.loads(line) for line in stdout.splitlines()]
+        assert sum(row["ip"] == ip_address for row in rows) == 2
+        timings = [json.loads(line) for line in stderr.splitlines()]
+        assert "discovery" in timings[0]["timings"]
+        assert {"homegraph", "devices"} <= set(timings[1]["timings"])
+
+    def test_profile(self) -> None:
+        """Profiling reports the stages of every account."""
+        exit_code, _, stderr = self.run_main("--profile")
+        assert exit_code == 0
+        lines = [json.loads(line) for line in stderr.splitlines()]
+        assert lines[0]["profile"] == []
+        for line in lines[1:]:
+            stages = [timing["stage"] for timing in line["profile"]]
+            assert stages == ["channel", "get_homegraph", "join"]
+
+    def test_cache_dir(self) -> None:
+        """Accounts with a fresh snapshot in the cache are not fetched again."""
+        cache_dir = self.tmp_dir / "cache"
+        for _ in range(2):
+            exit_code, stdout, _ = self.run_main(
+                "--no-discovery", "--cache-dir", str(cache_dir)
+            )
+            assert exit_code == 0
+            assert len(stdout.splitlines()) == 4
+        assert self.m_fetch.call_count == 2
+        assert cache_path(cache_dir, self.accounts[0]).exists()
+
+    def test_failed_account(self) -> None:
+        """Failed accounts are reported in the exit code."""
+        self.m_fetch.side_effect = RuntimeError("boom")
+        exit_code, stdout, _ = self.run_main("--no-discovery")
+        assert exit_code == 1
+        assert stdout == ""
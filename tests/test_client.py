@@ -2,9 +2,14 @@
 
 from __future__ import annotations
 
-from datetime import datetime, timedelta
+from contextlib import contextmanager
+from datetime import timedelta
 import json
 import logging
+from pathlib import Path
+import socket
+from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
 from unittest import TestCase, mock
 from unittest.mock import NonCallableMock, patch
 
@@ -16,30 +21,59 @@ from glocaltokens.client import Device, GLocalAuthenticationTokens
 from glocaltokens.const import (
     ACCESS_TOKEN_APP_NAME,
     ACCESS_TOKEN_CLIENT_SIGNATURE,
-    ACCESS_TOKEN_DURATION,
     ACCESS_TOKEN_SERVICE,
     ANDROID_ID_LENGTH,
-    HOMEGRAPH_DURATION,
     JSON_KEY_DEVICE_NAME,
     JSON_KEY_HARDWARE,
     JSON_KEY_IP,
     JSON_KEY_LOCAL_AUTH_TOKEN,
     JSON_KEY_NETWORK_DEVICE,
     JSON_KEY_PORT,
+    TOKEN_REFRESH_MARGIN,
 )
-from glocaltokens.scanner import NetworkDevice
+from glocaltokens.homegraph import project_homegraph
+from glocaltokens.scanner import CastListener, NetworkDevice
+from glocaltokens.utils.expiry import Expiry
+from glocaltokens.utils.logs import InstanceLogger
+from glocaltokens.utils.profiling import profile
 from tests.assertions import DeviceAssertions, TypeAssertions
 from tests.factory.providers import HomegraphProvider, TokenProvider
 
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+
 faker = Faker()
 faker.add_provider(TokenProvider)
 faker.add_provider(HomegraphProvider)
 faker.add_provider(internet)
 
 
+@contextmanager
+def capture_logs(name: str) -> Iterator[list[logging.LogRecord]]:
+    """Collect the records of a logger without changing its level."""
+    records: list[logging.LogRecord] = []
+
+    class ListHandler(logging.Handler):
+        """Handler appending records to the list."""
+
+        def emit(self, record: logging.LogRecord) -> None:
+            """Append the record."""
+            records.append(record)
+
+    handler = ListHandler()
+    logger = logging.getLogger(name)
+    logger.addHandler(handler)
+    try:
+        yield records
+    finally:
+        logger.removeHandler(handler)
+
+
 class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, TestCase):
     """GLocalAuthenticationTokens clien specific unittests."""
 
+    # pylint: disable=too-many-public-methods
+
     def setUp(self) -> None:
         """Set up the test client before each test."""
         self.client = GLocalAuthenticationTokens(
@@ -72,7 +106,7 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         assert client.master_token is not None
         self.assertIsAasEt(client.master_token)
 
-    @patch("glocaltokens.client.LOGGER.error")
+    @patch("glocaltokens.utils.logs.InstanceLogger.error")
     def test_initialization__valid(self, m_log: NonCallableMock) -> None:
         """Valid initialization tests."""
         # With username and password
@@ -83,24 +117,65 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         GLocalAuthenticationTokens(master_token=faker.master_token())
         assert m_log.call_count == 0
 
-    @patch("glocaltokens.client.LOGGER.setLevel")
-    def test_initialization__valid_verbose_logger(
-        self, m_set_level: NonCallableMock
-    ) -> None:
+    def test_initialization__valid_verbose_logger(self) -> None:
         """Valid initialization tests with verbose logging."""
         # Non verbose
-        GLocalAuthenticationTokens(username=faker.word(), password=faker.word())
-        m_set_level.assert_called_once_with(logging.ERROR)
-
-        m_set_level.reset_mock()
+        client = GLocalAuthenticationTokens(
+            username=faker.word(), password=faker.word()
+        )
+        assert not client.logger.isEnabledFor(logging.WARNING)
+        assert client.logger.isEnabledFor(logging.ERROR)
 
         # Verbose
-        GLocalAuthenticationTokens(
+        verbose_client = GLocalAuthenticationTokens(
             username=faker.word(), password=faker.word(), verbose=True
         )
-        m_set_level.assert_called_once_with(logging.DEBUG)
+        assert verbose_client.logger.isEnabledFor(logging.DEBUG)
+
+        # Verbosity is per instance and the module logger is left alone
+        assert not client.logger.isEnabledFor(logging.WARNING)
+        assert logging.getLogger("glocaltokens.client").level == logging.NOTSET
+        with capture_logs("glocaltokens.client") as records:
+            client.get_android_id()
+            verbose_client.get_android_id()
+        messages = [record.getMessage() for record in records]
+        assert (
+            messages.count("There is no stored android_id, generating a new one") == 1
+        )
 
-    @patch("glocaltokens.client.LOGGER.error")
+        # Devices and discovery are logged at the level of their client
+        for logging_client, count in ((client, 0), (verbose_client, 1)):
+            with capture_logs("glocaltokens") as records:
+                Device(
+                    device_id=str(faker.uuid4()),
+                    device_name=faker.word(),
+                    local_auth_token=faker.local_auth_token(),
+                    logger=logging_client.logger,
+                )
+                # As created by discover_devices
+                scanner_logger = InstanceLogger(
+                    logging.getLogger("glocaltokens.scanner"),
+                    logging_client.logging_level,
+                )
+                CastListener(logger=scanner_logger).remove_service(
+                    mock.Mock(), "_googlecast._tcp.local.", faker.word()
+                )
+            assert (
+                len([r for r in records if "Initializing" in r.getMessage()]) == count
+            )
+            assert (
+                len([r for r in records if r.name == "glocaltokens.scanner"]) == count
+            )
+
+        # A level set by the application takes precedence
+        logger = logging.getLogger("glocaltokens.client")
+        self.addCleanup(logger.setLevel, logging.NOTSET)
+        logger.setLevel(logging.WARNING)
+        assert not verbose_client.logger.isEnabledFor(logging.DEBUG)
+        logger.setLevel(logging.DEBUG)
+        assert client.logger.isEnabledFor(logging.DEBUG)
+
+    @patch("glocaltokens.utils.logs.InstanceLogger.error")
     def test_initialization__invalid(self, m_log: NonCallableMock) -> None:
         """Invalid initialization tests."""
         # Without username
@@ -136,23 +211,48 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         # Make sure we get different generated mac string
         assert android_id != GLocalAuthenticationTokens._generate_android_id()
 
-    def test_has_expired(self) -> None:
-        """Test expiry method."""
-        duration_sec = 60
-        now = datetime.now()
-        token_dt_expired = now - timedelta(seconds=duration_sec + 1)
-        token_dt_non_expired = now - timedelta(seconds=duration_sec - 1)
-
-        # Expired
-        assert GLocalAuthenticationTokens._has_expired(token_dt_expired, duration_sec)
-
-        # Non expired
-        assert not GLocalAuthenticationTokens._has_expired(
-            token_dt_non_expired, duration_sec
-        )
+    @patch("gpsoauth.perform_oauth")
+    def test_access_token_expiry(self, m_perform_oauth: NonCallableMock) -> None:
+        """Test access token lifetime comes from the oauth response."""
+        self.client.master_token = faker.master_token()
+        lifetime = faker.pyint(min_value=TOKEN_REFRESH_MARGIN + 60, max_value=7200)
+        m_perform_oauth.return_value = {
+            "Auth": faker.access_token(),
+            "ExpiresInDurationSec": str(lifetime),
+        }
+        self.client.get_access_token()
+        assert self.client.access_token_expiry is not None
+        assert lifetime - 5 < self.client.access_token_expiry.remaining() <= lifetime
+
+        # Wall clock changes don't affect expiry
+        assert self.client.access_token_date is not None
+        self.client.access_token_date -= timedelta(days=1)
+        self.client.get_access_token()
+        assert m_perform_oauth.call_count == 1
 
-    @patch("glocaltokens.client.LOGGER.error")
-    @patch("glocaltokens.client.perform_master_login")
+        # Tokens expiring within the refresh margin are refreshed
+        self.client.access_token_expiry = Expiry.in_seconds(TOKEN_REFRESH_MARGIN - 1)
+        self.client.get_access_token()
+        assert m_perform_oauth.call_count == 2
+
+    def test_next_refresh_in(self) -> None:
+        """Test refresh time is derived from the stored expiries."""
+        assert self.client.next_refresh_in() is None
+
+        self.client.homegraph_expiry = Expiry.in_seconds(TOKEN_REFRESH_MARGIN + 600)
+        self.client.access_token_expiry = Expiry.in_seconds(TOKEN_REFRESH_MARGIN + 60)
+        refresh_in = self.client.next_refresh_in()
+        assert refresh_in is not None
+        assert 590 < refresh_in <= 600
+        refresh_in = self.client.next_refresh_in(include_access_token=True)
+        assert refresh_in is not None
+        assert 50 < refresh_in <= 60
+
+        self.client.homegraph_expiry = Expiry.in_seconds(-1)
+        assert self.client.next_refresh_in() == 0
+
+    @patch("glocaltokens.utils.logs.InstanceLogger.error")
+    @patch("gpsoauth.perform_master_login")
     def test_get_master_token(
         self, m_perform_master_login: NonCallableMock, m_log: NonCallableMock
     ) -> None:
@@ -193,9 +293,9 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         assert master_token is None
         assert m_log.call_count == 2
 
-    @patch("glocaltokens.client.LOGGER.error")
-    @patch("glocaltokens.client.perform_master_login")
-    @patch("glocaltokens.client.perform_oauth")
+    @patch("glocaltokens.utils.logs.InstanceLogger.error")
+    @patch("gpsoauth.perform_master_login")
+    @patch("gpsoauth.perform_oauth")
     def test_get_access_token(
         self,
         m_perform_oauth: NonCallableMock,
@@ -248,19 +348,16 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         assert m_perform_oauth.call_count == 0
 
         # Another request with expired token must return new token (new request)
-        assert self.client.access_token_date is not None
-        self.client.access_token_date = self.client.access_token_date - timedelta(
-            ACCESS_TOKEN_DURATION + 1
-        )
+        self.client.access_token_expiry = Expiry.in_seconds(-1)
         access_token = self.client.get_access_token()
         assert m_perform_oauth.call_count == 1
 
-    @patch("glocaltokens.client.grpc.ssl_channel_credentials")
-    @patch("glocaltokens.client.grpc.access_token_call_credentials")
-    @patch("glocaltokens.client.grpc.composite_channel_credentials")
-    @patch("glocaltokens.client.grpc.secure_channel")
-    @patch("glocaltokens.client.StructuresServiceStub")
-    @patch("glocaltokens.client.GetHomeGraphRequest")
+    @patch("grpc.ssl_channel_credentials")
+    @patch("grpc.access_token_call_credentials")
+    @patch("grpc.composite_channel_credentials")
+    @patch("grpc.secure_channel")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    @patch("ghome_foyer_api.api_pb2.GetHomeGraphRequest")
     @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
     def test_get_homegraph(
         self,
@@ -295,10 +392,7 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         assert m_get_access_token.call_count == 1
 
         # Expired homegraph
-        assert self.client.homegraph_date is not None
-        self.client.homegraph_date = self.client.homegraph_date - timedelta(
-            HOMEGRAPH_DURATION + 1
-        )
+        self.client.homegraph_expiry = Expiry.in_seconds(-1)
         self.client.get_homegraph()
         assert m_ssl_channel_credentials.call_count == 2
         assert m_access_token_call_credentials.call_count == 2
@@ -309,7 +403,7 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         assert m_get_access_token.call_count == 2
 
     @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
-    @patch("glocaltokens.client.StructuresServiceStub")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
     def test_get_homegraph_retries(
         self,
         m_structure_service_stub: NonCallableMock,
@@ -322,18 +416,33 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         rpc_error.code.return_value.name = "UNAUTHENTICATED"
         rpc_error.details = mock.Mock()  # type: ignore[method-assign]
         m_structure_service_stub.return_value.GetHomeGraph.side_effect = rpc_error
-        result = self.client.get_homegraph()
+        with profile() as report:
+            result = self.client.get_homegraph()
         assert result is None
         assert m_structure_service_stub.return_value.GetHomeGraph.call_count == 3
 
-    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph")
-    def test_get_google_devices(self, m_get_homegraph: NonCallableMock) -> None:
+        # Every attempt is in the profiling report
+        attempts = [
+            timing for timing in report.stages if timing.stage == "get_homegraph"
+        ]
+        assert [timing.detail for timing in attempts] == [
+            "auth_attempts=3",
+            "auth_attempts=2",
+            "auth_attempts=1",
+        ]
+        assert all(timing.failed for timing in attempts)
+        assert [timing.stage for timing in report.stages].count("channel") == 3
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph_devices")
+    def test_get_google_devices(self, m_get_homegraph_devices: NonCallableMock) -> None:
         """Test getting google devices."""
         # With just one device returned from homegraph
         fake_device_name = faker.word()
         fake_ip_address = faker.ipv4()
         homegraph_device = faker.homegraph_device(device_name=fake_device_name)
-        m_get_homegraph.return_value.home.devices = [homegraph_device]
+        m_get_homegraph_devices.return_value = project_homegraph(
+            faker.homegraph([homegraph_device])
+        )
 
         # With no discover_devices, with no model_list
         google_devices = self.client.get_google_devices(
@@ -357,10 +466,9 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         )  # setting invalid token intentionally
         # Note that we initialize the list with homegraph_device_invalid
         # which should be ignored
-        m_get_homegraph.return_value.home.devices = [
-            homegraph_device_invalid,
-            homegraph_device_valid,
-        ]
+        m_get_homegraph_devices.return_value = project_homegraph(
+            faker.homegraph([homegraph_device_invalid, homegraph_device_valid])
+        )
         google_devices = self.client.get_google_devices(
             disable_discovery=True,
             addresses={fake_device_name: fake_ip_address},
@@ -371,6 +479,188 @@ class GLocalAuthenticationTokensClientTests(DeviceAssertions, TypeAssertions, Te
         if google_devices[0].network_device is not None:
             assert google_devices[0].network_device.ip_address == fake_ip_address
 
+    @patch("glocaltokens.utils.dns.socket.getaddrinfo")
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph_devices")
+    def test_get_google_devices__host_names(
+        self,
+        m_get_homegraph_devices: NonCallableMock,
+        m_getaddrinfo: NonCallableMock,
+    ) -> None:
+        """Static addresses can be IPv6 addresses or host names, resolved once."""
+        items = [faker.homegraph_device(device_name=name) for name in "abc"]
+        m_get_homegraph_devices.return_value = project_homegraph(faker.homegraph(items))
+        ipv6_address = faker.ipv6()
+        resolved_address = faker.ipv4()
+
+        def getaddrinfo(host: str, *_args: object, **_kwargs: object) -> object:
+            if host != "kitchen.lan":
+                raise socket.gaierror
+            return [(0, 0, 0, "", (resolved_address, 0))]
+
+        m_getaddrinfo.side_effect = getaddrinfo
+        addresses = {"a": ipv6_address, "b": "kitchen.lan", "c": "unknown.lan"}
+
+        for _ in range(2):
+            google_devices = self.client.get_google_devices(
+                disable_discovery=True, addresses=addresses
+            )
+            assert [device.ip_address for device in google_devices] == [
+                ipv6_address,
+                resolved_address,
+                None,
+            ]
+        assert m_getaddrinfo.call_count == 2
+
+        # Not a host name
+        assert not self.client.get_google_devices(
+            disable_discovery=True, addresses={"a": "kitchen_lan"}
+        )
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_get_homegraph__compact(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_get_access_token: NonCallableMock,
+    ) -> None:
+        """Test compact homegraph storage keeps only the projection and raw bytes."""
+        m_get_access_token.return_value = faker.word()
+        homegraph = faker.homegraph()
+        m_structure_service_stub.return_value.GetHomeGraph.return_value = homegraph
+        client = GLocalAuthenticationTokens(
+            master_token=faker.master_token(), compact_homegraph=True
+        )
+
+        devices = client.get_homegraph_devices()
+        assert devices == project_homegraph(homegraph)
+        assert client.homegraph is None
+        assert m_structure_service_stub.return_value.GetHomeGraph.call_count == 1
+        topology = client.get_homegraph_topology()
+        assert topology is not None
+        assert topology[0].devices is devices
+
+        # Raw homegraph is lazily parsed from the stored response
+        assert client.get_homegraph() == homegraph
+        assert client.get_homegraph_devices() is devices
+        assert m_structure_service_stub.return_value.GetHomeGraph.call_count == 1
+
+        client.invalidate_homegraph()
+        assert client.homegraph_devices is None
+        assert client.homegraph_topology is None
+        assert client._homegraph_raw is None
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_report_auth_failure(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_get_access_token: NonCallableMock,
+    ) -> None:
+        """Test the homegraph is only fetched again for rejected tokens."""
+        m_get_access_token.return_value = faker.word()
+        m_get_homegraph = m_structure_service_stub.return_value.GetHomeGraph
+        m_get_homegraph.return_value = faker.homegraph()
+
+        devices = self.client.get_homegraph_devices()
+        assert devices is not None
+        self.client.get_homegraph_devices()
+        assert m_get_homegraph.call_count == 1
+        assert self.client.next_refresh_in() != 0
+
+        assert not self.client.report_auth_failure(faker.uuid4())
+        assert self.client.report_auth_failure(devices[0].device_id)
+        assert self.client.next_refresh_in() == 0
+        self.client.get_homegraph_devices()
+        self.client.get_homegraph_devices()
+        assert m_get_homegraph.call_count == 2
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph_devices")
+    def test_devices(self, m_get_homegraph_devices: NonCallableMock) -> None:
+        """Test the device index follows the stored homegraph."""
+        assert len(self.client.devices) == 0
+
+        fake_ip_address = faker.ipv4()
+        homegraph_devices = faker.homegraph_devices(count=2)
+        for homegraph_device in homegraph_devices:
+            homegraph_device.device_info.device_id = str(faker.uuid4())
+        homegraph_devices[1].local_auth_token = faker.word()
+        self.client.homegraph_devices = project_homegraph(
+            faker.homegraph(homegraph_devices)
+        )
+        m_get_homegraph_devices.return_value = self.client.homegraph_devices
+        self.client.get_google_devices(
+            disable_discovery=True,
+            addresses={homegraph_devices[0].device_name: fake_ip_address},
+        )
+
+        devices = self.client.devices
+        assert devices is self.client.devices
+        assert len(devices) == 1
+        device = devices.get(homegraph_devices[0].device_info.device_id)
+        assert device is not None
+        assert devices.by_model(homegraph_devices[0].hardware.model) == (device,)
+        assert devices.by_ip(fake_ip_address) == (device,)
+        assert devices.get(homegraph_devices[1].device_info.device_id) is None
+
+        self.client.invalidate_homegraph()
+        assert len(self.client.devices) == 0
+        m_get_homegraph_devices.assert_called_once()
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph")
+    def test_join_devices(self, m_get_homegraph: NonCallableMock) -> None:
+        """Test stored devices are joined with network devices without fetching."""
+        assert self.client.join_devices([]) is None
+
+        homegraph_devices = faker.homegraph_devices(count=1)
+        self.client.homegraph_devices = project_homegraph(
+            faker.homegraph(homegraph_devices)
+        )
+        # Expired, but nothing is fetched
+        self.client.homegraph_expiry = Expiry.in_seconds(0)
+        item = homegraph_devices[0]
+        network_device = NetworkDevice(
+            item.device_name,
+            faker.ipv4(),
+            8009,
+            item.hardware.model,
+            item.device_info.agent_info.unique_id,
+        )
+        devices = self.client.join_devices([network_device])
+        assert devices is not None
+        assert [device.network_device for device in devices] == [network_device]
+        assert self.client.join_devices([], models_list=[faker.word()]) == []
+        m_get_homegraph.assert_not_called()
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_homegraph")
+    def test_save_and_load_homegraph(self, m_get_homegraph: NonCallableMock) -> None:
+        """Test homegraph snapshots are loaded without network."""
+        homegraph = faker.homegraph()
+        with TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "homegraph.bin"
+
+            # Nothing to save yet
+            assert not self.client.save_homegraph(path)
+
+            self.client._store_homegraph(homegraph)
+            assert self.client.save_homegraph(path)
+
+            client = GLocalAuthenticationTokens(master_token=faker.master_token())
+            assert client.load_homegraph(path)
+            assert client.homegraph == homegraph
+            assert client.homegraph_date == self.client.homegraph_date
+            assert client.get_homegraph_devices() == project_homegraph(homegraph)
+            assert m_get_homegraph.call_count == 0
+
+            # Snapshots older than max_age are rejected
+            client.invalidate_homegraph()
+            assert not client.load_homegraph(path, max_age=-1)
+            assert client.homegraph_devices is None
+
+            # Missing and invalid files are rejected
+            assert not client.load_homegraph(Path(tmp_dir) / "missing.bin")
+            path.write_bytes(b"invalid")
+            assert not client.load_homegraph(path)
+
     @patch("glocaltokens.client.GLocalAuthenticationTokens.get_google_devices")
     def test_get_google_devices_json(
         self, m_get_google_devices: NonCallableMock
@@ -451,3 +741,30 @@ class DeviceClientTests(TypeAssertions, TestCase):
         )
         assert m_log.call_count == 1
         assert device.local_auth_token is None
+
+    def test_logging_overhead(self) -> None:
+        """Test creating devices formats nothing with debug logging off."""
+        network_device = NetworkDevice(
+            faker.word(), faker.ipv4(), faker.port_number(), faker.word(), faker.word()
+        )
+        local_auth_token = faker.local_auth_token()
+        items = [(str(faker.uuid4()), faker.word()) for _ in range(200)]
+
+        def create_devices() -> None:
+            for device_id, device_name in items:
+                Device(
+                    device_id=device_id,
+                    device_name=device_name,
+                    local_auth_token=local_auth_token,
+                    network_device=network_device,
+                )
+
+        # Nothing is formatted or censored for records that are not emitted
+        with patch("glocaltokens.client.Censored.__str__", autospec=True) as m_str:
+            with patch("glocaltokens.client.LOGGER.debug") as m_debug:
+                create_devices()
+            assert m_debug.call_count == 0
+        assert m_str.call_count == 0
+
+        with self.assertLogs("glocaltokens.client", logging.DEBUG):
+            create_devices()
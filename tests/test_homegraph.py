@@ -0,0 +1,91 @@
+"""Homegraph helpers specific tests."""
+
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from faker import Faker
+import pytest
+
+from glocaltokens.homegraph import (
+    HomegraphDevice,
+    HomegraphHome,
+    HomegraphRoom,
+    dump_snapshot,
+    load_snapshot,
+    project_homegraph,
+    project_topology,
+    read_snapshot,
+    save_snapshot,
+)
+from tests.factory.providers import HomegraphProvider
+
+faker = Faker()
+faker.add_provider(HomegraphProvider)
+
+
+class HomegraphTests(TestCase):
+    """Homegraph projection and snapshot tests."""
+
+    def test_project_homegraph(self) -> None:
+        """Projection keeps the fields needed to build devices."""
+        homegraph = faker.homegraph()
+        devices = project_homegraph(homegraph)
+        assert len(devices) == len(homegraph.home.devices)
+        for device, item in zip(devices, homegraph.home.devices):
+            assert device == HomegraphDevice(
+                device_id=item.device_info.device_id,
+                device_name=item.device_name,
+                local_auth_token=item.local_auth_token,
+                model=item.hardware.model,
+                unique_id=item.device_info.agent_info.unique_id,
+            )
+
+    def test_project_topology(self) -> None:
+        """Topology keeps the home, its rooms and the projected devices."""
+        homegraph = faker.homegraph()
+        homegraph.home.home_id = faker.uuid4()
+        homegraph.home.home_name = faker.word()
+        room = homegraph.home.rooms.add(room_id=faker.uuid4(), room_name=faker.word())
+        room.category.name = "Kitchen"
+        devices = project_homegraph(homegraph)
+
+        assert project_topology(homegraph, devices) == (
+            HomegraphHome(
+                home_id=homegraph.home.home_id,
+                home_name=homegraph.home.home_name,
+                rooms=(HomegraphRoom(room.room_id, room.room_name, "Kitchen"),),
+                devices=devices,
+            ),
+        )
+        assert project_topology(homegraph)[0].devices == devices
+        assert not project_topology(type(homegraph)())
+
+    def test_snapshot_roundtrip(self) -> None:
+        """Snapshot keeps the homegraph and its fetch time."""
+        homegraph = faker.homegraph()
+        fetched_at = datetime.now()
+
+        snapshot = load_snapshot(dump_snapshot(homegraph, fetched_at))
+        assert snapshot.homegraph == homegraph
+        assert snapshot.fetched_at == fetched_at
+
+        with TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "homegraph.bin"
+            save_snapshot(path, homegraph, fetched_at)
+            assert read_snapshot(path) == snapshot
+            # Temporary file used for the atomic write is gone
+            assert [file.name for file in Path(tmp_dir).iterdir()] == [path.name]
+
+    def test_snapshot_invalid(self) -> None:
+        """Invalid snapshots raise ValueError."""
+        data = dump_snapshot(faker.homegraph(), datetime.now())
+        with pytest.raises(ValueError, match="truncated"):
+            load_snapshot(data[:4])
+        with pytest.raises(ValueError, match="not a homegraph snapshot"):
+            load_snapshot(b"X" + data[1:])
+        with pytest.raises(ValueError, match="corrupted"):
+            load_snapshot(data + b"\xff")
@@ -0,0 +1,55 @@
+"""Import specific tests."""
+
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+HEAVY_MODULES = ["ghome_foyer_api", "google.protobuf", "gpsoauth", "grpc", "zeroconf"]
+
+# Imports the given module in a fresh interpreter and reports which heavy
+# modules it pulled in.
+LOADED_SCRIPT = """
+import importlib, json, sys
+
+importlib.import_module(sys.argv[1])
+print(json.dumps([name for name in json.loads(sys.argv[2]) if name in sys.modules]))
+"""
+
+
+def loaded_heavy_modules(module: str) -> list[str]:
+    """Import module in a fresh interpreter and return the heavy modules loaded."""
+    output = subprocess.run(
+        [sys.executable, "-c", LOADED_SCRIPT, module, json.dumps(HEAVY_MODULES)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    loaded: list[str] = json.loads(output)
+    return loaded
+
+
+class ImportTests(TestCase):
+    """Import tests."""
+
+    def test_lazy_imports(self) -> None:
+        """Heavy dependencies are not imported until they are used."""
+        for module in ("glocaltokens.client", "glocaltokens.cli"):
+            with self.subTest(module=module):
+                assert loaded_heavy_modules(module) == []
+
+    def test_no_logging_configuration(self) -> None:
+        """Importing the client doesn't configure the root logger."""
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import logging, glocaltokens.client; print(len(logging.root.handlers))",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        assert output.strip() == "0"
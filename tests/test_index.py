@@ -0,0 +1,70 @@
+"""Device index specific unittests."""
+
+from __future__ import annotations
+
+from unittest import TestCase
+
+from faker import Faker
+from faker.providers import internet
+
+from glocaltokens.client import Device
+from glocaltokens.index import DeviceIndex
+from glocaltokens.types import NetworkDevice
+from tests.factory.providers import TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(internet)
+
+
+def create_device(name: str, model: str, ip_address: str | None = None) -> Device:
+    """Create a device with a valid local auth token."""
+    device_id = str(faker.uuid4())
+    network_device = None
+    if ip_address is not None:
+        network_device = NetworkDevice(name, ip_address, 8009, model, device_id)
+    return Device(
+        device_id=device_id,
+        device_name=name,
+        local_auth_token=faker.local_auth_token(),
+        network_device=network_device,
+        hardware=model,
+    )
+
+
+class DeviceIndexTests(TestCase):
+    """DeviceIndex specific unittests."""
+
+    def test_lookups(self) -> None:
+        """Test looking devices up by id, name, model and IP address."""
+        ip_address = faker.ipv4()
+        kitchen = create_device("Kitchen", "Google Home Mini", ip_address)
+        speaker_group = create_device("Kitchen", "Google Cast Group", ip_address)
+        bedroom = create_device("Bedroom", "Google Nest Mini")
+        index = DeviceIndex([kitchen, speaker_group, bedroom])
+
+        assert len(index) == 3
+        assert list(index) == [kitchen, speaker_group, bedroom]
+        assert bedroom.device_id in index
+        assert index.get(bedroom.device_id) is bedroom
+        assert index.get(str(faker.uuid4())) is None
+        assert index.by_name("Kitchen") == (kitchen, speaker_group)
+        assert not index.by_name("Office")
+        assert index.by_model("Google Home Mini") == (kitchen,)
+        assert index.by_model("Google Nest Mini", "Google Home Mini") == (
+            kitchen,
+            bedroom,
+        )
+        assert index.by_ip(ip_address) == (kitchen, speaker_group)
+        assert index.models() == {
+            "Google Home Mini",
+            "Google Cast Group",
+            "Google Nest Mini",
+        }
+
+    def test_empty(self) -> None:
+        """Test an empty index."""
+        index = DeviceIndex()
+        assert len(index) == 0
+        assert index.get(str(faker.uuid4())) is None
+        assert not index.by_model(faker.word())
@@ -0,0 +1,177 @@
+"""Client registry specific tests."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+import time
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+
+from glocaltokens.homegraph import project_homegraph
+from glocaltokens.registry import ClientRegistry
+from glocaltokens.store import TokenStore
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+
+class ClientRegistryTests(TestCase):
+    """ClientRegistry tests."""
+
+    def setUp(self) -> None:
+        """Set up an empty registry."""
+        self.registry = ClientRegistry()
+
+    def test_get(self) -> None:
+        """One client is created per account."""
+        username = faker.email()
+        client = self.registry.get(username=username, password=faker.word())
+        assert client is not None
+        assert self.registry.get(username=username.upper()) is client
+
+        master_token = faker.master_token()
+        other_client = self.registry.get(master_token=master_token)
+        assert other_client is not None
+        assert other_client is not client
+        assert self.registry.get(master_token=master_token) is other_client
+        assert len(self.registry) == 2
+
+        assert self.registry.get() is None
+
+        assert self.registry.remove(username=username) is client
+        assert self.registry.get(username=username, password=faker.word()) is not client
+        self.registry.clear()
+        assert len(self.registry) == 0
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_shared_between_threads(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_get_access_token: NonCallableMock,
+    ) -> None:
+        """Threads sharing a client only fetch the homegraph once."""
+        m_get_access_token.return_value = faker.access_token()
+        homegraph = faker.homegraph()
+
+        def get_homegraph(_request: object) -> object:
+            time.sleep(0.05)
+            return homegraph
+
+        m_structure_service_stub.return_value.GetHomeGraph.side_effect = get_homegraph
+        master_token = faker.master_token()
+
+        def worker(_index: int) -> object:
+            client = self.registry.get(master_token=master_token)
+            assert client is not None
+            return client.get_homegraph_devices()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(worker, range(16)))
+
+        assert results == [project_homegraph(homegraph)] * 16
+        assert m_structure_service_stub.return_value.GetHomeGraph.call_count == 1
+        assert len(self.registry) == 1
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_get__while_fetching(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_get_access_token: NonCallableMock,
+    ) -> None:
+        """Handing out a client doesn't wait for its homegraph being fetched."""
+        m_get_access_token.return_value = faker.access_token()
+        homegraph = faker.homegraph()
+        started, released = Event(), Event()
+
+        def get_homegraph(_request: object) -> object:
+            started.set()
+            released.wait()
+            return homegraph
+
+        m_structure_service_stub.return_value.GetHomeGraph.side_effect = get_homegraph
+        self.addCleanup(released.set)
+        master_token = faker.master_token()
+        client = self.registry.get(master_token=master_token)
+        assert client is not None
+        fetch = Thread(target=client.get_homegraph_devices)
+        fetch.start()
+        assert started.wait(5)
+
+        get = Thread(target=self.registry.get, kwargs={"master_token": master_token})
+        get.start()
+        get.join(5)
+        assert not get.is_alive()
+
+        # Measured again once stored
+        size = self.registry.memory_size
+        released.set()
+        fetch.join(5)
+        assert self.registry.memory_size > size
+        client.invalidate_homegraph()
+        assert self.registry.memory_size == size
+
+    def test_eviction__without_store(self) -> None:
+        """Clients are never evicted without a store to load them from."""
+        registry = ClientRegistry(max_clients=1)
+        for _ in range(2):
+            registry.get(master_token=faker.master_token())
+        assert len(registry) == 2
+        assert registry.evictions == 0
+
+    @patch("gpsoauth.perform_oauth")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_eviction(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_perform_oauth: NonCallableMock,
+    ) -> None:
+        """Evicted clients are created again from the store without fetching."""
+        m_perform_oauth.return_value = {
+            "Auth": faker.access_token(),
+            "ExpiresInDurationSec": "3600",
+        }
+        m_get_homegraph = m_structure_service_stub.return_value.GetHomeGraph
+        m_get_homegraph.return_value = faker.homegraph()
+        tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        store = TokenStore(Path(tmp_dir.name) / "tokens.db")
+        self.addCleanup(store.close)
+        registry = ClientRegistry(store=store, max_clients=2)
+
+        username, master_token = faker.email(), faker.master_token()
+        client = registry.get(
+            username=username, password=faker.word(), master_token=master_token
+        )
+        assert client is not None
+        devices = client.get_homegraph_devices()
+        assert registry.get(username=username) is client
+        size = registry.memory_size
+        assert size > len(master_token) + len(client.access_token or "")
+
+        for _ in range(2):
+            registry.get(master_token=faker.master_token())
+        assert len(registry) == 2
+        assert registry.evictions == 1
+        assert registry.memory_size < size
+
+        # Rehydrated from the store, with the saved master token
+        client = registry.get(username=username)
+        assert client is not None
+        assert client.master_token == master_token
+        assert client.get_homegraph_devices() == devices
+        assert m_perform_oauth.call_count == 1
+        assert m_get_homegraph.call_count == 1
+
+        # Bounded by memory, the client just used is kept
+        registry.max_memory = 1
+        assert registry.get(username=username) is client
+        assert len(registry) == 1
@@ -0,0 +1,101 @@
+"""Token rotation tracking specific tests."""
+
+from __future__ import annotations
+
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+
+from glocaltokens.const import ROTATION_MIN_INTERVAL
+from glocaltokens.homegraph import HomegraphDevice
+from glocaltokens.rotation import TokenRotation, TokenRotationTracker
+from tests.factory.providers import TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+
+
+def homegraph_device(device_id: str, local_auth_token: str) -> HomegraphDevice:
+    """Return a homegraph device with the given token."""
+    return HomegraphDevice(
+        device_id=device_id,
+        device_name=faker.word(),
+        local_auth_token=local_auth_token,
+        model=faker.word(),
+        unique_id=faker.uuid4(),
+    )
+
+
+class TokenRotationTrackerTests(TestCase):
+    """TokenRotationTracker tests."""
+
+    def setUp(self) -> None:
+        """Set up a tracker with a controllable clock."""
+        patcher = patch("glocaltokens.rotation.time")
+        self.m_time: NonCallableMock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.m_time.monotonic.return_value = 1000.0
+        self.tracker = TokenRotationTracker()
+        self.device_id = faker.uuid4()
+
+    def observe(self, now: float, local_auth_token: str) -> None:
+        """Observe the token of the tracked device at the given time."""
+        self.m_time.monotonic.return_value = now
+        self.tracker.observe([homegraph_device(self.device_id, local_auth_token)])
+
+    def test_observe(self) -> None:
+        """Interval is only known after the token was seen changing twice."""
+        tokens = [faker.local_auth_token() for _ in range(3)]
+        self.observe(1000, tokens[0])
+        self.observe(1500, tokens[0])
+        assert self.tracker.get(self.device_id) == TokenRotation(
+            tokens[0], first_seen=1000, last_seen=1500, last_changed=1000
+        )
+
+        self.observe(2000, tokens[1])
+        rotation = self.tracker.get(self.device_id)
+        assert rotation is not None
+        assert (rotation.changes, rotation.interval) == (1, None)
+        assert self.tracker.shortest_interval() is None
+
+        self.observe(5000, tokens[2])
+        rotation = self.tracker.get(self.device_id)
+        assert rotation is not None
+        assert (rotation.changes, rotation.interval) == (2, 3000)
+        assert rotation.next_rotation() == 8000
+        assert self.tracker.shortest_interval() == 3000
+
+        # Quick successive rotations don't shorten it below the minimum
+        self.observe(5005, tokens[0])
+        assert self.tracker.shortest_interval() == ROTATION_MIN_INTERVAL
+
+        # Devices gone from the homegraph are forgotten
+        self.tracker.observe([])
+        assert len(self.tracker) == 0
+
+    def test_needs_refresh(self) -> None:
+        """Refresh is needed on auth failures and right before predicted rotations."""
+        tokens = [faker.local_auth_token() for _ in range(3)]
+        for now, token in zip((1000, 2000, 5000), tokens):
+            self.observe(now, token)
+        assert not self.tracker.needs_refresh(margin=60)
+        assert self.tracker.next_refresh_in(margin=60) == 8000 - 60 - 5000
+
+        self.m_time.monotonic.return_value = 7940
+        assert self.tracker.needs_refresh(margin=60)
+        assert self.tracker.next_refresh_in(margin=60) == 0
+
+        # Token didn't rotate as predicted, don't refresh again
+        self.observe(7940, tokens[-1])
+        assert not self.tracker.needs_refresh(margin=60)
+        assert self.tracker.next_refresh_in(margin=60) is None
+
+        assert self.tracker.report_auth_failure(self.device_id)
+        assert not self.tracker.report_auth_failure(faker.uuid4())
+        assert self.tracker.needs_refresh(margin=60)
+        assert self.tracker.next_refresh_in(margin=60) == 0
+
+        # Failures are cleared by a fresh homegraph
+        self.observe(8000, faker.local_auth_token())
+        assert not self.tracker.needs_refresh(margin=60)
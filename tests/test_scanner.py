@@ -2,13 +2,24 @@
 
 from __future__ import annotations
 
+import asyncio
 from unittest import TestCase, mock
 from unittest.mock import NonCallableMock, patch
 
 from faker import Faker
 from faker.providers import internet as internet_provider, python as python_provider
 
-from glocaltokens.scanner import CastListener, NetworkDevice
+from glocaltokens.const import GOOGLE_CAST_GROUP
+from glocaltokens.scanner import (
+    CastListener,
+    DiscoveryEvent,
+    DiscoveryEventType,
+    NetworkDevice,
+    async_iter_discovery_events,
+    discover_devices,
+    iter_discovery_events,
+)
+from glocaltokens.utils.discovery_stats import DiscoveryStats
 
 faker = Faker()
 faker.add_provider(internet_provider)
@@ -35,7 +46,8 @@ class NetworkDeviceTests(TestCase):
 
         assert (
             f"NetworkDevice(name='{name}', ip_address='{ip_address}', "
-            f"port={port}, model='{model}', unique_id='{unique_id}')" == str(device)
+            f"port={port}, model='{model}', unique_id='{unique_id}', "
+            "addresses=())" == str(device)
         )
 
     @patch("glocaltokens.scanner.LOGGER.error")
@@ -88,3 +100,173 @@ class NetworkDeviceTests(TestCase):
 
         # No devices should be added
         assert listener.count == 0
+
+    def test_service_info__addresses(self) -> None:
+        """Every address is kept, link-local ones are not preferred."""
+        service = _cast_service(faker.word())
+        ipv4_address = faker.ipv4_private()
+        ipv6_address = faker.ipv6()
+        service.parsed_addresses.return_value = [
+            "fe80::1",
+            "fe80::2%3",
+            ipv4_address,
+            ipv6_address,
+        ]
+        zc = mock.Mock(name="Zeroconf")
+        zc.get_service_info.return_value = service
+        listener = CastListener()
+        name = faker.word()
+        listener.add_service(zc, faker.word(), name)
+
+        device = listener.devices[name]
+        assert device.ip_address == ipv4_address
+        # Scoped addresses can't be used as device addresses
+        assert device.addresses == ("fe80::1", ipv4_address, ipv6_address)
+
+    def test_callbacks_receive_device(self) -> None:
+        """Listener callbacks are called with the affected device."""
+        added: list[NetworkDevice] = []
+        removed: list[NetworkDevice] = []
+        listener = CastListener(
+            add_callback=added.append, remove_callback=removed.append
+        )
+        zc = mock.Mock(name="Zeroconf")
+        zc.get_service_info.return_value = _cast_service(faker.word())
+        name = faker.word()
+
+        listener.add_service(zc, faker.word(), name)
+        assert added == [listener.devices[name]]
+
+        listener.remove_service(zc, faker.word(), name)
+        assert removed == added
+        assert listener.count == 0
+
+        # Unknown services are not reported as removed
+        listener.remove_service(zc, faker.word(), faker.word())
+        assert len(removed) == 1
+
+
+def _cast_service(model: str) -> NonCallableMock:
+    """Create a resolved cast service mock of the given model."""
+    service = mock.Mock(name="Service")
+    service.parsed_addresses.return_value = [faker.ipv4_private()]
+    service.port = faker.port_number()
+    service.properties = {
+        b"md": model.encode("utf-8"),
+        b"fn": faker.word().encode("utf-8"),
+        b"cd": faker.uuid4().encode("utf-8"),
+    }
+    return service
+
+
+class DiscoveryEventsTests(TestCase):
+    """Streaming discovery API tests."""
+
+    def setUp(self) -> None:
+        """Make the patched ServiceBrowser announce a device and a cast group."""
+        self.zc = mock.Mock(name="Zeroconf")
+        self.zc.get_service_info.side_effect = [
+            _cast_service(GOOGLE_CAST_GROUP),
+            _cast_service("Google Home"),
+        ]
+
+        def browse(
+            zc: NonCallableMock, type_: str, listener: CastListener
+        ) -> NonCallableMock:
+            listener.add_service(zc, type_, "group")
+            listener.add_service(zc, type_, "speaker")
+            listener.remove_service(zc, type_, "speaker")
+            return self.service_browser
+
+        self.service_browser = mock.Mock(name="ServiceBrowser")
+        patcher = patch("glocaltokens.scanner.ServiceBrowser", side_effect=browse)
+        self.m_service_browser = patcher.start()
+        self.addCleanup(patcher.stop)
+        # Nothing in the zeroconf cache
+        patcher = patch("glocaltokens.scanner.ServiceInfo")
+        self.m_service_info = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.m_service_info.return_value.properties = {}
+
+    def test_iter_discovery_events(self) -> None:
+        """Events are streamed in order and cast groups are skipped."""
+        events = list(iter_discovery_events(timeout=0.1, zeroconf_instance=self.zc))
+        assert [event.type for event in events] == [
+            DiscoveryEventType.ADD,
+            DiscoveryEventType.REMOVE,
+        ]
+        assert events[0].device.model == "Google Home"
+        assert events[0].device == events[1].device
+        self.service_browser.cancel.assert_called_once()
+        # Caller owned zeroconf instance is left open
+        assert self.zc.close.call_count == 0
+
+    def test_iter_discovery_events__early_stop(self) -> None:
+        """Browsing stops as soon as the caller stops iterating."""
+        events = iter_discovery_events(timeout=None, zeroconf_instance=self.zc)
+        first = next(events)
+        events.close()
+        assert first.type == DiscoveryEventType.ADD
+        self.service_browser.cancel.assert_called_once()
+
+    def test_async_iter_discovery_events(self) -> None:
+        """Async iterator yields the same events as the sync one."""
+
+        async def collect() -> list[DiscoveryEvent]:
+            return [
+                event
+                async for event in async_iter_discovery_events(
+                    models_list=["Google Home"],
+                    timeout=0.1,
+                    zeroconf_instance=self.zc,
+                )
+            ]
+
+        events = asyncio.run(collect())
+        assert [event.type for event in events] == [
+            DiscoveryEventType.ADD,
+            DiscoveryEventType.REMOVE,
+        ]
+        self.service_browser.cancel.assert_called_once()
+
+    def test_discover_devices__filter(self) -> None:
+        """Unwanted services are not resolved when their TXT record is cached."""
+        speaker = _cast_service("Google Home")
+        self.zc.get_service_info.side_effect = [speaker]
+        # The TXT record of the group was announced
+        self.m_service_info.side_effect = lambda _type, name: mock.Mock(
+            properties=(
+                {b"md": GOOGLE_CAST_GROUP.encode("utf-8")} if name == "group" else {}
+            )
+        )
+        unique_id = speaker.properties[b"cd"].decode("utf-8")
+
+        def browse(
+            zc: NonCallableMock, type_: str, listener: CastListener
+        ) -> NonCallableMock:
+            listener.add_service(zc, type_, "group")
+            listener.add_service(zc, type_, "speaker")
+            return self.service_browser
+
+        self.m_service_browser.side_effect = browse
+
+        devices = discover_devices(
+            unique_ids=[unique_id], max_devices=1, zeroconf_instance=self.zc
+        )
+        assert [device.unique_id for device in devices] == [unique_id]
+        assert self.zc.get_service_info.call_count == 1
+
+    def test_discover_devices__stats(self) -> None:
+        """Discoveries are recorded in the stats of the network."""
+        stats = DiscoveryStats()
+        with patch("glocaltokens.scanner.current_network", return_value="lan"):
+            # Offline devices of the homegraph are counted in max_devices
+            discover_devices(
+                max_devices=3, timeout=0.01, zeroconf_instance=self.zc, stats=stats
+            )
+        samples = stats.samples("lan")
+        assert len(samples) == 1
+        assert samples[0].devices == 0
+        # Only devices found before are expected
+        assert samples[0].complete
+        assert samples[0].first_response is not None
@@ -0,0 +1,169 @@
+"""Refresh scheduler specific tests."""
+
+from __future__ import annotations
+
+from threading import Lock
+import time
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+import pytest
+
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.const import REFRESH_MIN_INTERVAL, TOKEN_REFRESH_MARGIN
+from glocaltokens.homegraph import project_homegraph
+from glocaltokens.scheduler import FleetScheduler, RefreshScheduler
+from glocaltokens.utils.expiry import Expiry
+from tests.factory.providers import HomegraphProvider
+
+faker = Faker()
+faker.add_provider(HomegraphProvider)
+
+
+class RefreshSchedulerTests(TestCase):
+    """RefreshScheduler tests."""
+
+    def setUp(self) -> None:
+        """Set up a client whose homegraph fetch is mocked."""
+        self.client = GLocalAuthenticationTokens(master_token=faker.master_token())
+        patcher = patch.object(self.client, "get_homegraph")
+        self.m_get_homegraph: NonCallableMock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def fetch(_auth_attempts: int = 3) -> object:
+            homegraph = faker.homegraph()
+            self.client.homegraph_devices = project_homegraph(homegraph)
+            self.client.homegraph_expiry = Expiry.in_seconds(self.lifetime)
+            return homegraph
+
+        self.lifetime = TOKEN_REFRESH_MARGIN + 600
+        self.m_get_homegraph.side_effect = fetch
+
+    def test_refresh(self) -> None:
+        """Refresh only fetches when needed and returns the next refresh delay."""
+        scheduler = RefreshScheduler(self.client)
+        delay = scheduler.refresh()
+        assert 590 < delay <= 600
+        assert self.m_get_homegraph.call_count == 1
+
+        # Homegraph still fresh, nothing fetched
+        scheduler.refresh()
+        assert self.m_get_homegraph.call_count == 1
+
+        # Never schedules a busy loop
+        self.lifetime = 0
+        self.client.homegraph_expiry = Expiry.in_seconds(-1)
+        assert scheduler.refresh() == REFRESH_MIN_INTERVAL
+
+    def test_refresh__failure(self) -> None:
+        """Failed refreshes are retried after the retry interval."""
+        self.m_get_homegraph.side_effect = None
+        self.m_get_homegraph.return_value = None
+        scheduler = RefreshScheduler(self.client, retry_interval=42)
+        assert scheduler.refresh() == 42
+
+    def test_start_stop(self) -> None:
+        """Background thread refreshes right away and stops on request."""
+        scheduler = RefreshScheduler(self.client)
+        scheduler.start()
+        deadline = time.monotonic() + 5
+        while self.m_get_homegraph.call_count == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        scheduler.stop()
+        assert self.m_get_homegraph.call_count == 1
+        assert self.client.homegraph_devices is not None
+
+
+class FleetSchedulerTests(TestCase):
+    """FleetScheduler tests."""
+
+    def setUp(self) -> None:
+        """Set up clients whose homegraph fetches are mocked and counted."""
+        self.lock = Lock()
+        self.running = 0
+        self.max_running = 0
+        self.fetched: list[GLocalAuthenticationTokens] = []
+        self.clients = [
+            self.create_client(lifetime=TOKEN_REFRESH_MARGIN + 600) for _ in range(6)
+        ]
+
+    def create_client(self, lifetime: float) -> GLocalAuthenticationTokens:
+        """Create a client whose homegraph fetch takes a while."""
+        client = GLocalAuthenticationTokens(master_token=faker.master_token())
+
+        def fetch(_auth_attempts: int = 3) -> object:
+            with self.lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.02)
+            homegraph = faker.homegraph()
+            client.homegraph_devices = project_homegraph(homegraph)
+            client.homegraph_expiry = Expiry.in_seconds(lifetime)
+            with self.lock:
+                self.running -= 1
+                self.fetched.append(client)
+            return homegraph
+
+        patcher = patch.object(client, "get_homegraph", side_effect=fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return client
+
+    def wait_for(self, fetches: int) -> None:
+        """Wait until the homegraph was fetched a number of times."""
+        deadline = time.monotonic() + 5
+        while len(self.fetched) < fetches and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_budget(self) -> None:
+        """Refreshes are bounded by the concurrency and rate budgets."""
+        scheduler = FleetScheduler(self.clients, max_concurrency=2, rate=100)
+        stats = scheduler.stats()
+        assert stats.scheduled == 6
+        assert stats.queue_depth == 6
+        scheduler.start()
+        self.wait_for(6)
+        scheduler.stop()
+        assert sorted(map(id, self.fetched)) == sorted(map(id, self.clients))
+        assert self.max_running == 2
+        stats = scheduler.stats()
+        # Nothing is due again before the homegraphs expire
+        assert stats.queue_depth == 0
+        assert stats.in_flight == 0
+        assert stats.scheduled == 6
+        assert stats.refreshes == 6
+
+        # At most rate refreshes start per second
+        clients = [
+            self.create_client(lifetime=TOKEN_REFRESH_MARGIN + 600) for _ in range(3)
+        ]
+        scheduler = FleetScheduler(clients, rate=20)
+        start = time.monotonic()
+        scheduler.start()
+        self.wait_for(9)
+        scheduler.stop()
+        assert len(self.fetched) == 9
+        assert time.monotonic() - start >= 2 / 20
+
+    def test_invalid_budget(self) -> None:
+        """A budget that doesn't allow any refresh is rejected."""
+        for rate in (0, -1):
+            with self.subTest(rate=rate), pytest.raises(ValueError, match="rate"):
+                FleetScheduler(self.clients, rate=rate)
+        with pytest.raises(ValueError, match="max_concurrency"):
+            FleetScheduler(self.clients, max_concurrency=0)
+
+    def test_priority(self) -> None:
+        """The client expiring first is refreshed first, removed ones never."""
+        scheduler = FleetScheduler(max_concurrency=1, rate=100, jitter=0)
+        expiring = self.create_client(lifetime=TOKEN_REFRESH_MARGIN + 0.05)
+        for client in (*self.clients[:2], expiring):
+            scheduler.add(client)
+        scheduler.remove(self.clients[1])
+        scheduler.start()
+        self.wait_for(3)
+        scheduler.stop()
+        # Refreshed on start, then again right before it expires
+        assert self.fetched == [self.clients[0], expiring, expiring]
+        assert scheduler.stats().scheduled == 2
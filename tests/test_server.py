@@ -0,0 +1,214 @@
+"""HTTP server specific tests."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from threading import Event
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.const import TOKEN_REFRESH_MARGIN
+from glocaltokens.homegraph import project_homegraph
+from glocaltokens.server import TokenServer
+from glocaltokens.types import NetworkDevice
+from glocaltokens.utils.expiry import Expiry
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+
+class TokenServerTests(IsolatedAsyncioTestCase):
+    """TokenServer tests."""
+
+    async def asyncSetUp(self) -> None:
+        """Start a server whose client fetches are held until released."""
+        self.client = GLocalAuthenticationTokens(master_token=faker.master_token())
+        self.homegraph = faker.homegraph(faker.homegraph_devices(count=2))
+        for item in self.homegraph.home.devices:
+            item.device_info.device_id = str(faker.uuid4())
+        self.released = Event()
+
+        def fetch(_auth_attempts: int = 3) -> object:
+            self.released.wait()
+            self.client.homegraph_devices = project_homegraph(self.homegraph)
+            self.client.homegraph_expiry = Expiry.in_seconds(3600)
+            return self.homegraph
+
+        patcher = patch.object(self.client, "get_homegraph", side_effect=fetch)
+        self.m_get_homegraph: NonCallableMock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.released.set)
+
+        await self.start_server(TokenServer([self.client], disable_discovery=True))
+
+    async def start_server(self, server: TokenServer) -> None:
+        """Start a server and connect to it."""
+        self.server = server
+        port = await server.start(port=0)
+        self.addAsyncCleanup(server.stop)
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        self.addCleanup(self.writer.close)
+
+    async def request(
+        self, path: str, headers: dict[str, str] | None = None
+    ) -> tuple[int, dict[str, str], bytes]:
+        """Send a GET request on the connection and read the response."""
+        lines = [f"GET {path} HTTP/1.1", "Host: localhost"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        status_line = await self.reader.readline()
+        response_headers: dict[str, str] = {}
+        while (line := await self.reader.readline()) != b"\r\n":
+            name, _, value = line.decode().partition(":")
+            response_headers[name.lower()] = value.strip()
+        body = await self.reader.readexactly(int(response_headers["content-length"]))
+        return int(status_line.split()[1]), response_headers, body
+
+    async def wait_ready(self) -> None:
+        """Release the fetch and wait for the server to be ready."""
+        self.released.set()
+        for _ in range(100):
+            if self.server.ready:
+                return
+            await asyncio.sleep(0.01)
+        self.fail("Server never got ready")
+
+    async def test_ready(self) -> None:
+        """Devices are only served once every client has been refreshed."""
+        status, _, body = await self.request("/ready")
+        assert status == 503
+        assert json.loads(body) == {
+            "ready": False,
+            "accounts": [{"account": 0, "ready": False, "error": None}],
+        }
+        status, _, _ = await self.request("/devices")
+        assert status == 503
+
+        await self.wait_ready()
+        status, _, body = await self.request("/ready")
+        assert status == 200
+        assert json.loads(body) == {
+            "ready": True,
+            "accounts": [{"account": 0, "ready": True, "error": None}],
+        }
+
+    async def test_failing_account(self) -> None:
+        """An account failing to refresh doesn't block the others."""
+        failing = GLocalAuthenticationTokens(master_token=faker.master_token())
+        patcher = patch.object(failing, "get_homegraph", return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        await self.start_server(
+            TokenServer([self.client, failing], disable_discovery=True)
+        )
+        await self.wait_ready()
+
+        status, _, body = await self.request("/ready")
+        assert status == 200
+        assert json.loads(body)["accounts"][1] == {
+            "account": 1,
+            "ready": False,
+            "error": "Unable to refresh homegraph",
+        }
+        status, _, body = await self.request("/devices")
+        assert status == 200
+        assert len(json.loads(body)) == len(self.homegraph.home.devices)
+
+    async def test_failing_refresh(self) -> None:
+        """Devices are kept while a later refresh of their account fails."""
+        client = GLocalAuthenticationTokens(master_token=faker.master_token())
+        responses = [self.homegraph, None]
+
+        def fetch(_auth_attempts: int = 3) -> object:
+            homegraph = responses.pop(0) if responses else None
+            if homegraph is not None:
+                client.homegraph_devices = project_homegraph(homegraph)
+                # Due for a refresh shortly
+                client.homegraph_expiry = Expiry.in_seconds(TOKEN_REFRESH_MARGIN + 0.05)
+            return homegraph
+
+        patcher = patch.object(client, "get_homegraph", side_effect=fetch)
+        m_get_homegraph = patcher.start()
+        self.addCleanup(patcher.stop)
+        with patch("glocaltokens.scheduler.REFRESH_MIN_INTERVAL", 0.01):
+            await self.start_server(TokenServer([client], disable_discovery=True))
+            for _ in range(100):
+                if not responses:
+                    break
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+
+        status, _, body = await self.request("/ready")
+        assert status == 200
+        assert json.loads(body)["accounts"] == [
+            {"account": 0, "ready": True, "error": "Unable to refresh homegraph"}
+        ]
+        status, _, body = await self.request("/devices")
+        assert status == 200
+        assert len(json.loads(body)) == len(self.homegraph.home.devices)
+        # A failed refresh only fetches once
+        assert m_get_homegraph.call_count == 2
+
+    async def test_rediscovery(self) -> None:
+        """Devices are joined again with the devices of every discovery."""
+        item = self.homegraph.home.devices[0]
+        network_devices: list[NetworkDevice] = []
+        patcher = patch(
+            "glocaltokens.scanner.discover_devices",
+            side_effect=lambda *_args, **_kwargs: list(network_devices),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        await self.start_server(TokenServer([self.client], discovery_interval=0.01))
+        await self.wait_ready()
+        fetches = self.m_get_homegraph.call_count
+
+        address = faker.ipv4()
+        network_devices.append(
+            NetworkDevice(
+                item.device_name,
+                address,
+                8009,
+                item.hardware.model,
+                item.device_info.agent_info.unique_id,
+            )
+        )
+        for _ in range(100):
+            _, _, body = await self.request(f"/devices/{item.device_info.device_id}")
+            if json.loads(body)["network_device"]["ip"] == address:
+                break
+            await asyncio.sleep(0.01)
+        else:
+            self.fail("Discovered address never served")
+        assert self.m_get_homegraph.call_count == fetches
+
+    async def test_devices(self) -> None:
+        """Devices are served from cache with their ETag."""
+        await self.wait_ready()
+        status, headers, body = await self.request("/devices")
+        assert status == 200
+        devices = json.loads(body)
+        assert [device["device_id"] for device in devices] == [
+            item.device_info.device_id for item in self.homegraph.home.devices
+        ]
+
+        # Same connection, unchanged devices
+        status, _, body = await self.request(
+            "/devices", {"If-None-Match": headers["etag"]}
+        )
+        assert status == 304
+        assert body == b""
+
+        status, _, body = await self.request(f"/devices/{devices[0]['device_id']}")
+        assert status == 200
+        assert json.loads(body) == devices[0]
+
+        status, _, _ = await self.request("/devices/unknown")
+        assert status == 404
+        assert self.m_get_homegraph.call_count == 1
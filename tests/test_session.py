@@ -0,0 +1,187 @@
+"""Device session specific tests."""
+
+from __future__ import annotations
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import ssl
+from threading import Thread
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+
+from glocaltokens.client import Device, GLocalAuthenticationTokens
+from glocaltokens.const import LOCAL_AUTH_TOKEN_HEADER
+from glocaltokens.session import DeviceSession
+from glocaltokens.types import NetworkDevice
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+# Self-signed certificate of 127.0.0.1, like the ones of the devices
+CERTIFICATE = str(Path(__file__).parent / "factory" / "device.pem")
+
+
+class DeviceServer(ThreadingHTTPServer):
+    """Local API stand-in accepting a single token."""
+
+    daemon_threads = True
+
+    def __init__(self, token: str):
+        """Listen on a free port of 127.0.0.1 over TLS."""
+        super().__init__(("127.0.0.1", 0), DeviceRequestHandler)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(CERTIFICATE)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.token = token
+        self.connections = 0
+
+
+class DeviceRequestHandler(BaseHTTPRequestHandler):
+    """Answer every GET request with the requested path."""
+
+    protocol_version = "HTTP/1.1"
+    server: DeviceServer
+
+    def setup(self) -> None:
+        """Count the connections."""
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:  # noqa: N802  # pylint: disable=invalid-name
+        """Answer with the path if the token is accepted."""
+        if self.headers[LOCAL_AUTH_TOKEN_HEADER] != self.server.token:
+            self.send_response(401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002  # pylint: disable=redefined-builtin
+        """Don't log requests."""
+
+
+class DeviceSessionTests(TestCase):
+    """DeviceSession tests."""
+
+    def setUp(self) -> None:
+        """Start a device stand-in and a session to it."""
+        self.token = faker.local_auth_token()
+        self.server = DeviceServer(self.token)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.session = DeviceSession(
+            port=self.server.server_address[1], verify=CERTIFICATE
+        )
+        self.addCleanup(self.session.close)
+
+    def create_device(self, local_auth_token: str, device_id: str = "") -> Device:
+        """Create a device at the address of the stand-in."""
+        return Device(
+            device_id=device_id or str(faker.uuid4()),
+            device_name=faker.word(),
+            local_auth_token=local_auth_token,
+            network_device=NetworkDevice(
+                faker.word(), "127.0.0.1", 8009, faker.word(), str(faker.uuid4())
+            ),
+        )
+
+    def test_request_many(self) -> None:
+        """Requests reuse connections and a failing device doesn't stop the others."""
+        devices = [self.create_device(self.token) for _ in range(3)]
+        devices.insert(1, self.create_device(faker.local_auth_token()))
+        for _ in range(2):
+            responses = self.session.request_many(
+                devices, "/setup/eureka_info", max_parallel=1
+            )
+            assert [response.device for response in responses] == devices
+            assert [response.status for response in responses] == [200, 401, 200, 200]
+            assert responses[0].data == {"path": "/setup/eureka_info"}
+            assert responses[1].error == "401 Unauthorized"
+        assert self.server.connections == 1
+
+        # Multi-homed devices are reached on an address accepting connections
+        multi_homed = self.create_device(self.token)
+        assert multi_homed.network_device is not None
+        multi_homed.network_device = multi_homed.network_device._replace(
+            addresses=("127.0.0.2", "127.0.0.1")
+        )
+        assert self.session.request(multi_homed, "/").status == 200
+        assert self.server.connections == 1
+
+        unreachable = self.create_device(self.token)
+        unreachable.ip_address = None
+        assert self.session.request(unreachable, "/").error == "Unknown IP address"
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_rejected_token(
+        self, m_stub: NonCallableMock, m_get_access_token: NonCallableMock
+    ) -> None:
+        """A rejected token is refreshed from the homegraph once."""
+        m_get_access_token.return_value = faker.access_token()
+        item = faker.homegraph_device()
+        old_homegraph = faker.homegraph([item])
+        item.local_auth_token = self.token
+        m_get_homegraph = m_stub.return_value.GetHomeGraph
+        m_get_homegraph.side_effect = [old_homegraph, faker.homegraph([item])]
+
+        client = GLocalAuthenticationTokens(master_token=faker.master_token())
+        homegraph_device = client.get_homegraph_devices()[0]  # type: ignore[index]
+        devices = [
+            self.create_device(
+                homegraph_device.local_auth_token, homegraph_device.device_id
+            )
+            for _ in range(2)
+        ]
+        session = DeviceSession(
+            client, port=self.server.server_address[1], verify=CERTIFICATE
+        )
+        self.addCleanup(session.close)
+
+        # Both are rejected at once, the homegraph is only fetched again once
+        responses = session.request_many(devices, "/setup/eureka_info")
+        assert [response.status for response in responses] == [200, 200]
+        assert all(device.local_auth_token == self.token for device in devices)
+        assert m_get_homegraph.call_count == 2
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens.get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_verify_tokens(
+        self, m_stub: NonCallableMock, m_get_access_token: NonCallableMock
+    ) -> None:
+        """Rejected tokens are reported to the client in a single sweep."""
+        m_get_access_token.return_value = faker.access_token()
+        items = faker.homegraph_devices(count=3)
+        for item in items:
+            item.device_info.device_id = str(faker.uuid4())
+        items[0].local_auth_token = self.token
+        m_stub.return_value.GetHomeGraph.return_value = faker.homegraph(items)
+        client = GLocalAuthenticationTokens(master_token=faker.master_token())
+        devices = [
+            self.create_device(item.local_auth_token, item.device_id)
+            for item in client.get_homegraph_devices() or ()
+        ]
+        devices[2].ip_address = None
+        session = DeviceSession(
+            client, port=self.server.server_address[1], verify=CERTIFICATE
+        )
+        self.addCleanup(session.close)
+
+        checks = session.verify_tokens(devices)
+        assert [check.valid for check in checks] == [True, False, None]
+        assert checks[0].latency is not None
+        assert checks[2].error == "Unknown IP address"
+        rotation = client.token_rotations.get(devices[1].device_id)
+        assert rotation is not None
+        assert rotation.auth_failures == 1
@@ -0,0 +1,130 @@
+"""Sharding specific tests."""
+
+from __future__ import annotations
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+from unittest import TestCase
+from unittest.mock import patch
+
+from faker import Faker
+
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.scheduler import FleetScheduler
+from glocaltokens.sharding import (
+    HashRing,
+    LeaseBackend,
+    MemoryLeaseBackend,
+    ShardCoordinator,
+)
+from glocaltokens.store import TokenStore
+from tests.factory.providers import TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+
+
+class HashRingTests(TestCase):
+    """HashRing tests."""
+
+    def test_node_for(self) -> None:
+        """Adding a node only moves the keys it takes over."""
+        keys = [faker.email() for _ in range(1000)]
+        ring = HashRing(["a", "b", "c"])
+        before = {key: ring.node_for(key) for key in keys}
+        assert set(before.values()) == {"a", "b", "c"}
+
+        ring = HashRing(["a", "b", "c", "d"])
+        moved = [key for key in keys if ring.node_for(key) != before[key]]
+        assert all(ring.node_for(key) == "d" for key in moved)
+        assert 0.1 < len(moved) / len(keys) < 0.4
+
+        assert HashRing().node_for(keys[0]) is None
+
+
+class ShardCoordinatorTests(TestCase):
+    """ShardCoordinator tests, with every backend."""
+
+    def setUp(self) -> None:
+        """Create clients of many accounts."""
+        self.clients = [
+            GLocalAuthenticationTokens(master_token=faker.master_token())
+            for _ in range(20)
+        ]
+
+    def create_backends(self) -> list[LeaseBackend]:
+        """Return a backend of every kind."""
+        tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        store = TokenStore(Path(tmp_dir.name) / "tokens.db")
+        self.addCleanup(store.close)
+        return [MemoryLeaseBackend(), store]
+
+    def create_node(self, backend: LeaseBackend, node_id: str) -> ShardCoordinator:
+        """Create a node tracking every account."""
+        node = ShardCoordinator(backend, FleetScheduler(), node_id)
+        for client in self.clients:
+            node.add(client)
+        return node
+
+    def test_rebalance(self) -> None:
+        """Accounts are handed over between nodes without ever being shared."""
+        for backend in self.create_backends():
+            with self.subTest(backend=type(backend).__name__):
+                first = self.create_node(backend, "first")
+                assert len(first.rebalance()) == len(self.clients)
+                assert first.scheduler is not None
+                assert first.scheduler.stats().scheduled == len(self.clients)
+
+                # Accounts of the new node are still leased by the first one
+                second = self.create_node(backend, "second")
+                assert not second.rebalance()
+                moving = len(self.clients) - len(first.rebalance())
+                assert 0 < moving < len(self.clients)
+                assert first.scheduler.stats().scheduled == len(self.clients) - moving
+                assert len(second.rebalance()) == moving
+                assert not first.owned & second.owned
+
+                # Accounts of a node leaving are taken over
+                second.leave()
+                assert not second.owned
+                assert len(first.rebalance()) == len(self.clients)
+
+                # A removed account is released
+                first.remove(self.clients[0])
+                assert len(first.owned) == len(self.clients) - 1
+                assert first.scheduler.stats().scheduled == len(self.clients) - 1
+
+    def test_release__in_flight(self) -> None:
+        """A lease is only released once the refresh in flight has completed."""
+        backend = MemoryLeaseBackend()
+        node = ShardCoordinator(backend, FleetScheduler(), "first")
+        client = self.clients[0]
+        node.add(client)
+        started, finished = Event(), Event()
+
+        def refresh() -> None:
+            started.set()
+            finished.wait()
+
+        patcher = patch.object(client, "get_homegraph_devices", side_effect=refresh)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        assert node.scheduler is not None
+        (key,) = node.rebalance()
+        node.scheduler.start()
+        self.addCleanup(node.scheduler.stop)
+        self.addCleanup(finished.set)
+        assert started.wait(5)
+
+        thread = Thread(target=node.remove, args=(client,))
+        thread.start()
+        thread.join(0.1)
+        assert thread.is_alive()
+        assert backend.leases("shard:") == {f"shard:{key}": "first"}
+
+        finished.set()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert not backend.leases("shard:")
@@ -0,0 +1,139 @@
+"""Token store specific tests."""
+
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Event, Thread
+import time
+from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
+
+from faker import Faker
+
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.homegraph import project_homegraph
+from glocaltokens.store import TokenStore
+from tests.factory.providers import HomegraphProvider, TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+faker.add_provider(HomegraphProvider)
+
+
+class TokenStoreTests(TestCase):
+    """TokenStore tests.
+
+    Every client gets its own TokenStore on the same file, like clients of
+    different processes.
+    """
+
+    def setUp(self) -> None:
+        """Create a temporary store file."""
+        tmp_dir = TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp_dir.cleanup)
+        self.path = Path(tmp_dir.name) / "tokens.db"
+        self.username = faker.email()
+        self.password = faker.word()
+
+    def open_store(self, **kwargs: float) -> TokenStore:
+        """Open the store file, closing it at the end of the test."""
+        store = TokenStore(self.path, **kwargs)
+        self.addCleanup(store.close)
+        return store
+
+    def create_client(self) -> GLocalAuthenticationTokens:
+        """Create a client of the account with its own store."""
+        return GLocalAuthenticationTokens(
+            username=self.username,
+            password=self.password,
+            master_token=faker.master_token(),
+            store=self.open_store(),
+        )
+
+    def test_file_permissions(self) -> None:
+        """The store is only readable by its owner."""
+        self.open_store()
+        assert self.path.stat().st_mode & 0o777 == 0o600
+
+    def test_lock(self) -> None:
+        """Leases are exclusive until released or expired."""
+        store, other_store = self.open_store(), self.open_store(poll_interval=0.01)
+        released = Event()
+
+        def hold_lease() -> None:
+            with store.lock("account"):
+                acquired.set()
+                time.sleep(0.1)
+                released.set()
+
+        acquired = Event()
+        thread = Thread(target=hold_lease)
+        thread.start()
+        acquired.wait()
+        with other_store.lock("account") as locked:
+            assert locked
+            assert released.is_set()
+        thread.join()
+
+        # Leases of crashed processes expire
+        with self.open_store(lease_duration=0.1).lock("crashed"):
+            with self.open_store(lock_timeout=0).lock("crashed") as locked:
+                assert not locked
+            time.sleep(0.1)
+            with self.open_store(lock_timeout=1).lock("crashed") as locked:
+                assert locked
+
+    @patch("gpsoauth.perform_oauth")
+    def test_shared_access_token(self, m_perform_oauth: NonCallableMock) -> None:
+        """The access token is fetched by the first client only."""
+        m_perform_oauth.side_effect = lambda *_args, **_kwargs: {
+            "Auth": faker.access_token(),
+            "ExpiresInDurationSec": "3600",
+        }
+        client, other_client = self.create_client(), self.create_client()
+
+        access_token = client.get_access_token()
+        assert other_client.get_access_token() == access_token
+        assert m_perform_oauth.call_count == 1
+
+        # A rejected token is not used again
+        other_client.invalidate_access_token()
+        assert other_client.get_access_token() != access_token
+        assert m_perform_oauth.call_count == 2
+
+    @patch("glocaltokens.client.GLocalAuthenticationTokens._get_access_token")
+    @patch("ghome_foyer_api.api_pb2_grpc.StructuresServiceStub")
+    def test_shared_homegraph(
+        self,
+        m_structure_service_stub: NonCallableMock,
+        m_get_access_token: NonCallableMock,
+    ) -> None:
+        """Clients waiting for the lease use the homegraph of the first one."""
+        m_get_access_token.return_value = faker.access_token()
+        homegraph = faker.homegraph()
+
+        def get_homegraph(_request: object) -> object:
+            time.sleep(0.1)
+            return homegraph
+
+        m_get_homegraph = m_structure_service_stub.return_value.GetHomeGraph
+        m_get_homegraph.side_effect = get_homegraph
+        clients = [self.create_client() for _ in range(8)]
+
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            results = list(
+                executor.map(lambda client: client.get_homegraph_devices(), clients)
+            )
+        assert m_get_homegraph.call_count == 1
+        assert all(devices == project_homegraph(homegraph) for devices in results)
+
+        # A device rejecting its token makes the client fetch it again
+        assert clients[0].report_auth_failure(
+            homegraph.home.devices[0].device_info.device_id
+        )
+        clients[0].get_homegraph_devices()
+        assert m_get_homegraph.call_count == 2
+        clients[1].get_homegraph_devices()
+        assert m_get_homegraph.call_count == 2
@@ -0,0 +1,112 @@
+"""Auth transport specific tests."""
+
+from __future__ import annotations
+
+from unittest import TestCase
+from unittest.mock import MagicMock, NonCallableMock, patch
+
+from faker import Faker
+from gpsoauth import AUTH_URL, perform_master_login, perform_oauth
+from requests import ConnectionError as RequestsConnectionError, Session
+
+from glocaltokens.client import GLocalAuthenticationTokens
+from glocaltokens.const import (
+    ACCESS_TOKEN_APP_NAME,
+    ACCESS_TOKEN_CLIENT_SIGNATURE,
+    ACCESS_TOKEN_SERVICE,
+)
+from glocaltokens.transport import AuthTransport
+from tests.factory.providers import TokenProvider
+
+faker = Faker()
+faker.add_provider(TokenProvider)
+
+
+class AuthTransportTests(TestCase):
+    """AuthTransport tests."""
+
+    def setUp(self) -> None:
+        """Set up a transport with a mocked session."""
+        self.session = MagicMock(spec=Session)
+        self.session.headers = {}
+        self.transport = AuthTransport(session=self.session, pool_size=4)
+
+    def test_session(self) -> None:
+        """The session is configured like gpsoauth's with a connection pool."""
+        with AuthTransport(pool_size=4) as transport:
+            adapter = transport.session.get_adapter(AUTH_URL)
+            assert adapter.poolmanager.connection_pool_kw["maxsize"] == 4  # type: ignore[attr-defined]
+            assert transport.session.headers["User-Agent"] == "GoogleAuth/1.4"
+
+    def test_perform_auth_request(self) -> None:
+        """Responses are parsed and connection errors logged."""
+        token = faker.access_token()
+        self.session.post.return_value.text = f"Auth={token}\nExpiry=1\n"
+        assert self.transport.perform_auth_request({"Email": "a"}) == {
+            "Auth": token,
+            "Expiry": "1",
+        }
+        self.session.post.assert_called_once_with(
+            AUTH_URL, data={"Email": "a"}, timeout=self.transport.timeout
+        )
+
+        self.session.post.side_effect = RequestsConnectionError()
+        with self.assertLogs("glocaltokens.transport", "ERROR"):
+            assert not self.transport.perform_auth_request({})
+
+    @patch("gpsoauth._perform_auth_request")
+    def test_same_requests_as_gpsoauth(
+        self, m_perform_auth_request: NonCallableMock
+    ) -> None:
+        """Requests have the same form data as gpsoauth ones."""
+        self.session.post.return_value.text = ""
+        email, android_id = faker.email(), faker.word()
+
+        perform_oauth(
+            email,
+            faker.master_token(),
+            android_id,
+            service=ACCESS_TOKEN_SERVICE,
+            app=ACCESS_TOKEN_APP_NAME,
+            client_sig=ACCESS_TOKEN_CLIENT_SIGNATURE,
+        )
+        master_token = m_perform_auth_request.call_args.args[0]["EncryptedPasswd"]
+        self.transport.perform_oauth(
+            email,
+            master_token,
+            android_id,
+            service=ACCESS_TOKEN_SERVICE,
+            app=ACCESS_TOKEN_APP_NAME,
+            client_sig=ACCESS_TOKEN_CLIENT_SIGNATURE,
+        )
+        assert (
+            self.session.post.call_args.kwargs["data"]
+            == m_perform_auth_request.call_args.args[0]
+        )
+
+        perform_master_login(email, faker.word(), android_id)
+        self.transport.perform_master_login(email, faker.word(), android_id)
+        expected = m_perform_auth_request.call_args.args[0]
+        data = self.session.post.call_args.kwargs["data"]
+        # The encrypted password is randomized
+        assert data.keys() == expected.keys()
+        del data["EncryptedPasswd"], expected["EncryptedPasswd"]
+        assert data == expected
+
+    @patch("gpsoauth.perform_oauth")
+    def test_client_uses_transport(self, m_perform_oauth: NonCallableMock) -> None:
+        """Clients with a transport don't open connections of their own."""
+        self.session.post.return_value.text = f"Auth={faker.access_token()}\n"
+        clients = [
+            GLocalAuthenticationTokens(
+                username=faker.email(),
+                password=faker.word(),
+                master_token=faker.master_token(),
+                transport=self.transport,
+            )
+            for _ in range(3)
+        ]
+        for client in clients:
+            assert client.get_access_token() is not None
+        assert self.session.post.call_count == 3
+        assert m_perform_oauth.call_count == 0
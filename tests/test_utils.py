@@ -1,10 +1,29 @@
 """Utility tests."""
 
+import asyncio
+import logging
+from pathlib import Path
+import socket
+from tempfile import TemporaryDirectory
+import time
 from unittest import TestCase
+from unittest.mock import NonCallableMock, patch
 
 from faker import Faker
+import pytest
 
-from glocaltokens.utils.logs import censor
+from glocaltokens.const import (
+    DISCOVERY_MARGIN,
+    DISCOVERY_STATS_MIN_SAMPLES,
+    DISCOVERY_STEP_UP,
+)
+from glocaltokens.utils.discovery_stats import DiscoverySample, DiscoveryStats
+from glocaltokens.utils.dns import DNSCache
+from glocaltokens.utils.expiry import Expiry
+from glocaltokens.utils.logs import Censored, RateLimitFilter, censor
+from glocaltokens.utils.network import is_valid_hostname, select_address
+from glocaltokens.utils.profiling import active_report, profile, timed
+from glocaltokens.utils.token import oauth_lifetime
 
 faker = Faker()
 
@@ -33,3 +52,132 @@ class UtilsTests(TestCase):
 
         # Hide both
         assert censor("abc", hide_first_letter=True, hide_length=True) == "<redacted>"
+
+    def test_censored(self) -> None:
+        """Testing lazy censoring."""
+        assert str(Censored("abc")) == censor("abc")
+        assert str(Censored("abc", hide_length=True)) == "a<redacted>"
+        assert str(Censored(None)) == "None"
+        with patch("glocaltokens.utils.logs.censor") as m_censor:
+            logging.getLogger(__name__).debug("Token: %s", Censored("abc"))
+        assert m_censor.call_count == 0
+
+    @patch("glocaltokens.utils.logs.time")
+    def test_rate_limit_filter(self, m_time: NonCallableMock) -> None:
+        """Testing repeated log messages are rate limited."""
+        m_time.monotonic.return_value = 0
+        rate_limit = RateLimitFilter(burst=2, interval=60)
+
+        def record(msg: str, level: int = logging.WARNING) -> logging.LogRecord:
+            return logging.LogRecord(
+                __name__, level, __file__, 0, msg, (faker.word(),), None
+            )
+
+        assert rate_limit.filter(record("%s failed"))
+        assert rate_limit.filter(record("%s failed"))
+        assert not rate_limit.filter(record("%s failed"))
+        assert not rate_limit.filter(record("%s failed"))
+        # Other messages, debug and error records are not limited
+        assert rate_limit.filter(record("%s succeeded"))
+        assert rate_limit.filter(record("%s failed", logging.DEBUG))
+        assert rate_limit.filter(record("%s failed", logging.ERROR))
+
+        m_time.monotonic.return_value = 60
+        passed = record("%s failed")
+        assert rate_limit.filter(passed)
+        assert passed.msg == "%s failed (2 similar messages suppressed)"
+        assert rate_limit.filter(record("%s failed"))
+        assert not rate_limit.filter(record("%s failed"))
+
+    def test_oauth_lifetime(self) -> None:
+        """Testing access token lifetime parsing."""
+        default = faker.pyint()
+        assert oauth_lifetime({"ExpiresInDurationSec": "3599"}, default) == 3599
+        expiry = str(int(time.time()) + 1800)
+        assert 1795 < oauth_lifetime({"Expiry": expiry}, default) <= 1800
+        assert oauth_lifetime({}, default) == default
+        assert oauth_lifetime({"ExpiresInDurationSec": "soon"}, default) == default
+
+    def test_expiry(self) -> None:
+        """Testing monotonic expiry."""
+        expiry = Expiry.in_seconds(60)
+        assert 59 < expiry.remaining() <= 60
+        assert not expiry.has_expired()
+        assert expiry.has_expired(margin=60)
+        assert Expiry.in_seconds(-1).has_expired()
+
+    @patch("glocaltokens.utils.dns.socket.getaddrinfo")
+    def test_dns_cache(self, m_getaddrinfo: NonCallableMock) -> None:
+        """Host names are looked up once per ttl, addresses never."""
+        address = faker.ipv4()
+        m_getaddrinfo.return_value = [(0, 0, 0, "", (address, 0))]
+        cache = DNSCache(ttl=0.05)
+        ipv6_address = faker.ipv6()
+        for _ in range(2):
+            assert cache.resolve_many(["a.lan", "a.lan", ipv6_address]) == {
+                "a.lan": address,
+                ipv6_address: ipv6_address,
+            }
+        assert m_getaddrinfo.call_count == 1
+
+        time.sleep(0.05)
+        assert asyncio.run(cache.async_resolve_many(["a.lan"])) == {"a.lan": address}
+        assert m_getaddrinfo.call_count == 2
+
+        assert is_valid_hostname("kitchen-speaker.home.arpa.")
+        assert not is_valid_hostname("-kitchen.lan")
+        assert not is_valid_hostname("kitchen..lan")
+
+    def test_select_address(self) -> None:
+        """The first address accepting a connection is selected."""
+        with socket.create_server(("127.0.0.1", 0)) as server:
+            port = server.getsockname()[1]
+            # Nothing listens on 127.0.0.2, it is refused right away
+            assert select_address(["127.0.0.2", "127.0.0.1"], port) == "127.0.0.1"
+            assert select_address(["127.0.0.2"], port) == "127.0.0.2"
+        assert select_address(["127.0.0.2", "127.0.0.3"], port, timeout=1) is None
+
+    def test_discovery_stats(self) -> None:
+        """The discovery window follows the response times of the network."""
+        with TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "stats.json"
+            stats = DiscoveryStats(path)
+            for _ in range(DISCOVERY_STATS_MIN_SAMPLES):
+                assert stats.timeout("lan", default=2) == 2
+                stats.record("lan", DiscoverySample(0.1, 0.5, 3))
+            assert stats.timeout("lan") == 0.5 + DISCOVERY_MARGIN
+            assert stats.timeout("other", default=2) == 2
+            assert stats.expected_devices("lan") == 3
+
+            # Devices were missed, the next window is one step longer
+            incomplete = DiscoverySample(0.1, 0.7, 2, complete=False)
+            stats.record("lan", incomplete)
+            window = (0.7 + DISCOVERY_MARGIN) * DISCOVERY_STEP_UP
+            assert stats.timeout("lan") == pytest.approx(window)
+            assert stats.samples("lan")[-1] == incomplete
+            # Further misses don't stretch it again
+            stats.record("lan", incomplete)
+            assert stats.timeout("lan") == pytest.approx(window)
+            # And it decays once every device responds again
+            stats.record("lan", DiscoverySample(0.1, 0.5, 3))
+            assert stats.timeout("lan") == 0.7 + DISCOVERY_MARGIN
+
+            stats.save()
+            assert DiscoveryStats(path).samples("lan") == stats.samples("lan")
+
+    def test_profile(self) -> None:
+        """Testing stage timings are only recorded while profiling."""
+        with timed("ignored"):
+            pass
+        with profile() as report:
+            assert active_report() is report
+            with timed("oauth"):
+                pass
+            with pytest.raises(ValueError, match="refused"), timed("oauth", "retry"):
+                raise ValueError("refused")
+        assert active_report() is None
+        assert [timing.stage for timing in report.stages] == ["oauth", "oauth"]
+        assert [timing.failed for timing in report.stages] == [False, True]
+        assert report.stages[1].detail == "retry"
+        assert set(report.totals()) == {"oauth"}
+        assert report.as_list()[0]["stage"] == "oauth"